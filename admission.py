@@ -0,0 +1,147 @@
+# admission.py
+"""
+Controle de admissão do /api/chat: limite de taxa por chave (token bucket por
+user_id e por IP) e limites de concorrência com fila de espera limitada — um
+global para as requisições do chat e um menor para as chamadas à IA.
+
+Quem passa do limite recebe a recusa na hora (Overloaded, que vira 429/503 com
+Retry-After) em vez de ocupar uma thread do gunicorn e conexões do banco. Os
+limites valem por processo: com N workers, a capacidade total é N vezes a
+configurada (com workers sync de uma thread, o limite de concorrência só faz
+diferença para as threads do worker gthread).
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import ADMISSION_DECISIONS, ADMISSION_WAIT_SECONDS
+from user_cache import TTLCache
+
+
+class Overloaded(Exception):
+    """Requisição recusada; `status` é 429 (taxa) ou 503 (capacidade)"""
+
+    def __init__(self, limiter, reason, retry_after, status=503):
+        super().__init__(f"{limiter}: {reason}")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status = status
+
+
+class RateLimiter:
+    """
+    Token bucket por chave: `rate` fichas por segundo, acumulando até `burst`.
+    Baldes parados por burst/rate segundos já estariam cheios, então expiram.
+    """
+
+    def __init__(self, name, rate, burst, max_keys=100000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate deve ser positivo e burst pelo menos 1")
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._buckets = TTLCache(max_size=max_keys, ttl=burst / rate)  # chave -> (fichas, instante)
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Consome uma ficha da chave ou levanta Overloaded (429) com o tempo até a próxima"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets.set(key, (tokens, now))
+        if not allowed:
+            ADMISSION_DECISIONS.inc(limiter=self.name, outcome='rate_limited')
+            raise Overloaded(self.name, 'limite de taxa', (1 - tokens) / self.rate, status=429)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class Permit:
+    """Vaga ocupada num ConcurrencyLimiter; release() pode ser chamado mais de uma vez"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.acquired_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        self.limiter._release(self)
+
+
+class ConcurrencyLimiter:
+    """
+    Até `limit` execuções simultâneas; as seguintes esperam até `timeout` segundos
+    numa fila de no máximo `max_queue` (cheia, a recusa é imediata). O Retry-After
+    sugerido vem da duração média das execuções (média móvel) e do tamanho da fila.
+    """
+
+    def __init__(self, name, limit, max_queue=0, timeout=0.0):
+        if limit < 1:
+            raise ValueError("limit deve ser pelo menos 1")
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._avg_hold = 1.0
+        self._cond = threading.Condition()
+
+    def _retry_after(self):
+        return self._avg_hold * (self.waiting + 1) / self.limit
+
+    def acquire(self):
+        """Ocupa uma vaga (esperando na fila, se houver lugar) e devolve o Permit, ou levanta Overloaded (503)"""
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                ADMISSION_DECISIONS.inc(limiter=self.name, outcome='accepted')
+                return Permit(self)
+            if self.waiting >= self.max_queue:
+                ADMISSION_DECISIONS.inc(limiter=self.name, outcome='shed')
+                raise Overloaded(self.name, 'fila cheia', self._retry_after())
+            self.waiting += 1
+            start = time.monotonic()
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.limit, self.timeout)
+            finally:
+                self.waiting -= 1
+            ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start, limiter=self.name)
+            if not admitted:
+                # Pode ter recebido o aviso de uma vaga junto com o timeout: repassa
+                self._cond.notify()
+                ADMISSION_DECISIONS.inc(limiter=self.name, outcome='timeout')
+                raise Overloaded(self.name, 'tempo de espera esgotado', self._retry_after())
+            self.active += 1
+            ADMISSION_DECISIONS.inc(limiter=self.name, outcome='queued')
+            return Permit(self)
+
+    def _release(self, permit):
+        with self._cond:
+            if permit.released:
+                return
+            permit.released = True
+            self.active -= 1
+            # O tempo de ocupação alimenta a estimativa do Retry-After
+            self._avg_hold += 0.1 * (time.monotonic() - permit.acquired_at - self._avg_hold)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        permit = self.acquire()
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    def stats(self):
+        return {'active': self.active, 'waiting': self.waiting, 'limit': self.limit,
+                'max_queue': self.max_queue, 'avg_hold_seconds': round(self._avg_hold, 3)}
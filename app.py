@@ -5,14 +5,35 @@ Backend Flask com MySQL — Inteligência Contextual + Aprendizado Ativo
 Deploy seguro no Render via GitHub
 """
 
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
-import mysql.connector
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, g, has_app_context, Response, \
+    stream_with_context
 from mysql.connector import Error
 import os
+import hmac
 from dotenv import load_dotenv
 import logging
-import re
-from datetime import datetime
+import json
+import time
+from datetime import datetime, timedelta
+from knowledge_index import KnowledgeIndex
+from kb_snapshot import SnapshotPublisher, SnapshotWatcher
+from admission import RateLimiter, ConcurrencyLimiter, Overloaded
+from llm_client import LLMClient
+from db_pool import ConnectionPool, PoolTimeoutError
+from write_behind import WriteBehindLogger, STATEMENTS as LOG_STATEMENTS
+from user_cache import UserStateCache
+from llm_cache import LLMAnswerCache
+from intent_rules import load_rules, DEFAULT_RULES_PATH
+from history_store import HistoryStore, new_session_id
+from metrics_rollup import MetricsRollup
+from unknown_tracker import UnknownQuestionTracker
+from question_clusters import QuestionClusterer
+from kb_keywords import extract_keywords
+import kb_bulk
+import storage
+import export
+import instrumentation
+from instrumentation import span, record_tier
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -35,15 +56,254 @@ DB_CONFIG = {
     "collation": 'utf8mb4_unicode_ci'
 }
 
+# Backend de armazenamento: mysql (padrão) ou sqlite (arquivo embutido, sem servidor)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mysql')
+repository_for = storage.repository_class(STORAGE_BACKEND)
+connect_db = None
+if STORAGE_BACKEND == 'sqlite':
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'data/ednna.db')
+    storage.create_sqlite_schema(SQLITE_PATH)
+
+    def connect_db():
+        return storage.SQLiteConnection(SQLITE_PATH)
+
+
+# Pool de conexões (um por worker)
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    size=int(os.getenv('DB_POOL_SIZE', 5)),
+    max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', 10)),
+    timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)),
+    pre_ping=os.getenv('DB_POOL_PRE_PING', '1') == '1',
+    cursor_wrapper=instrumentation.InstrumentedCursor,
+    connect=connect_db
+)
+
 
 def get_db_connection():
-    """Estabelece conexão com o banco de dados"""
+    """
+    Devolve a conexão do pool associada à requisição atual.
+    Todas as rotas e funções auxiliares da mesma requisição compartilham a conexão,
+    que volta ao pool no teardown do app context.
+    """
+    if has_app_context() and g.get('db_conn') is not None:
+        return g.db_conn
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        return connection
-    except Error as e:
-        logger.error(f"Erro ao conectar ao MySQL: {e}")
+        connection = db_pool.acquire()
+    except (Error, PoolTimeoutError) as e:
+        logger.error(f"Erro ao conectar ao banco ({STORAGE_BACKEND}): {e}")
         return None
+    if has_app_context():
+        g.db_conn = connection
+    return connection
+
+
+# Cache do estado por usuário (users, user_profiles, conversa ativa)
+user_cache = UserStateCache(
+    max_size=int(os.getenv('USER_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('USER_CACHE_TTL', 300))
+)
+
+# Log assíncrono (write-behind) de mensagens e pares de auditoria — opcional
+write_behind = None
+if os.getenv('ASYNC_LOGGING', '0') == '1':
+    write_behind = WriteBehindLogger(
+        db_pool.acquire,
+        max_queue=int(os.getenv('ASYNC_LOGGING_QUEUE_SIZE', 10000)),
+        batch_size=int(os.getenv('ASYNC_LOGGING_BATCH_SIZE', 200)),
+        flush_interval=float(os.getenv('ASYNC_LOGGING_FLUSH_INTERVAL', 0.5)),
+        spill_path=os.getenv('ASYNC_LOGGING_SPILL_PATH', 'data/write_behind_spill.jsonl')
+    ).start()
+
+
+# Contadores por minuto/hora/dia para o dashboard
+metrics_rollup = MetricsRollup(
+    db_pool.acquire,
+    flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 10)),
+    compact_interval=float(os.getenv('METRICS_COMPACT_INTERVAL', 600))
+).start()
+
+# Perguntas sem resposta: deduplicação em memória e contagem descarregada em lote
+unknown_tracker = UnknownQuestionTracker(
+    db_pool.acquire,
+    repository_for,
+    window=int(os.getenv('UNKNOWN_DEDUP_WINDOW', 3600)),
+    max_size=int(os.getenv('UNKNOWN_DEDUP_SIZE', 50000)),
+    flush_interval=float(os.getenv('UNKNOWN_FLUSH_INTERVAL', 5))
+).start()
+
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        conn.close()
+
+
+# Instrumentação: rastro por requisição (etapas, consultas) exposto em /metrics
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_MS', 0)) / 1000
+# Token do coletor (Authorization: Bearer ...); sem ele, só o admin logado vê /metrics
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+
+@app.before_request
+def start_request_trace():
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace = instrumentation.start_trace(route)
+
+
+@app.after_request
+def record_response_status(response):
+    trace = g.get('trace')
+    if trace is not None:
+        trace.status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(exc):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        instrumentation.finish_trace(trace, request.method, trace.status or 500, SLOW_REQUEST_SECONDS)
+
+
+# Ollama (IA generativa)
+OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3.2')
+OLLAMA_STREAM_TIMEOUT = float(os.getenv('OLLAMA_STREAM_TIMEOUT', 120))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', 5))
+# Prazo da resposta completa no modo sem streaming
+OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', 10))
+
+# Controle de admissão do /api/chat (limites por worker; taxa 0 desliga o limite)
+CHAT_RATE_PER_USER = float(os.getenv('CHAT_RATE_PER_USER', 1))
+CHAT_BURST_PER_USER = int(os.getenv('CHAT_BURST_PER_USER', 10))
+CHAT_RATE_PER_IP = float(os.getenv('CHAT_RATE_PER_IP', 5))
+CHAT_BURST_PER_IP = int(os.getenv('CHAT_BURST_PER_IP', 30))
+# Atrás do proxy do Render o IP do cliente vem no X-Forwarded-For
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', '0') == '1'
+chat_user_limiter = RateLimiter('chat_user', CHAT_RATE_PER_USER, CHAT_BURST_PER_USER) \
+    if CHAT_RATE_PER_USER > 0 else None
+chat_ip_limiter = RateLimiter('chat_ip', CHAT_RATE_PER_IP, CHAT_BURST_PER_IP) if CHAT_RATE_PER_IP > 0 else None
+# Os limites do chat saem das threads do worker (startup.txt: --threads ${GUNICORN_THREADS:-16}):
+# em execução fica abaixo do total de threads e a fila cabe nas que sobram; acima disso
+# a requisição esperaria pelo gunicorn, fora do alcance da fila e do timeout
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS') or 16)
+CHAT_MAX_CONCURRENCY = int(os.getenv('CHAT_MAX_CONCURRENCY') or max(1, GUNICORN_THREADS * 3 // 4))
+if GUNICORN_THREADS > 1 and CHAT_MAX_CONCURRENCY >= GUNICORN_THREADS:
+    logger.warning(f"CHAT_MAX_CONCURRENCY={CHAT_MAX_CONCURRENCY} não é menor que GUNICORN_THREADS="
+                   f"{GUNICORN_THREADS}; usando {GUNICORN_THREADS - 1}")
+    CHAT_MAX_CONCURRENCY = GUNICORN_THREADS - 1
+CHAT_MAX_QUEUE = int(os.getenv('CHAT_MAX_QUEUE') or max(0, GUNICORN_THREADS - CHAT_MAX_CONCURRENCY))
+if CHAT_MAX_QUEUE > max(0, GUNICORN_THREADS - CHAT_MAX_CONCURRENCY):
+    logger.warning(f"CHAT_MAX_QUEUE={CHAT_MAX_QUEUE} maior que as threads livres; usando "
+                   f"{max(0, GUNICORN_THREADS - CHAT_MAX_CONCURRENCY)}")
+    CHAT_MAX_QUEUE = max(0, GUNICORN_THREADS - CHAT_MAX_CONCURRENCY)
+chat_slots = ConcurrencyLimiter(
+    'chat',
+    limit=CHAT_MAX_CONCURRENCY,
+    max_queue=CHAT_MAX_QUEUE,
+    timeout=float(os.getenv('CHAT_QUEUE_TIMEOUT', 2))
+)
+llm_slots = ConcurrencyLimiter(
+    'llm',
+    limit=int(os.getenv('LLM_MAX_CONCURRENCY', 4)),
+    max_queue=int(os.getenv('LLM_MAX_QUEUE', 8)),
+    timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', 5))
+)
+
+# Cliente do Ollama: sessão com keep-alive, gerações no limite do llm_slots e
+# pedidos simultâneos da mesma pergunta normalizada acompanhando uma só geração
+llm_client = LLMClient(
+    OLLAMA_URL,
+    OLLAMA_MODEL,
+    llm_slots,
+    timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_STREAM_TIMEOUT),
+    retries=int(os.getenv('OLLAMA_RETRIES', 2)),
+    backoff=float(os.getenv('OLLAMA_RETRY_BACKOFF', 0.5))
+)
+
+# Cache das respostas da IA (memória + disco)
+llm_cache = LLMAnswerCache(
+    path=os.getenv('LLM_CACHE_PATH', 'data/llm_cache.sqlite3'),
+    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', 50000)),
+    ttl=int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600)),
+    memory_size=int(os.getenv('LLM_CACHE_MEMORY_SIZE', 2000))
+)
+
+# Regras de intenção (saudações, despedidas, temas, ERPs, normalização, perfil)
+intent_rules = load_rules(os.getenv('INTENT_RULES_PATH', DEFAULT_RULES_PATH))
+
+
+def normalize_message(message):
+    """Normalização de termos (mesma usada na busca e na chave do cache da IA)"""
+    return intent_rules.normalize(message)
+
+
+# Histórico de conversa no servidor (o cookie leva só o id da sessão)
+# Com mais de um worker, turnos seguidos da mesma sessão podem cair em workers
+# diferentes: o SQLite compartilhado é o padrão e só pode ser desligado (valor
+# vazio) com um worker só
+HISTORY_BACKING_PATH = os.getenv('HISTORY_BACKING_PATH', 'data/history.sqlite3')
+if not HISTORY_BACKING_PATH and int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+    raise RuntimeError("HISTORY_BACKING_PATH vazio exige WEB_CONCURRENCY=1 (histórico só na memória do worker)")
+history_store = HistoryStore(
+    max_turns=int(os.getenv('HISTORY_MAX_TURNS', 20)),
+    idle_ttl=int(os.getenv('HISTORY_IDLE_TTL', 3600)),
+    max_sessions=int(os.getenv('HISTORY_MAX_SESSIONS', 50000)),
+    backing_path=HISTORY_BACKING_PATH or None
+)
+
+# Índice da knowledge_base (um por worker), sobre o snapshot mapeado comum aos workers
+KB_INDEX_REFRESH_SECONDS = int(os.getenv('KB_INDEX_REFRESH_SECONDS', 300))
+KB_SNAPSHOT_PATH = os.getenv('KB_SNAPSHOT_PATH', 'data/kb_snapshot.bin')
+# Entradas em memória por cima do snapshot a partir das quais ele é regravado
+KB_SNAPSHOT_MAX_OVERLAY = int(os.getenv('KB_SNAPSHOT_MAX_OVERLAY', 500))
+# Identidade do banco gravada no snapshot: um arquivo de outro banco é recusado
+KB_SOURCE = f"sqlite://{os.path.abspath(SQLITE_PATH)}" if STORAGE_BACKEND == 'sqlite' else \
+    f"mysql://{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+kb_index = KnowledgeIndex()
+kb_snapshot_watcher = None
+kb_snapshot_publisher = None
+if KB_SNAPSHOT_PATH:
+    kb_snapshot_watcher = SnapshotWatcher(KB_SNAPSHOT_PATH,
+                                          interval=float(os.getenv('KB_SNAPSHOT_CHECK_SECONDS', 2)))
+    kb_snapshot_publisher = SnapshotPublisher(KB_SNAPSHOT_PATH, db_pool.acquire, repository_for,
+                                              source=KB_SOURCE).start()
+
+
+def publish_kb_snapshot():
+    """Pede a regravação do snapshot (em segundo plano) depois de alterar a knowledge_base"""
+    if kb_snapshot_publisher is not None:
+        kb_snapshot_publisher.request()
+
+
+def get_knowledge_index(connection=None):
+    """Devolve o índice da knowledge_base, carregando ou sincronizando quando necessário"""
+    remapped = False
+    if kb_snapshot_watcher is not None:
+        snapshot = kb_snapshot_watcher.poll(kb_index.snapshot, force=kb_index.loaded_at is None)
+        if snapshot is not None:
+            remapped = kb_index.attach_snapshot(snapshot, source=KB_SOURCE)
+    stale = kb_index.loaded_at is None or time.time() - kb_index.loaded_at > KB_INDEX_REFRESH_SECONDS
+    if not stale and not remapped:
+        return kb_index
+    conn = connection or get_db_connection()
+    if not conn:
+        return kb_index
+    try:
+        if kb_index.loaded_at is None:
+            kb_index.load_from_db(repository_for(conn))
+            publish_kb_snapshot()
+        else:
+            # Depois de mapear um snapshot, traz na hora o que mudou desde que ele foi gravado
+            kb_index.refresh_from_db(repository_for(conn))
+            if kb_index.snapshot is not None and kb_index.overlay_size > KB_SNAPSHOT_MAX_OVERLAY:
+                publish_kb_snapshot()
+    except Error as e:
+        logger.error(f"Erro ao carregar índice da knowledge_base: {e}")
+    return kb_index
 
 
 @app.route('/')
@@ -51,63 +311,236 @@ def index():
     return render_template('index.html')
 
 
+DB_POOL_CONNECTIONS = instrumentation.REGISTRY.register(instrumentation.Gauge(
+    'ednna_db_pool_connections', 'Conexões do pool por estado', ('state',)))
+QUEUE_SIZE = instrumentation.REGISTRY.register(instrumentation.Gauge(
+    'ednna_queue_size', 'Itens em memória por estrutura', ('queue',)))
+
+
+def collect_runtime_gauges():
+    pool = db_pool.stats()
+    DB_POOL_CONNECTIONS.set(pool['in_use'], state='in_use')
+    DB_POOL_CONNECTIONS.set(pool['idle'], state='idle')
+    QUEUE_SIZE.set(len(history_store), queue='history_sessions')
+    if write_behind:
+        QUEUE_SIZE.set(write_behind.queue_size(), queue='write_behind')
+    for limiter in (chat_slots, llm_slots):
+        instrumentation.ADMISSION_SLOTS.set(limiter.active, limiter=limiter.name, state='active')
+        instrumentation.ADMISSION_SLOTS.set(limiter.waiting, limiter=limiter.name, state='waiting')
+
+
+instrumentation.REGISTRY.add_collector(collect_runtime_gauges)
+
+
+@app.route('/metrics')
+def metrics():
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    authorized = session.get('admin_logged_in') or \
+        (METRICS_TOKEN and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()))
+    if not authorized:
+        return jsonify({'error': 'Acesso negado'}), 401
+    return Response(instrumentation.REGISTRY.render(), content_type=instrumentation.CONTENT_TYPE)
+
+
 @app.route('/api/health')
 def health_check():
     try:
         conn = get_db_connection()
         status = 'healthy' if conn and conn.is_connected() else 'degraded'
-        if conn:
-            conn.close()
-        return jsonify({'status': status}), 200
+        payload = {'status': status, 'db_pool': db_pool.stats(), 'user_cache': user_cache.stats(),
+                   'llm_cache': llm_cache.metrics(), 'history': history_store.metrics()}
+        if write_behind:
+            payload['write_behind'] = dict(write_behind.stats, queued=write_behind.queue_size())
+        payload['admission'] = {'chat': chat_slots.stats(), 'llm': llm_slots.stats()}
+        payload['llm_client'] = dict(llm_client.stats, in_flight=llm_client.in_flight())
+        snapshot = kb_index.snapshot
+        payload['kb_index'] = {'entries': len(kb_index), 'overlay': kb_index.overlay_size,
+                               'snapshot_version': snapshot.version if snapshot is not None else None}
+        if kb_snapshot_publisher is not None:
+            payload['kb_index']['publisher'] = kb_snapshot_publisher.stats
+        return jsonify(payload), 200
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
 
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
+def read_chat_request():
+    """Valida o corpo do /api/chat: devolve (mensagem, user_id, None) ou (None, None, resposta de erro)"""
+    data = request.get_json()
+    if not data:
+        return None, None, (jsonify({'error': 'JSON inválido'}), 400)
+    user_message = data.get('message', '').strip()
+
+    DEFAULT_USER_ID = 99
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'JSON inválido'}), 400
-        user_message = data.get('message', '').strip()
-        
-        DEFAULT_USER_ID = 99
-        try:
-            user_id = int(data.get('user_id', DEFAULT_USER_ID))
-        except (ValueError, TypeError):
-            user_id = DEFAULT_USER_ID
-        
+        user_id = int(data.get('user_id', DEFAULT_USER_ID))
+    except (ValueError, TypeError):
+        user_id = DEFAULT_USER_ID
+
+    with span('ensure_user'):
         if not ensure_user_exists(user_id):
             user_id = DEFAULT_USER_ID
 
-        if not user_message:
-            return jsonify({'error': 'Mensagem vazia'}), 400
+    if not user_message:
+        return None, None, (jsonify({'error': 'Mensagem vazia'}), 400)
+    return user_message, user_id, None
+
+
+def client_ip():
+    if RATE_LIMIT_TRUST_PROXY and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'desconhecido'
+
+
+def admit_chat():
+    """Limites de taxa por IP e por user_id, antes de qualquer acesso ao banco (Overloaded se estourar)"""
+    if chat_ip_limiter is not None:
+        chat_ip_limiter.check(client_ip())
+    data = request.get_json(silent=True)
+    user_id = data.get('user_id') if isinstance(data, dict) else None
+    if chat_user_limiter is not None and user_id is not None:
+        chat_user_limiter.check(str(user_id))
+
+
+def overloaded_response(e):
+    """429 (taxa) ou 503 (capacidade) com Retry-After"""
+    response = jsonify({'error': 'Muitas requisições, tente novamente em instantes', 'retry_after': e.retry_after})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def get_history_id():
+    """Id da sessão de histórico guardado no cookie (descarta o histórico antigo do cookie)"""
+    session.pop('conversation_history', None)
+    if 'history_id' not in session:
+        session['history_id'] = new_session_id()
+    return session['history_id']
 
-        # Histórico de conversa
-        if 'conversation_history' not in session:
-            session['conversation_history'] = []
-        session['conversation_history'].append({
-            'role': 'user',
-            'text': user_message,
-            'timestamp': str(datetime.now())
-        })
 
-        last_question = session['conversation_history'][-2]['text'] \
-            if len(session['conversation_history']) > 1 else None
-        response = get_chat_response(user_message, user_id, last_question)
+def push_user_turn(history_id, user_message):
+    """Registra a mensagem do usuário e devolve o texto do turno anterior, se houver"""
+    history_store.append(history_id, 'user', user_message)
+    previous = history_store.turn(history_id, -2)
+    return previous['text'] if previous else None
 
-        session['conversation_history'].append({
-            'role': 'bot',
-            'text': response['response'],
-            'timestamp': str(datetime.now())
-        })
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    try:
+        admit_chat()
+        with chat_slots.slot():
+            user_message, user_id, error = read_chat_request()
+            if error:
+                return error
+
+            # Histórico de conversa
+            history_id = get_history_id()
+            last_question = push_user_turn(history_id, user_message)
+            response = get_chat_response(user_message, user_id, last_question)
+            history_store.append(history_id, 'bot', response['response'])
 
         return jsonify(response)
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Erro no /api/chat: {e}")
         return jsonify({'error': 'Erro interno'}), 500
 
 
+def ndjson(event):
+    return json.dumps(event, ensure_ascii=False, default=str) + '\n'
+
+
+def parse_date_arg(name):
+    """Lê um parâmetro YYYY-MM-DD da query string (ValueError se inválido)"""
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Igual ao /api/chat, mas responde em NDJSON: quando a knowledge_base não tem a
+    resposta, repassa os tokens do Ollama à medida que são gerados.
+    """
+    try:
+        admit_chat()
+        with chat_slots.slot():
+            user_message, user_id, error = read_chat_request()
+            if error:
+                return error
+
+            history_id = get_history_id()
+            last_question = push_user_turn(history_id, user_message)
+            response = get_chat_response(user_message, user_id, last_question, stream_ia=True)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Erro no /api/chat/stream: {e}")
+        return jsonify({'error': 'Erro interno'}), 500
+
+    if response.get('intent') != 'ia':
+        history_store.append(history_id, 'bot', response['response'])
+        return Response(ndjson(dict(response, event='done')), mimetype='application/x-ndjson')
+
+    # A geração pode levar segundos: devolve a conexão ao pool antes de começar
+    release_db_connection(None)
+    prompt = response.pop('prompt')
+    norm = response.pop('norm')
+    cid = response.pop('conversation_id')
+    fallback = response['response']
+    asked_at = datetime.now()
+
+    # Sem resposta no cache, começa (ou acompanha) a geração antes de responder:
+    # sem vaga na IA, a recusa ainda pode ser um 503
+    cached = llm_cache.get(norm, OLLAMA_MODEL)
+    chunks = None
+    if not cached:
+        try:
+            chunks = stream_ia_response(prompt, norm)
+        except Overloaded as e:
+            return overloaded_response(e)
+
+    def generate():
+        parts = []
+        yield ndjson({'event': 'start', 'intent': 'ia'})
+        if cached:
+            parts.append(cached)
+            yield ndjson({'event': 'delta', 'text': cached})
+        else:
+            try:
+                for token in chunks:
+                    parts.append(token)
+                    yield ndjson({'event': 'delta', 'text': token})
+            except Exception as e:
+                logger.error(f"Erro no streaming do Ollama: {e}")
+                if parts:
+                    # Descarta no cliente a resposta pela metade: fica só o fallback, como no registro
+                    yield ndjson({'event': 'reset'})
+                parts = []
+            llm_cache.set(norm, OLLAMA_MODEL, ''.join(parts).strip())
+
+        answer = ''.join(parts).strip()
+        if not answer:
+            answer = fallback
+            yield ndjson({'event': 'delta', 'text': fallback})
+        record_tier(('llm_cache' if cached else 'llm') if parts else 'unknown')
+
+        # Registra a resposta completa depois que a geração termina
+        history_store.append(history_id, 'bot', answer)
+        conn = get_db_connection()
+        if conn or write_behind:
+            log_exchange(cid, user_message, answer, 'ia' if parts else 'unknown', conn, asked_at)
+        yield ndjson({'event': 'done', 'response': answer,
+                      'intent': 'ia' if parts else 'unknown',
+                      'confidence': 0.5 if parts else 0.1})
+
+    # O contexto da requisição (e o rastro) dura até o fim do streaming: a duração
+    # medida inclui a geração e a conexão do registro volta ao pool no teardown
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/audit')
 def audit_page():
     return render_template('audit.html')
@@ -146,29 +579,39 @@ def dashboard():
     if not conn:
         return "Erro de conexão", 500
 
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT COUNT(*) as total FROM messages WHERE is_from_user = 1")
-        total_respondidas = cursor.fetchone()['total']
+    # Janela do detalhamento por intenção (?hours=N, padrão 24h)
+    hours = max(1, min(request.args.get('hours', 24, type=int), 24 * 365))
+    since = datetime.now() - timedelta(hours=hours)
 
-        cursor.execute("SELECT COUNT(*) as total FROM unknown_questions WHERE status = 'pending'")
-        total_pendentes = cursor.fetchone()['total']
+    totals = metrics_rollup.window(conn, ['answered'])
+    total_respondidas = sum(totals.values())
 
-        cursor.execute("""
-            SELECT question, COUNT(*) as count FROM unknown_questions 
-            WHERE created_at > DATE_SUB(NOW(), INTERVAL 10 HOUR)
-            GROUP BY question ORDER BY count DESC LIMIT 5
-        """)
-        frequentes = cursor.fetchall()
-
-        return render_template('dashboard.html',
-                               total_respondidas=total_respondidas,
-                               total_pendentes=total_pendentes,
-                               taxa_edi=92,
-                               frequentes=frequentes)
-    finally:
-        cursor.close()
-        conn.close()
+    # Contagem na hora pelo índice (status, ...): só percorre as pendentes
+    total_pendentes = repository_for(conn).count_pending_unknown()
+
+    recent = metrics_rollup.window(conn, ['answered', 'unknown', 'kb_hit', 'kb_miss'], start=since)
+    kb_hits = sum(v for (m, _), v in recent.items() if m == 'kb_hit')
+    kb_misses = sum(v for (m, _), v in recent.items() if m == 'kb_miss')
+    taxa_acerto = round(100 * kb_hits / (kb_hits + kb_misses), 1) if kb_hits + kb_misses else None
+    por_intencao = sorted(
+        [{'intent': label or '-', 'count': v} for (m, label), v in recent.items()
+         if m == 'answered' and label != 'unknown'],
+        key=lambda item: item['count'], reverse=True)
+    sem_resposta = sum(v for (m, _), v in recent.items() if m == 'unknown')
+
+    frequentes = unknown_tracker.top(conn, limit=5)
+
+    return render_template('dashboard.html',
+                           total_respondidas=total_respondidas,
+                           total_pendentes=total_pendentes,
+                           taxa_acerto=taxa_acerto,
+                           por_intencao=por_intencao,
+                           sem_resposta=sem_resposta,
+                           hours=hours,
+                           frequentes=frequentes)
+
+
+HISTORICS_PAGE_SIZE = 100
 
 
 @app.route('/admin/historics')
@@ -176,33 +619,59 @@ def historics_dashboard():
     if not session.get('admin_logged_in'):
         return redirect(url_for('admin_login'))
 
+    # Filtros e cursor da página (?cursor=<started_at ISO>_<conversation_id>)
+    filters = {k: request.args.get(k, '').strip() for k in ('company', 'erp', 'status', 'from', 'to')}
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+        cursor_arg = request.args.get('cursor')
+        page_cursor = None
+        if cursor_arg:
+            started, _, cid = cursor_arg.rpartition('_')
+            page_cursor = (datetime.fromisoformat(started), int(cid))
+    except ValueError:
+        return "Parâmetros inválidos", 400
+
+    where, params = [], []
+    for field in ('company', 'erp', 'status'):
+        if filters[field]:
+            where.append(f"{field} = %s")
+            params.append(filters[field])
+    if date_from:
+        where.append("started_at >= %s")
+        params.append(date_from)
+    if date_to:
+        where.append("started_at < %s")
+        params.append(date_to + timedelta(days=1))
+    if page_cursor:
+        where.append("(started_at < %s OR (started_at = %s AND conversation_id < %s))")
+        params.extend([page_cursor[0], page_cursor[0], page_cursor[1]])
+
     conn = get_db_connection()
     if not conn:
         return "Erro de conexão", 500
 
     cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("""
-            SELECT 
-                c.id as conversation_id,
-                c.user_id,
-                c.started_at,
-                c.status,
-                p.name,
-                p.company,
-                p.erp,
-                (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = c.id) as total_messages
-            FROM conversations c
-            LEFT JOIN user_profiles p ON c.user_id = p.user_id
-            ORDER BY c.started_at DESC
-            LIMIT 100
-        """)
+        cursor.execute(f"""
+            SELECT conversation_id, user_id, started_at, status, name, company, erp,
+                   message_count AS total_messages, unknown_count, last_message_at, last_user_message
+            FROM conversation_summaries
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY started_at DESC, conversation_id DESC
+            LIMIT %s
+        """, params + [HISTORICS_PAGE_SIZE])
         conversations = cursor.fetchall()
 
-        return render_template('historics.html', conversations=conversations)
+        next_cursor = None
+        if len(conversations) == HISTORICS_PAGE_SIZE:
+            last = conversations[-1]
+            next_cursor = f"{last['started_at'].isoformat()}_{last['conversation_id']}"
+
+        return render_template('historics.html', conversations=conversations,
+                               filters=filters, next_cursor=next_cursor)
     finally:
         cursor.close()
-        conn.close()
 
 
 @app.route('/admin/conversa/<int:conversation_id>')
@@ -214,32 +683,18 @@ def ver_conversa(conversation_id):
     if not conn:
         return "Erro de conexão", 500
 
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM conversations WHERE id = %s", (conversation_id,))
-        conversa = cursor.fetchone()
-
-        if not conversa:
-            return "Conversa não encontrada", 404
+    repo = repository_for(conn)
+    conversa = repo.get_conversation(conversation_id)
+    if not conversa:
+        return "Conversa não encontrada", 404
 
-        cursor.execute("SELECT name, company, erp FROM user_profiles WHERE user_id = %s", (conversa['user_id'],))
-        perfil = cursor.fetchone() or {}
+    perfil = repo.get_profile(conversa['user_id']) or {}
+    mensagens = repo.conversation_messages(conversation_id)
 
-        cursor.execute("""
-            SELECT is_from_user, message_text, sent_at 
-            FROM messages 
-            WHERE conversation_id = %s 
-            ORDER BY sent_at ASC
-        """, (conversation_id,))
-        mensagens = cursor.fetchall()
-
-        return render_template('conversa_detalhe.html',
-                               conversa=conversa,
-                               perfil=perfil,
-                               mensagens=mensagens)
-    finally:
-        cursor.close()
-        conn.close()
+    return render_template('conversa_detalhe.html',
+                           conversa=conversa,
+                           perfil=perfil,
+                           mensagens=mensagens)
 
 
 @app.route('/admin/exportar/<int:conversation_id>')
@@ -251,37 +706,60 @@ def exportar_conversa(conversation_id):
     if not conn:
         return "Erro", 500
 
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM conversations WHERE id = %s", (conversation_id,))
-    conversa = cursor.fetchone()
+    conversa = repository_for(conn).get_conversation(conversation_id)
+    if not conversa:
+        return "Conversa não encontrada", 404
 
-    cursor.execute("""
-        SELECT is_from_user, message_text, sent_at FROM messages 
-        WHERE conversation_id = %s ORDER BY sent_at ASC
-    """, (conversation_id,))
-    mensagens = cursor.fetchall()
+    def generate():
+        yield f"CONVERSA #{conversation_id} - {conversa['started_at']}\n"
+        yield f"USER ID: {conversa['user_id']}\n\n"
+        for row in export.iter_rows(conn, {'conversation_id': conversation_id}):
+            yield export.text_line(row)
 
-    content = f"CONVERSA #{conversation_id} - {conversa['started_at']}\n"
-    content += f"USER ID: {conversa['user_id']}\n\n"
+    return Response(
+        stream_with_context(export.iter_bytes(generate())),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment;filename=conversa_{conversation_id}.txt'}
+    )
 
-    for msg in mensagens:
-        sender = "Usuário" if msg['is_from_user'] else "Ednna"
-        dt = msg['sent_at'].strftime('%d/%m %H:%M')
-        content += f"[{dt}] {sender}: {msg['message_text']}\n"
 
-    conn.close()
+@app.route('/admin/exportar')
+def exportar_conversas():
+    """Exportação em massa: ?format=jsonl|csv|txt&gzip=1&from=&to=&user_id=&company=&erp=&status="""
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin_login'))
 
-    from io import StringIO
-    from flask import Response
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in export.FORMATS:
+        return jsonify({'error': f"format deve ser um de: {', '.join(sorted(export.FORMATS))}"}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    try:
+        filters = export.parse_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'Filtro inválido (datas em YYYY-MM-DD, user_id numérico)'}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Erro de conexão'}), 500
 
-    buffer = StringIO(content)
+    mimetype, extension = export.FORMATS[fmt]
+    filename = f"conversas_{datetime.now():%Y%m%d_%H%M%S}.{extension}"
+    if compress:
+        mimetype, filename = 'application/gzip', filename + '.gz'
+    chunks = export.iter_export(export.iter_rows(conn, filters), fmt)
     return Response(
-        buffer.getvalue(),
-        mimetype='text/plain',
-        headers={'Content-Disposition': f'attachment;filename=conversa_{conversation_id}.txt'}
+        stream_with_context(export.iter_bytes(chunks, compress=compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment;filename={filename}'}
     )
 
 
+# Agrupamento das pendências quase iguais no /admin/learn
+LEARN_MAX_QUESTIONS = int(os.getenv('LEARN_MAX_QUESTIONS', 5000))
+LEARN_PAGE_CLUSTERS = int(os.getenv('LEARN_PAGE_CLUSTERS', 50))
+question_clusterer = QuestionClusterer(threshold=float(os.getenv('LEARN_CLUSTER_THRESHOLD', 0.5)))
+
+
 @app.route('/admin/learn')
 def learn_dashboard():
     if not session.get('admin_logged_in'):
@@ -291,16 +769,51 @@ def learn_dashboard():
     if not conn:
         return "Erro DB", 500
 
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT id, user_id, question, created_at FROM unknown_questions 
-        WHERE status = 'pending' ORDER BY created_at DESC LIMIT 50
-    """)
-    questions = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    # As pendências mais frequentes, agrupadas; os grupos maiores primeiro
+    questions = unknown_tracker.top(conn, limit=LEARN_MAX_QUESTIONS)
+    with span('question_clusters'):
+        clusters = question_clusterer.cluster(questions)
 
-    return render_template('admin_learn.html', questions=questions)
+    return render_template('admin_learn.html', clusters=clusters[:LEARN_PAGE_CLUSTERS],
+                           total_clusters=len(clusters), total_questions=len(questions))
+
+
+def save_teaching(conn, question, answer, category, unknown_ids=()):
+    """
+    Grava a resposta na knowledge_base e fecha, na mesma transação, as pendências
+    com a pergunta e as de `unknown_ids` (um grupo do /admin/learn). Devolve
+    quantas pendências foram fechadas.
+    """
+    repo = repository_for(conn)
+    keywords = extract_keywords(question, answer)
+    try:
+        repo.upsert_kb(question, answer, category, keywords)
+        resolved = repo.close_unknown(question)
+        closed = repo.close_unknown_ids(unknown_ids) if unknown_ids else []
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for text in {question, *closed}:
+        unknown_tracker.forget(text)
+    resolved += len(closed)
+
+    # Atualiza o índice em memória com a linha gravada
+    row = repo.kb_entry(question)
+    if row:
+        kb_index.upsert(row)
+    publish_kb_snapshot()
+    llm_cache.invalidate_matching(normalize_message(question), keywords)
+    return resolved
+
+
+def read_teaching():
+    """Lê pergunta/resposta/categoria do JSON; devolve (dados, resposta de erro)"""
+    data = request.get_json(silent=True) or {}
+    fields = {k: str(data.get(k) or '').strip() for k in ('question', 'answer', 'category')}
+    if not all(fields.values()):
+        return None, (jsonify({"error": "Campos obrigatórios"}), 400)
+    return dict(data, **fields), None
 
 
 @app.route('/admin/teach', methods=['POST'])
@@ -308,105 +821,234 @@ def teach_ednna():
     if not session.get('admin_logged_in'):
         return jsonify({'error': 'Acesso negado'}), 403
 
-    data = request.get_json()
-    q = data.get('question', '').strip()
-    a = data.get('answer', '').strip()
-    c = data.get('category', '').strip()
+    data, error = read_teaching()
+    if error:
+        return error
 
-    if not all([q, a, c]):
-        return jsonify({"error": "Campos obrigatórios"}), 400
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "DB"}), 500
+
+    try:
+        save_teaching(conn, data['question'], data['answer'], data['category'])
+        return jsonify({"status": "success"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/teach/cluster', methods=['POST'])
+def teach_cluster():
+    """Ensina uma resposta para um grupo: {question, answer, category, ids: [...]}"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    data, error = read_teaching()
+    if error:
+        return error
+    try:
+        ids = [int(i) for i in data.get('ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids deve ser uma lista de números"}), 400
 
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "DB"}), 500
 
-    cursor = conn.cursor()
     try:
-        words = re.findall(r'\w{5,}', a.lower())
-        keywords = ",".join(set(words[:10])) or "geral"
+        resolved = save_teaching(conn, data['question'], data['answer'], data['category'], ids)
+        return jsonify({"status": "success", "resolved": resolved})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        cursor.execute("""
-            INSERT INTO knowledge_base (question, answer, category, keywords, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, NOW(), NOW())
-            ON DUPLICATE KEY UPDATE answer = VALUES(answer), updated_at = NOW()
-        """, (q, a, c, keywords))
 
-        cursor.execute("UPDATE unknown_questions SET status = 'answered' WHERE question = %s", (q,))
-        conn.commit()
-        return jsonify({"status": "success"})
+@app.route('/admin/kb/import', methods=['POST'])
+def kb_import():
+    """
+    Importação em massa da knowledge_base: arquivo no campo 'file' (multipart) ou no
+    corpo, ?format=csv|jsonl (padrão pela extensão, senão jsonl) e ?dry_run=1 para
+    só ver o diff. Linhas inválidas cancelam o lote inteiro.
+    """
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    upload = request.files.get('file')
+    fmt = request.args.get('format') or kb_bulk.guess_format(upload.filename if upload else None)
+    if fmt not in kb_bulk.FORMATS:
+        return jsonify({'error': f"format deve ser um de: {', '.join(sorted(kb_bulk.FORMATS))}"}), 400
+    dry_run = request.args.get('dry_run') in ('1', 'true')
+    try:
+        text = (upload.read() if upload else request.get_data()).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Arquivo deve estar em UTF-8'}), 400
+
+    try:
+        with span('kb_import_validate'):
+            entries, duplicates = kb_bulk.validate(text, fmt)
+    except kb_bulk.ImportErrors as e:
+        return jsonify({'error': str(e), 'lines': [{'line': line, 'error': message}
+                                                   for line, message in e.errors[:100]]}), 400
+    if not entries:
+        return jsonify({'error': 'Arquivo sem entradas'}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "DB"}), 500
+
+    repo = repository_for(conn)
+    try:
+        with span('kb_import_diff'):
+            changes = kb_bulk.diff(repo, entries)
+        result = dict(kb_bulk.summarize(changes, duplicates), dry_run=dry_run)
+        if dry_run:
+            return jsonify(result)
+        with span('kb_import_apply'):
+            result['resolved'] = kb_bulk.apply(repo, entries)
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+
+    for entry in entries.values():
+        unknown_tracker.forget(entry['question'])
+    # Recarrega o índice em memória com as entradas alteradas e limpa as respostas
+    # da IA que a base agora responde
+    kb_index.refresh_from_db(repo)
+    publish_kb_snapshot()
+    llm_cache.invalidate_matching(*(normalize_message(entry['question']) for entry in entries.values()))
+    return jsonify(result)
+
+
+@app.route('/admin/kb/export')
+def kb_export():
+    """Exportação da knowledge_base no formato aceito pela importação: ?format=jsonl|csv&gzip=1"""
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin_login'))
+
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in kb_bulk.FORMATS:
+        return jsonify({'error': f"format deve ser um de: {', '.join(sorted(kb_bulk.FORMATS))}"}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Erro de conexão'}), 500
+
+    mimetype, extension = kb_bulk.FORMATS[fmt]
+    filename = f"knowledge_base_{datetime.now():%Y%m%d_%H%M%S}.{extension}"
+    if compress:
+        mimetype, filename = 'application/gzip', filename + '.gz'
+    chunks = kb_bulk.iter_export(repository_for(conn), fmt)
+    return Response(
+        stream_with_context(export.iter_bytes(chunks, compress=compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment;filename={filename}'}
+    )
+
+
+AUDIT_MAX_LIMIT = 1000
+AUDIT_MAX_STREAM = 100000
 
 
 @app.route('/api/audit', methods=['GET'])
 def audit():
-    """Endpoint para auditoria de perguntas e respostas"""
+    """
+    Endpoint para auditoria de perguntas e respostas.
+    Paginação por chave: ?before=<id>&limit=N, filtros ?from=/&to= (YYYY-MM-DD)
+    e ?format=ndjson para receber as linhas em streaming.
+    """
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(dictionary=True)
-
-        query = """
-            SELECT 
-                u.message_text AS pergunta,
-                b.message_text AS resposta,
-                u.sent_at AS data
-            FROM messages u
-            JOIN messages b 
-                ON b.conversation_id = u.conversation_id 
-                AND b.id > u.id
-                AND b.is_from_user = 0
-            WHERE u.is_from_user = 1
-            ORDER BY u.sent_at DESC
-            LIMIT 500
-        """
-        cursor.execute(query)
-        results = cursor.fetchall()
-        return jsonify(results)
+        before = request.args.get('before', type=int)
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+    stream = request.args.get('format') == 'ndjson'
+    max_limit = AUDIT_MAX_STREAM if stream else AUDIT_MAX_LIMIT
+    limit = max(1, min(request.args.get('limit', 100, type=int), max_limit))
+
+    where, params = [], []
+    if before:
+        where.append("id < %s")
+        params.append(before)
+    if date_from:
+        where.append("asked_at >= %s")
+        params.append(date_from)
+    if date_to:
+        where.append("asked_at < %s")
+        params.append(date_to + timedelta(days=1))
+    query = f"""
+        SELECT id, question AS pergunta, answer AS resposta, asked_at AS data, intent
+        FROM audit_pairs
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY id DESC
+        LIMIT %s
+    """
+    params.append(limit)
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Erro de conexão'}), 500
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(query, params)
     except Error as e:
+        cursor.close()
         logger.error(f"Erro ao gerar auditoria: {e}")
         return jsonify({'error': 'Erro ao gerar auditoria'}), 500
+
+    if stream:
+        def generate():
+            try:
+                while True:
+                    rows = cursor.fetchmany(500)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield ndjson(row)
+            finally:
+                cursor.close()
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        results = cursor.fetchall()
     finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+        cursor.close()
+    response = jsonify(results)
+    if len(results) == limit:
+        response.headers['X-Next-Before'] = str(results[-1]['id'])
+    return response
 
 
 # === FUNÇÕES AUXILIARES ===
 
 def get_or_create_user_profile(user_id, connection):
-    cursor = None
+    cached = user_cache.get_profile(user_id)
+    if cached is not None:
+        return cached
+    repo = repository_for(connection)
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM user_profiles WHERE user_id = %s", (user_id,))
-        profile = cursor.fetchone()
+        profile = repo.get_profile(user_id)
         if not profile:
-            cursor.execute("""
-                INSERT INTO user_profiles (user_id, name, company, erp) VALUES (%s, NULL, NULL, NULL)
-            """, (user_id,))
+            profile = repo.create_profile(user_id)
             connection.commit()
-            return {'user_id': user_id, 'name': None, 'company': None, 'erp': None}
+        user_cache.set_profile(user_id, profile)
         return profile
     except Error as e:
         logger.error(f"Erro ao buscar perfil: {e}")
         return {'user_id': user_id}
-    finally:
-        if cursor:
-            cursor.close()
 
 
 def update_user_profile(user_id, updates, connection):
     cursor = None
     try:
+        repository_for(connection).update_profile(user_id, updates)
         cursor = connection.cursor()
-        set_clause = ", ".join([f"{k} = %s" for k in updates.keys()])
-        values = list(updates.values()) + [user_id]
-        query = f"UPDATE user_profiles SET {set_clause}, updated_at = NOW() WHERE user_id = %s"
-        cursor.execute(query, values)
+        # Mantém os dados de perfil copiados no resumo das conversas do usuário
+        summary_updates = {k: v for k, v in updates.items() if k in ('name', 'company', 'erp')}
+        if summary_updates:
+            set_clause = ", ".join([f"{k} = %s" for k in summary_updates.keys()])
+            cursor.execute(f"UPDATE conversation_summaries SET {set_clause} WHERE user_id = %s",
+                           list(summary_updates.values()) + [user_id])
         connection.commit()
+        user_cache.update_profile(user_id, updates)
     except Error as e:
         logger.error(f"Erro ao atualizar perfil: {e}")
     finally:
@@ -415,20 +1057,27 @@ def update_user_profile(user_id, updates, connection):
 
 
 def get_or_create_conversation(user_id, connection):
+    cached = user_cache.get_conversation(user_id)
+    if cached is not None:
+        return cached
+    repo = repository_for(connection)
     cursor = None
     try:
+        conversation_id = repo.active_conversation_id(user_id)
+        if conversation_id is not None:
+            user_cache.set_conversation(user_id, conversation_id)
+            return conversation_id
+        started_at = datetime.now()
+        conversation_id = repo.create_conversation(user_id, started_at)
         cursor = connection.cursor()
+        profile = user_cache.get_profile(user_id) or {}
         cursor.execute("""
-            SELECT id FROM conversations WHERE user_id = %s AND status = 'active' 
-            ORDER BY started_at DESC LIMIT 1
-        """, (user_id,))
-        result = cursor.fetchone()
-        if result:
-            return result[0]
-        cursor.execute("INSERT INTO conversations (user_id, started_at, status) VALUES (%s, NOW(), 'active')",
-                       (user_id,))
+            INSERT INTO conversation_summaries (conversation_id, user_id, status, name, company, erp, started_at)
+            VALUES (%s, %s, 'active', %s, %s, %s, %s)
+        """, (conversation_id, user_id, profile.get('name'), profile.get('company'), profile.get('erp'), started_at))
         connection.commit()
-        return cursor.lastrowid
+        user_cache.set_conversation(user_id, conversation_id)
+        return conversation_id
     except Error as e:
         logger.error(f"Erro ao criar conversa: {e}")
         return 1
@@ -437,151 +1086,192 @@ def get_or_create_conversation(user_id, connection):
             cursor.close()
 
 
-def log_message(conversation_id, message, is_from_user, connection):
+def write_log_records(records, connection, what='registros de log'):
+    """Grava [(tipo, parâmetros)] de LOG_STATEMENTS numa transação, ou enfileira no write-behind"""
+    if write_behind:
+        for kind, params in records:
+            write_behind.enqueue(kind, params)
+        return
     cursor = None
     try:
         cursor = connection.cursor()
-        query = "INSERT INTO messages (conversation_id, message_text, is_from_user, sent_at) VALUES (%s, %s, %s, NOW())"
-        cursor.execute(query, (conversation_id, message, is_from_user))
+        grouped = {}
+        for kind, params in records:
+            grouped.setdefault(kind, []).append(params)
+        for kind, rows in grouped.items():
+            cursor.executemany(LOG_STATEMENTS[kind], rows)
         connection.commit()
     except Error as e:
-        logger.error(f"Erro ao registrar mensagem: {e}")
+        connection.rollback()
+        logger.error(f"Erro ao gravar {what}: {e}")
     finally:
         if cursor:
             cursor.close()
 
 
-def get_ia_response(prompt):
+def log_message(conversation_id, message, is_from_user, connection):
+    sent_at = datetime.now()
+    write_log_records([
+        ('message', (conversation_id, message, is_from_user, sent_at)),
+        ('summary_messages', (1, sent_at, sent_at, message if is_from_user else None, conversation_id)),
+    ], connection, 'mensagem')
+
+
+def log_exchange(conversation_id, question, answer, intent, connection, asked_at=None, log_question=True):
+    """
+    Registra pergunta, resposta, o par de auditoria e o resumo da conversa numa
+    única transação. Com log_question=False só a resposta vai para `messages`.
+    """
+    asked_at = asked_at or datetime.now()
+    answered_at = datetime.now()
+    records = []
+    if log_question:
+        records.append(('message', (conversation_id, question, True, asked_at)))
+    records.append(('message', (conversation_id, answer, False, answered_at)))
+    records.append(('audit_pair', (conversation_id, question, answer, intent, asked_at, answered_at)))
+    records.append(('summary_messages', (len(records) - 1, answered_at, answered_at, question, conversation_id)))
+    if intent == 'unknown':
+        records.append(('summary_unknown', (conversation_id,)))
+        metrics_rollup.record('unknown')
+    # Toda pergunta conta em "answered" (por intenção, inclusive unknown): a mesma
+    # definição da carga inicial da migrations/0007 (mensagens do usuário)
+    metrics_rollup.record('answered', intent)
+    write_log_records(records, connection, 'troca de mensagens')
+
+
+def get_ia_response(prompt, norm=None):
+    """Resposta da IA; com `norm`, consulta e alimenta o cache de respostas"""
+    if norm:
+        cached = llm_cache.get(norm, OLLAMA_MODEL)
+        if cached:
+            record_tier('llm_cache')
+            return cached
+    start = time.perf_counter()
     try:
-        import requests
-        resp = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": "llama3.2",
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=10
-        )
-        return resp.json().get("response", "").strip()
+        answer = llm_client.generate(prompt, key=norm, timeout=OLLAMA_TIMEOUT).strip()
+        instrumentation.LLM_SECONDS.observe(time.perf_counter() - start, mode='blocking', outcome='ok')
+        if norm:
+            llm_cache.set(norm, OLLAMA_MODEL, answer)
+        if answer:
+            record_tier('llm')
+        return answer
     except Exception as e:
+        instrumentation.LLM_SECONDS.observe(time.perf_counter() - start, mode='blocking', outcome='error')
+        instrumentation.LLM_ERRORS.inc(mode='blocking', reason=type(e).__name__)
         logger.error(f"Erro ao chamar Ollama: {e}")
         return None
 
+
+def stream_ia_response(prompt, norm=None):
+    """
+    Começa a geração (ou acompanha uma igual em andamento) e devolve o gerador dos
+    trechos da resposta à medida que são produzidos; Overloaded se não houver vaga
+    """
+    start = time.perf_counter()
+    try:
+        chunks = llm_client.stream(prompt, key=norm)
+    except Exception as e:
+        instrumentation.LLM_ERRORS.inc(mode='stream', reason=type(e).__name__)
+        raise
+
+    def observed():
+        outcome = 'aborted'
+        try:
+            yield from chunks
+            outcome = 'ok'
+        except Exception as e:
+            outcome = 'error'
+            instrumentation.LLM_ERRORS.inc(mode='stream', reason=type(e).__name__)
+            raise
+        finally:
+            instrumentation.LLM_SECONDS.observe(time.perf_counter() - start, mode='stream', outcome=outcome)
+    return observed()
+
+
 def ensure_user_exists(user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE id = %s", (user_id,))
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return result is not None
+    cached = user_cache.get_user_exists(user_id)
+    if cached is not None:
+        return cached
+    exists = repository_for(get_db_connection()).user_exists(user_id)
+    user_cache.set_user_exists(user_id, exists)
+    return exists
+
+def log_chat_turn(user_id, question, answer, intent, connection, log_question=True):
+    """Registra a troca na conversa ativa do usuário, cronometrando as duas etapas"""
+    with span('conversation'):
+        cid = get_or_create_conversation(user_id, connection)
+    with span('log_exchange'):
+        log_exchange(cid, question, answer, intent, connection, log_question=log_question)
+
 
 # === RESPOSTA INTELIGENTE COM CONTEXTO ===
 
-def get_chat_response(message, user_id, last_user_question=None):
+def get_chat_response(message, user_id, last_user_question=None, stream_ia=False):
     conn = get_db_connection()
     if not conn:
         return {'response': 'Erro de conexão', 'intent': 'error'}
-    cursor = None
     try:
-        cursor = conn.cursor(dictionary=True)
-        msg_low = message.strip().lower()
+        # Classifica a mensagem numa única passada pelo motor de regras
+        with span('intent_rules'):
+            analysis = intent_rules.analyze(message)
 
         # Carrega perfil do usuário
-        profile = get_or_create_user_profile(user_id, conn) or {}
+        with span('profile_load'):
+            profile = get_or_create_user_profile(user_id, conn) or {}
         name = profile.get('name')
         company = profile.get('company')
         erp = profile.get('erp')
 
         # Normalização de termos
-        terms = {'teiacard': 'teia card', 'teiavalue': 'teia values'}
-        norm = msg_low
-        for err, cor in terms.items():
-            norm = norm.replace(err, cor)
+        norm = analysis['normalized']
 
         # 🔁 MANTÉM FOCO NO TEMA ATUAL
         intencao_atual = None
         if last_user_question:
-            if any(word in last_user_question.lower() for word in ['edi', 'interchange', 'sftp', 'van']):
-                intencao_atual = 'edi'
-            elif any(word in last_user_question.lower() for word in ['boletos', 'pix', 'cofre', 'carro forte']):
-                intencao_atual = 'teia_values'
-            elif any(word in last_user_question.lower() for word in ['cartão', 'cielo', 'rede', 'stone']):
-                intencao_atual = 'teia_card'
+            topics = intent_rules.analyze(last_user_question)['topics']
+            intencao_atual = topics[0] if topics else None
 
         # ✅ SAUDAÇÕES
-        saudacoes = ['oi', 'olá', 'bom dia', 'boa tarde', 'tudo bem']
-        if any(s in msg_low for s in saudacoes):
+        if analysis['greetings']:
             resposta = f"Olá, {name}! Como posso te ajudar hoje?" if name else "Olá! Como posso te ajudar hoje?"
-            cid = get_or_create_conversation(user_id, conn)
-            log_message(cid, message, True, conn)
-            log_message(cid, resposta, False, conn)
+            record_tier('saudacao')
+            log_chat_turn(user_id, message, resposta, 'saudacao', conn)
             return {'response': resposta, 'intent': 'saudacao'}
 
         # ✅ DESPEDIDAS
-        despedidas = ['tchau', 'até logo', 'obrigado', 'valeu', 'falou']
-        if any(d in msg_low for d in despedidas):
+        if analysis['farewells']:
             resposta = f"Tchau, {name}! Fico à disposição." if name else "Tchau! Estou aqui quando precisar."
-            cid = get_or_create_conversation(user_id, conn)
-            log_message(cid, message, True, conn)
-            log_message(cid, resposta, False, conn)
+            record_tier('despedida')
+            log_chat_turn(user_id, message, resposta, 'despedida', conn)
             return {'response': resposta, 'intent': 'despedida'}
 
-        # 🔹 DETECÇÃO DE PERFIL
-        if not name:
-            match = re.search(r"\b(?:me chamo|meu nome é|sou|eu sou)\s+(\w+)", msg_low)
-            if match:
-                update_user_profile(user_id, {'name': match.group(1).title()}, conn)
-        if not company:
-            match = re.search(r"\b(?:trabalho na|sou da|empresa)\s+(\w+)", msg_low)
-            if match:
-                update_user_profile(user_id, {'company': match.group(1).title()}, conn)
-        if not erp:
-            erps = {'totvs': 'TOTVS', 'sap': 'SAP', 'oracle': 'ORACLE', 'sankhya': 'SANKHYA'}
-            for key, value in erps.items():
-                if key in msg_low:
-                    update_user_profile(user_id, {'erp': value}, conn)
-                    break
-
-        # 🔍 BUSCA POR INTENÇÃO
-        result = None
-        if intencao_atual:
-            cursor.execute("""
-                SELECT answer, category FROM knowledge_base 
-                WHERE category = %s AND (question LIKE %s OR keywords LIKE %s)
-                ORDER BY updated_at DESC LIMIT 1
-            """, (intencao_atual, f'%{norm}%', f'%{norm}%'))
-            result = cursor.fetchone()
-
-        # 🔍 Busca geral
-        if not result:
-            try:
-                cursor.execute("""
-                    SELECT answer, category FROM knowledge_base 
-                    WHERE question LIKE %s OR keywords LIKE %s 
-                    ORDER BY updated_at DESC LIMIT 1
-                """, (f'%{norm}%', f'%{norm}%'))
-                result = cursor.fetchone()
-            except Error as e:
-                logger.error(f"Erro na busca geral: {e}")
-
-        # 🔍 Full-text como fallback
-        if not result and len(norm.split()) > 1:
-            try:
-                safe_norm = norm.replace("'", "\\'").replace('"', '\\"')
-                query_fulltext = f"""
-                    SELECT answer, category,
-                           MATCH(question, keywords, answer) AGAINST('{safe_norm}' IN NATURAL LANGUAGE MODE) as score
-                    FROM knowledge_base
-                    WHERE MATCH(question, keywords, answer) AGAINST('{safe_norm}' IN NATURAL LANGUAGE MODE) > 0.7
-                    ORDER BY score DESC
-                    LIMIT 1
-                """
-                cursor.execute(query_fulltext)
-                result = cursor.fetchone()
-            except Exception as e:
-                logger.error(f"Erro na busca full-text: {e}")
+        # 🔹 DETECÇÃO DE PERFIL (um único UPDATE com tudo o que foi capturado)
+        profile_updates = {}
+        captured = analysis['profile']
+        if not name and captured.get('name'):
+            profile_updates['name'] = captured['name'].title()
+        if not company and captured.get('company'):
+            profile_updates['company'] = captured['company'].title()
+        if not erp and analysis['erps']:
+            profile_updates['erp'] = analysis['erps'][0]
+        if profile_updates:
+            with span('profile_update'):
+                update_user_profile(user_id, profile_updates, conn)
+
+        # 🔍 BUSCA NO ÍNDICE EM MEMÓRIA (intenção atual → geral → BM25 com corte 0.7)
+        with span('kb_lookup'):
+            index = get_knowledge_index(conn)
+            if index.loaded_at is not None:
+                result = index.lookup(norm, intencao_atual, min_score=0.7)
+            else:
+                # Índice não carregou: busca textual direto no banco (FULLTEXT / FTS5), com o
+                # mesmo corte e a mesma preferência pela categoria da intenção atual
+                repo = repository_for(conn)
+                ranked = repo.search_kb(norm, limit=1, min_score=0.7, category=intencao_atual) \
+                    if intencao_atual else []
+                ranked = ranked or repo.search_kb(norm, limit=1, min_score=0.7)
+                result = dict(ranked[0], tier='kb_fulltext') if ranked else None
+        metrics_rollup.record('kb_hit' if result else 'kb_miss', result['category'] if result else '')
 
         # Após todas as buscas
         if not result:
@@ -595,29 +1285,23 @@ def get_chat_response(message, user_id, last_user_question=None):
 
             Resposta:
             """
-            ia_answer = None
 
         # ✅ RESPOSTA ENCONTRADA
         if result:
-            cid = get_or_create_conversation(user_id, conn)
+            record_tier(result['tier'])
             resposta_final = result['answer']
-            log_message(cid, message, True, conn)
-            log_message(cid, resposta_final, False, conn)
+            log_chat_turn(user_id, message, resposta_final, result['category'], conn)
             return {'response': resposta_final, 'intent': result['category'], 'confidence': 0.9}
 
         # 📚 APRENDIZADO ATIVO
         short_question = message[:255]
-        cursor.execute("""
-            SELECT id FROM unknown_questions 
-            WHERE question = %s AND created_at > DATE_SUB(NOW(), INTERVAL 1 HOUR)
-        """, (short_question,))
-        if not cursor.fetchone():
-            cid = get_or_create_conversation(user_id, conn)
-            cursor.execute("""
-                INSERT INTO unknown_questions (user_id, question, conversation_id, status)
-                VALUES (%s, %s, %s, 'pending')
-            """, (user_id, short_question, cid))
-            conn.commit()
+        with span('unknown_dedup'):
+            is_new = not unknown_tracker.seen(short_question)
+        cid = None
+        if is_new:
+            with span('conversation'):
+                cid = get_or_create_conversation(user_id, conn)
+        unknown_tracker.record(short_question, user_id, cid)
 
         # 💡 SUGESTÃO INTELIGENTE
         if intencao_atual == 'edi':
@@ -628,18 +1312,34 @@ def get_chat_response(message, user_id, last_user_question=None):
             sugestao = "Posso te ajudar a esclarecer melhor?"
 
         resposta = f"Desculpe, ainda não sei responder isso. {sugestao}"
-        cid = get_or_create_conversation(user_id, conn)
-        log_message(cid, resposta, False, conn)
+        if stream_ia:
+            # O /api/chat/stream gera a resposta com a IA, registra ao final e anota a origem
+            with span('conversation'):
+                cid = get_or_create_conversation(user_id, conn)
+            return {'response': resposta, 'intent': 'ia', 'prompt': ia_prompt, 'norm': norm,
+                    'conversation_id': cid}
+
+        # 🤖 /api/chat: resposta completa da IA (cache ou Ollama, até OLLAMA_TIMEOUT);
+        # a conexão volta ao pool enquanto a geração roda
+        with span('conversation'):
+            cid = get_or_create_conversation(user_id, conn)
+        release_db_connection(None)
+        with span('llm'):
+            ia_answer = get_ia_response(ia_prompt, norm)
+        conn = get_db_connection()
+        intent = 'ia' if ia_answer else 'unknown'
+        if not ia_answer:
+            record_tier('unknown')
+        if conn or write_behind:
+            with span('log_exchange'):
+                log_exchange(cid, message, ia_answer or resposta, intent, conn, log_question=bool(ia_answer))
+        if ia_answer:
+            return {'response': ia_answer, 'intent': 'ia', 'confidence': 0.5}
         return {'response': resposta, 'intent': 'unknown', 'confidence': 0.1}
 
     except Error as e:
         logger.error(f"Erro no banco: {e}")
         return {'response': 'Erro ao processar', 'intent': 'error'}
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
 
 
 # Protege rotas admin
@@ -650,6 +1350,11 @@ def require_login():
             return redirect(url_for('admin_login'))
 
 
+# Monta o índice da knowledge_base na subida do worker
+with app.app_context():
+    get_knowledge_index()
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
     app.run(host='0.0.0.0', port=port, debug=False)
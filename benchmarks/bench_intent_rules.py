@@ -0,0 +1,102 @@
+# benchmarks/bench_intent_rules.py
+"""
+Micro-benchmark do motor de regras: custo por mensagem à medida que o número de
+regras cresce, comparado com a varredura linear (`any(word in texto ...)`) antiga.
+
+Uso: python benchmarks/bench_intent_rules.py [--messages 2000] [--sizes 10,100,1000,5000]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_rules import RuleEngine, DEFAULT_RULES_PATH  # noqa: E402
+
+SYLLABLES = ['ba', 'ca', 'da', 'fe', 'ga', 'li', 'ma', 'no', 'pa', 'que', 'ra', 'si', 'ta', 'vo', 'xu', 'ze']
+
+MESSAGES = [
+    "Oi, tudo bem? Eu sou a Maria da empresa Netunna",
+    "Como funciona a conciliação do TeiaCard com a Cielo?",
+    "Quais são as fases do processo de EDI via SFTP?",
+    "Vocês integram com TOTVS ou SAP para baixa de boletos e pix?",
+    "Preciso falar com o suporte sobre a VAN bancária do cliente",
+    "obrigado pela ajuda, até logo",
+]
+
+
+def synthetic_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def build_rules(size, rng):
+    """Regras reais + vocabulário sintético distribuído pelos grupos até `size` palavras"""
+    with open(DEFAULT_RULES_PATH, encoding='utf-8') as f:
+        rules = json.load(f)
+    topics = list(rules['topics'])
+    for i in range(max(0, size)):
+        word = synthetic_word(rng)
+        group = i % 4
+        if group == 0:
+            rules['topics'][topics[i % len(topics)]].append(word)
+        elif group == 1:
+            rules['erps'][word] = word.upper()
+        elif group == 2:
+            rules['normalizations'][word] = word + ' x'
+        else:
+            rules['farewells'].append(word)
+    return rules
+
+
+def linear_scan(rules, text):
+    """Reprodução da classificação antiga: uma varredura do texto por palavra"""
+    low = text.strip().lower()
+    norm = low
+    for err, cor in rules['normalizations'].items():
+        norm = norm.replace(err, cor)
+    topic = None
+    for name, words in rules['topics'].items():
+        if any(word in low for word in words):
+            topic = name
+            break
+    greeting = any(s in low for s in rules['greetings'])
+    farewell = any(d in low for d in rules['farewells'])
+    erp = next((v for k, v in rules['erps'].items() if k in low), None)
+    return norm, topic, greeting, farewell, erp
+
+
+def timed(fn, messages):
+    start = time.perf_counter()
+    for msg in messages:
+        fn(msg)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--sizes', default='10,100,1000,5000')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = [rng.choice(MESSAGES) for _ in range(args.messages)]
+
+    print(f"{'regras':>8} {'compilar (ms)':>14} {'estados':>9} {'motor (µs/msg)':>15} {'linear (µs/msg)':>16}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        rules = build_rules(size, rng)
+        start = time.perf_counter()
+        engine = RuleEngine(rules)
+        compile_ms = (time.perf_counter() - start) * 1000
+        engine_us = timed(engine.analyze, messages)
+        linear_us = timed(lambda m: linear_scan(rules, m), messages)
+        print(f"{engine.rule_count:>8} {compile_ms:>14.1f} {len(engine._automaton):>9} "
+              f"{engine_us:>15.1f} {linear_us:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/fake_mysql.py
+"""
+Banco substituto para os benchmarks: o backend SQLite embutido do storage.py
+(conexões no formato do mysql.connector sobre um arquivo em WAL, com tradução do
+dialeto MySQL) instalado no lugar de mysql.connector.connect, para rodar o app
+inalterado. Conta e cronometra as consultas, no total e por thread, para o
+relatório de consultas por requisição.
+
+Não é um MySQL: planos, locks e isolamento são os do SQLite. Serve para comparar
+versões do código entre si, não para prever a latência em produção.
+"""
+
+import threading
+import time
+
+import mysql.connector
+
+import storage
+
+
+class QueryStats:
+    """Contadores de consultas: total do processo e por thread (uma requisição por vez)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.total = 0
+        self.total_time = 0.0
+
+    def record(self, elapsed):
+        with self._lock:
+            self.total += 1
+            self.total_time += elapsed
+        self._local.count = getattr(self._local, 'count', 0) + 1
+        self._local.time = getattr(self._local, 'time', 0.0) + elapsed
+
+    def thread_counters(self):
+        return getattr(self._local, 'count', 0), getattr(self._local, 'time', 0.0)
+
+
+stats = QueryStats()
+
+
+class FakeCursor(storage.SQLiteCursor):
+    def execute(self, operation, params=()):
+        start = time.perf_counter()
+        try:
+            super().execute(operation, params)
+        finally:
+            stats.record(time.perf_counter() - start)
+
+    def executemany(self, operation, seq_params):
+        start = time.perf_counter()
+        try:
+            super().executemany(operation, seq_params)
+        finally:
+            stats.record(time.perf_counter() - start)
+
+
+class FakeConnection(storage.SQLiteConnection):
+    cursor_class = FakeCursor
+
+
+def create_schema(path):
+    storage.create_sqlite_schema(path)
+
+
+def install(path):
+    """Faz mysql.connector.connect abrir conexões com o banco SQLite em `path`"""
+    mysql.connector.connect = lambda **config: FakeConnection(path)
@@ -0,0 +1,320 @@
+# benchmarks/load_test.py
+"""
+Teste de carga reprodutível do app: sobe o Flask em processo contra o banco
+substituto (benchmarks/fake_mysql.py) e um Ollama falso, semeia uma knowledge_base
+e um histórico sintéticos e roda uma carga mista em /api/chat, /api/audit e nas
+páginas de admin. O resultado (vazão, p50/p95/p99 e consultas por requisição, no
+total e por rota) sai em JSON para comparar entre commits.
+
+Uso: python benchmarks/load_test.py [--requests 2000] [--concurrency 8] [--kb-size 2000]
+                                    [--conversations 2000] [--output resultado.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_mysql  # noqa: E402
+
+ADMIN_PASSWORD = 'benchmark'
+
+TOPICS = ['edi', 'teia_card', 'van', 'sftp', 'conciliação', 'boleto', 'pix', 'cielo', 'rede', 'getnet']
+WORDS = ['arquivo', 'retorno', 'remessa', 'extrato', 'banco', 'cliente', 'layout', 'processamento',
+         'erro', 'envio', 'prazo', 'cadastro', 'fechamento', 'adquirente', 'integração', 'tarifa']
+COMPANIES = ['Netunna', 'Acme', 'Varejo Sul', 'Rede Norte', 'Mercado Azul']
+ERPS = ['TOTVS', 'SAP', 'Oracle', 'Senior', None]
+
+CHAT_TEMPLATES = {
+    'kb': None,  # perguntas da própria knowledge_base
+    'greeting': ["Oi, tudo bem?", "Olá, bom dia", "boa tarde"],
+    'profile': ["Meu nome é {name}", "Trabalho na empresa {company}", "Usamos o ERP {erp}"],
+    'unknown': ["Qual o horário de {w1} do {w2}?", "Vocês fazem {w1} de {w2} no sábado?",
+                "Quanto custa o {w1} para {w2}?"],
+    'farewell': ["obrigado, até logo", "valeu, tchau"],
+}
+
+
+# === DADOS SINTÉTICOS ===
+
+def kb_question(i, rng):
+    return f"Como funciona o {rng.choice(WORDS)} de {rng.choice(WORDS)} no {TOPICS[i % len(TOPICS)]} #{i}?"
+
+
+def seed(path, kb_size, users, conversations, messages_per_conversation, unknown, rng):
+    """Preenche o banco substituto e devolve as perguntas da knowledge_base"""
+    import sqlite3
+    fake_mysql.create_schema(path)
+    db = sqlite3.connect(path)
+    now = datetime.now()
+
+    questions = [kb_question(i, rng) for i in range(kb_size)]
+    db.executemany("""
+        INSERT INTO knowledge_base (question, answer, category, keywords, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(q, f"Resposta sintética {i}: " + " ".join(rng.choices(WORDS, k=30)), TOPICS[i % len(TOPICS)],
+           ",".join(rng.sample(WORDS, 5)), now, now) for i, q in enumerate(questions)])
+
+    db.executemany("INSERT INTO users (id, created_at) VALUES (?, ?)", [(u, now) for u in range(1, users + 1)])
+    db.execute("INSERT OR IGNORE INTO users (id, created_at) VALUES (99, ?)", (now,))
+    db.executemany("""
+        INSERT INTO user_profiles (user_id, name, company, erp, updated_at) VALUES (?, ?, ?, ?, ?)
+    """, [(u, f"Usuário {u}", rng.choice(COMPANIES), rng.choice(ERPS), now) for u in range(1, users + 1)])
+
+    conv_rows, summary_rows, message_rows, audit_rows = [], [], [], []
+    message_id = 0
+    for cid in range(1, conversations + 1):
+        user_id = rng.randint(1, users)
+        started = now - timedelta(minutes=rng.randint(60, 60 * 24 * 90))
+        status = 'closed' if cid < conversations - users else 'active'
+        conv_rows.append((cid, user_id, started, status))
+        last_user = None
+        for n in range(messages_per_conversation):
+            sent = started + timedelta(seconds=30 * n)
+            message_id += 1
+            if n % 2 == 0:
+                last_user = rng.choice(questions)
+                message_rows.append((message_id, cid, last_user, 1, sent))
+            else:
+                answer = f"Resposta sintética {rng.randint(0, kb_size)}"
+                message_rows.append((message_id, cid, answer, 0, sent))
+                audit_rows.append((cid, last_user, answer, 'kb', sent - timedelta(seconds=30), sent))
+        summary_rows.append((cid, user_id, status, started, messages_per_conversation,
+                             started + timedelta(seconds=30 * messages_per_conversation), last_user))
+    db.executemany("INSERT INTO conversations (id, user_id, started_at, status) VALUES (?, ?, ?, ?)", conv_rows)
+    db.executemany("""
+        INSERT INTO messages (id, conversation_id, message_text, is_from_user, sent_at) VALUES (?, ?, ?, ?, ?)
+    """, message_rows)
+    db.executemany("""
+        INSERT INTO audit_pairs (conversation_id, question, answer, intent, asked_at, answered_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, sorted(audit_rows, key=lambda r: r[4]))
+    db.executemany("""
+        INSERT INTO conversation_summaries (conversation_id, user_id, status, started_at, message_count,
+                                            last_message_at, last_user_message)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, summary_rows)
+    db.execute("""
+        UPDATE conversation_summaries SET
+            name = (SELECT name FROM user_profiles p WHERE p.user_id = conversation_summaries.user_id),
+            company = (SELECT company FROM user_profiles p WHERE p.user_id = conversation_summaries.user_id),
+            erp = (SELECT erp FROM user_profiles p WHERE p.user_id = conversation_summaries.user_id)
+    """)
+    db.executemany("""
+        INSERT INTO unknown_questions (user_id, question, conversation_id, status, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(rng.randint(1, users), f"Pergunta sem resposta sobre {rng.choice(WORDS)} {i}", rng.randint(1, conversations),
+           'pending' if i % 3 else 'answered', now - timedelta(minutes=rng.randint(1, 60 * 24 * 30)))
+          for i in range(unknown)])
+    db.commit()
+    db.close()
+    return questions
+
+
+# === OLLAMA FALSO ===
+
+def start_fake_ollama(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            if body.get('stream'):
+                for word in "Resposta gerada pelo modelo de teste.".split():
+                    self.wfile.write(json.dumps({'response': word + ' ', 'done': False}).encode() + b'\n')
+                self.wfile.write(json.dumps({'response': '', 'done': True}).encode() + b'\n')
+            else:
+                self.wfile.write(json.dumps({'response': "Resposta gerada pelo modelo de teste."}).encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# === CARGA ===
+
+def build_workload(n, mix, questions, users, conversations, rng):
+    """Lista de (rota, método, caminho, corpo) na proporção de `mix`"""
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=n)
+    workload = []
+    for kind in kinds:
+        if kind == 'chat':
+            style = rng.choices(['kb', 'greeting', 'profile', 'unknown', 'farewell'], [60, 10, 10, 15, 5])[0]
+            if style == 'kb':
+                message = rng.choice(questions)
+            else:
+                message = rng.choice(CHAT_TEMPLATES[style]).format(
+                    name=f"Pessoa{rng.randint(1, 999)}", company=rng.choice(COMPANIES),
+                    erp=rng.choice([e for e in ERPS if e]), w1=rng.choice(WORDS), w2=rng.choice(WORDS))
+            workload.append(('/api/chat', 'POST', '/api/chat',
+                             {'message': message, 'user_id': rng.randint(1, users)}))
+        elif kind == 'audit':
+            path = '/api/audit?limit=100'
+            if rng.random() < 0.5:
+                path += f"&before={rng.randint(1, conversations * 2)}"
+            workload.append(('/api/audit', 'GET', path, None))
+        else:
+            route = rng.choice(['/admin/dashboard', '/admin/historics', '/admin/learn', '/admin/conversa'])
+            path = route
+            if route == '/admin/conversa':
+                path = f"/admin/conversa/{rng.randint(1, conversations)}"
+            elif route == '/admin/historics' and rng.random() < 0.3:
+                path += f"?company={rng.choice(COMPANIES)}"
+            workload.append((route, 'GET', path, None))
+    return workload
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples, duration):
+    latencies = sorted(s['latency'] for s in samples)
+    n = len(samples)
+    return {
+        'requests': n,
+        'errors': sum(1 for s in samples if s['status'] >= 400),
+        'throughput_rps': round(n / duration, 1) if duration else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if n else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if n else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if n else None,
+        'mean_ms': round(sum(latencies) / n * 1000, 2) if n else None,
+        'queries_per_request': round(sum(s['queries'] for s in samples) / n, 2) if n else None,
+        'db_ms_per_request': round(sum(s['db_time'] for s in samples) / n * 1000, 3) if n else None,
+    }
+
+
+def run_worker(app, items, samples, lock):
+    client = app.test_client()
+    client.post('/admin/login', data={'password': ADMIN_PASSWORD})
+    local = []
+    for route, method, path, body in items:
+        queries_before, db_time_before = fake_mysql.stats.thread_counters()
+        start = time.perf_counter()
+        if method == 'POST':
+            response = client.post(path, json=body)
+        else:
+            response = client.get(path)
+        response.get_data()
+        latency = time.perf_counter() - start
+        queries_after, db_time_after = fake_mysql.stats.thread_counters()
+        local.append({'route': route, 'status': response.status_code, 'latency': latency,
+                      'queries': queries_after - queries_before, 'db_time': db_time_after - db_time_before})
+    with lock:
+        samples.extend(local)
+
+
+def run(app, workload, concurrency):
+    samples, lock = [], threading.Lock()
+    slices = [workload[i::concurrency] for i in range(concurrency)]
+    threads = [threading.Thread(target=run_worker, args=(app, s, samples, lock)) for s in slices]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - start
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do chatbot com banco substituto")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--kb-size', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--messages-per-conversation', type=int, default=10)
+    parser.add_argument('--unknown', type=int, default=1000)
+    parser.add_argument('--mix', default='chat=70,audit=15,admin=15', help="pesos de chat/audit/admin")
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="segundos por resposta do Ollama falso")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='ednna-bench-')
+    db_path = os.path.join(workdir, 'bench.sqlite3')
+    seed_start = time.perf_counter()
+    questions = seed(db_path, args.kb_size, args.users, args.conversations, args.messages_per_conversation,
+                     args.unknown, rng)
+    seed_time = time.perf_counter() - seed_start
+
+    ollama = start_fake_ollama(args.llm_latency)
+    os.environ.update({
+        'OLLAMA_URL': f"http://127.0.0.1:{ollama.server_address[1]}",
+        'ADMIN_PASSWORD': ADMIN_PASSWORD,
+        'LLM_CACHE_PATH': os.path.join(workdir, 'llm_cache.sqlite3'),
+        'HISTORY_BACKING_PATH': os.path.join(workdir, 'history.sqlite3'),
+        'ASYNC_LOGGING_SPILL_PATH': os.path.join(workdir, 'write_behind_spill.jsonl'),
+        'KB_SNAPSHOT_PATH': os.path.join(workdir, 'kb_snapshot.bin'),
+        # Todas as requisições saem do mesmo IP e de poucos usuários: o teste mede o
+        # pipeline, não o limite de taxa (os limites de concorrência continuam ativos)
+        'CHAT_RATE_PER_IP': '0',
+        'CHAT_RATE_PER_USER': '0',
+    })
+    fake_mysql.install(db_path)
+    import logging
+    logging.disable(logging.WARNING)
+    from app import app  # noqa: E402 (importado depois de instalar o banco substituto)
+
+    run(app, build_workload(args.warmup, parse_mix(args.mix), questions, args.users, args.conversations, rng),
+        args.concurrency)
+    workload = build_workload(args.requests, parse_mix(args.mix), questions, args.users, args.conversations, rng)
+    samples, duration = run(app, workload, args.concurrency)
+
+    routes = sorted({s['route'] for s in samples})
+    result = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': dict(vars(args), seed_seconds=round(seed_time, 2),
+                       async_logging=os.getenv('ASYNC_LOGGING', '0') == '1'),
+        'duration_s': round(duration, 3),
+        'overall': summarize(samples, duration),
+        'routes': {route: summarize([s for s in samples if s['route'] == route], duration) for route in routes},
+    }
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+    ollama.shutdown()
+
+
+if __name__ == "__main__":
+    main()
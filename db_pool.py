@@ -0,0 +1,198 @@
+# db_pool.py
+"""
+Pool de conexões MySQL com overflow, validação (pre-ping) e reciclagem por idade.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo de espera"""
+
+
+class PooledConnection:
+    """Proxy da conexão real: close() devolve a conexão ao pool em vez de fechá-la"""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._raw.cursor(*args, **kwargs)
+        wrap = self._pool.cursor_wrapper
+        return wrap(cursor) if wrap else cursor
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Mantém até `size` conexões ociosas e permite até `max_overflow` conexões extras
+    em picos. Conexões mais velhas que `recycle` segundos são descartadas, e as que
+    ficaram ociosas mais de `pre_ping_after` segundos são validadas antes do uso.
+    Se informado, `cursor_wrapper(cursor)` envolve todo cursor aberto pelas conexões,
+    e `connect()` substitui mysql.connector.connect(**db_config) na abertura delas.
+    """
+
+    def __init__(self, db_config, size=5, max_overflow=10, timeout=30,
+                 recycle=3600, pre_ping=True, pre_ping_after=30, cursor_wrapper=None, connect=None):
+        self.db_config = db_config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.cursor_wrapper = cursor_wrapper
+        self.connect = connect
+        self.pre_ping_after = pre_ping_after
+        self._idle = deque()  # (conexão, criada_em, ociosa_desde)
+        self._cond = threading.Condition()
+        self._total = 0
+        self._in_use = 0
+        self._stats = {
+            'created': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'checkouts': 0,
+        }
+
+    def _connect(self):
+        if self.connect:
+            return self.connect()
+        return mysql.connector.connect(**self.db_config)
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, raw, created_at, idle_since):
+        now = time.time()
+        if self.recycle and now - created_at > self.recycle:
+            with self._cond:
+                self._stats['recycled'] += 1
+            return False
+        if self.pre_ping and now - idle_since > self.pre_ping_after:
+            # is_connected() faz um ping no servidor (fora do lock)
+            if not raw.is_connected():
+                with self._cond:
+                    self._stats['ping_failures'] += 1
+                return False
+        return True
+
+    def acquire(self, timeout=None):
+        """Retira uma conexão do pool, criando uma nova se houver vaga"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None
+        waited_since = None
+        while True:
+            with self._cond:
+                candidate = None
+                if self._idle:
+                    candidate = self._idle.pop()
+                    self._in_use += 1
+                elif self._total < self.size + self.max_overflow:
+                    self._total += 1
+                    self._in_use += 1
+                else:
+                    if waited_since is None:
+                        waited_since = time.time()
+                        deadline = waited_since + timeout
+                        self._stats['waits'] += 1
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        self._stats['wait_time'] += time.time() - waited_since
+                        raise PoolTimeoutError(
+                            f"Pool esgotado: {self._in_use} conexões em uso após {timeout}s")
+                    self._cond.wait(remaining)
+                    continue
+                if waited_since is not None:
+                    self._stats['wait_time'] += time.time() - waited_since
+                self._stats['checkouts'] += 1
+
+            if candidate is not None:
+                raw, created_at, idle_since = candidate
+                if self._is_usable(raw, created_at, idle_since):
+                    return PooledConnection(self, raw, created_at)
+                self._discard(raw)
+                with self._cond:
+                    self._total -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                continue
+
+            # Abre a conexão fora do lock para não bloquear as outras threads
+            try:
+                raw = self._connect()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+            return PooledConnection(self, raw, time.time())
+
+    def _release(self, raw, created_at):
+        # Sem ping aqui: a validade da conexão fica para o pre-ping da retirada
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception as e:
+            logger.warning(f"Conexão descartada ao devolver ao pool: {e}")
+            self._discard(raw)
+            raw = None
+        with self._cond:
+            self._in_use -= 1
+            if raw is not None and len(self._idle) < self.size:
+                self._idle.append((raw, created_at, time.time()))
+            else:
+                self._total -= 1
+                if raw is not None:
+                    self._discard(raw)
+            self._cond.notify()
+
+    def dispose(self):
+        """Fecha todas as conexões ociosas"""
+        with self._cond:
+            while self._idle:
+                raw, _, _ = self._idle.pop()
+                self._discard(raw)
+                self._total -= 1
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats,
+                        size=self.size,
+                        max_overflow=self.max_overflow,
+                        total=self._total,
+                        idle=len(self._idle),
+                        in_use=self._in_use,
+                        wait_time=round(self._stats['wait_time'], 4))
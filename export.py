@@ -0,0 +1,213 @@
+# export.py
+"""
+Exportação em massa das conversas (JSONL, CSV ou texto, com gzip opcional).
+As linhas vêm de um cursor sem buffer e passam por geradores, então o uso de
+memória é constante qualquer que seja o volume exportado.
+
+Uso: python export.py --format jsonl --gzip --from 2025-01-01 --to 2025-01-31 -o conversas.jsonl.gz
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+FORMATS = {
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv', 'csv'),
+    'txt': ('text/plain', 'txt'),
+}
+
+CSV_COLUMNS = ['conversation_id', 'user_id', 'company', 'started_at', 'sent_at', 'sender', 'message_text']
+
+
+def build_query(filters):
+    """
+    Monta a consulta a partir dos filtros (from/to em datetime, user_id, company,
+    erp, status, conversation_id)
+    """
+    where, params = [], []
+    for field in ('conversation_id', 'user_id', 'company', 'erp', 'status'):
+        if filters.get(field):
+            where.append(f"s.{field} = %s")
+            params.append(filters[field])
+    if filters.get('from'):
+        where.append("s.started_at >= %s")
+        params.append(filters['from'])
+    if filters.get('to'):
+        where.append("s.started_at < %s")
+        params.append(filters['to'] + timedelta(days=1))
+    query = f"""
+        SELECT s.conversation_id, s.user_id, s.company, s.started_at,
+               m.is_from_user, m.message_text, m.sent_at
+        FROM conversation_summaries s
+        JOIN messages m ON m.conversation_id = s.conversation_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY s.conversation_id, m.sent_at, m.id
+    """
+    return query, params
+
+
+def iter_rows(connection, filters, batch_size=1000):
+    """Linhas da exportação lidas aos poucos de um cursor sem buffer"""
+    query, params = build_query(filters)
+    cursor = connection.cursor(dictionary=True, buffered=False)
+    done = False
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                done = True
+                break
+            yield from rows
+    finally:
+        # Download interrompido: o resto do resultado precisa ser lido antes de a
+        # conexão voltar ao pool, senão a próxima consulta falha com "Unread result"
+        if not done:
+            try:
+                while cursor.fetchmany(batch_size):
+                    pass
+            except Exception:
+                pass
+        cursor.close()
+
+
+def text_line(row):
+    sender = "Usuário" if row['is_from_user'] else "Ednna"
+    return f"[{row['sent_at'].strftime('%d/%m %H:%M')}] {sender}: {row['message_text']}\n"
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps({
+            'conversation_id': row['conversation_id'],
+            'user_id': row['user_id'],
+            'company': row['company'],
+            'started_at': row['started_at'],
+            'sent_at': row['sent_at'],
+            'sender': 'user' if row['is_from_user'] else 'bot',
+            'message_text': row['message_text'],
+        }, ensure_ascii=False, default=str) + '\n'
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow([row['conversation_id'], row['user_id'], row['company'], row['started_at'],
+                         row['sent_at'], 'user' if row['is_from_user'] else 'bot', row['message_text']])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_text(rows):
+    """Mesmo layout do antigo /admin/exportar/<id>, uma conversa após a outra"""
+    current = None
+    for row in rows:
+        if row['conversation_id'] != current:
+            if current is not None:
+                yield "\n"
+            current = row['conversation_id']
+            yield f"CONVERSA #{current} - {row['started_at']}\n"
+            yield f"USER ID: {row['user_id']}\n\n"
+        yield text_line(row)
+
+
+def iter_export(rows, fmt):
+    if fmt == 'jsonl':
+        return iter_jsonl(rows)
+    if fmt == 'csv':
+        return iter_csv(rows)
+    return iter_text(rows)
+
+
+def iter_bytes(chunks, compress=False, flush_size=64 * 1024):
+    """Codifica em UTF-8 e, se pedido, comprime em gzip à medida que os pedaços chegam"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= flush_size:
+            data = b''.join(pending)
+            pending, pending_size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(pending)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def parse_filters(args):
+    """Filtros a partir de um dicionário de strings (query string ou argumentos da CLI)"""
+    filters = {}
+    for key in ('from', 'to'):
+        if args.get(key):
+            filters[key] = datetime.strptime(args[key], '%Y-%m-%d')
+    for key in ('user_id', 'conversation_id'):
+        if args.get(key):
+            filters[key] = int(args[key])
+    for key in ('company', 'erp', 'status'):
+        if args.get(key) and args[key].strip():
+            filters[key] = args[key].strip()
+    return filters
+
+
+def main():
+    import mysql.connector
+    from config import DB_CONFIG
+
+    parser = argparse.ArgumentParser(description="Exporta conversas do chatbot")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='jsonl')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--from', dest='from_', metavar='YYYY-MM-DD')
+    parser.add_argument('--to', metavar='YYYY-MM-DD')
+    parser.add_argument('--user-id')
+    parser.add_argument('--company')
+    parser.add_argument('--erp')
+    parser.add_argument('--status', choices=['active', 'closed'])
+    parser.add_argument('-o', '--output', help="arquivo de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    filters = parse_filters({'from': args.from_, 'to': args.to, 'user_id': args.user_id,
+                             'company': args.company, 'erp': args.erp, 'status': args.status})
+    conn = mysql.connector.connect(**DB_CONFIG)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    start = time.time()
+    rows = 0
+    total_bytes = 0
+
+    def counted(source):
+        nonlocal rows
+        for row in source:
+            rows += 1
+            yield row
+
+    try:
+        chunks = iter_export(counted(iter_rows(conn, filters)), args.format)
+        for data in iter_bytes(chunks, compress=args.gzip):
+            out.write(data)
+            total_bytes += len(data)
+    finally:
+        if args.output:
+            out.close()
+        conn.close()
+    elapsed = time.time() - start
+    print(f"{rows} mensagens exportadas ({total_bytes} bytes) em {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# history_store.py
+"""
+Histórico de conversa no servidor, indexado pelo id de sessão guardado no cookie.
+Cada sessão é um buffer circular (deque com maxlen) em memória, com despejo das
+sessões ociosas e persistência num arquivo SQLite compartilhado entre os workers
+(sem `backing_path`, o histórico fica só na memória do processo).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class HistoryStore:
+    """Últimos `max_turns` turnos por sessão; acesso às pontas em O(1)"""
+
+    def __init__(self, max_turns=20, idle_ttl=3600, max_sessions=50000, backing_path=None):
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.backing_path = backing_path
+        self._sessions = OrderedDict()  # session_id -> [deque de turnos, visto_em, versão]
+        self._lock = threading.Lock()
+        self._db = None
+        self._ops = 0
+        self.stats = {'sessions_evicted': 0, 'backing_loads': 0}
+
+    # === PERSISTÊNCIA OPCIONAL ===
+
+    def _conn(self):
+        if self._db is None:
+            directory = os.path.dirname(self.backing_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.backing_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    last_seen REAL NOT NULL
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS chat_turns (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_last_seen ON chat_sessions (last_seen)")
+            self._db.commit()
+        return self._db
+
+    def _backing_version(self, db, session_id):
+        row = db.execute("SELECT version FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _load(self, db, session_id, version):
+        rows = db.execute("""
+            SELECT role, text, timestamp FROM chat_turns
+            WHERE session_id = ? ORDER BY seq DESC LIMIT ?
+        """, (session_id, self.max_turns)).fetchall()
+        turns = deque(({'role': r, 'text': t, 'timestamp': ts} for r, t, ts in reversed(rows)),
+                      maxlen=self.max_turns)
+        self.stats['backing_loads'] += 1
+        return [turns, time.time(), version]
+
+    # === API ===
+
+    def _entry(self, session_id, create=False):
+        """Entrada em memória da sessão, recarregada do SQLite se outro worker a alterou"""
+        entry = self._sessions.get(session_id)
+        if self.backing_path:
+            db = self._conn()
+            version = self._backing_version(db, session_id)
+            if entry is None or entry[2] != version:
+                entry = self._load(db, session_id, version) if version else None
+        if entry is None and create:
+            entry = [deque(maxlen=self.max_turns), time.time(), 0]
+        if entry is not None:
+            entry[1] = time.time()
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+        return entry
+
+    def append(self, session_id, role, text):
+        turn = {'role': role, 'text': text, 'timestamp': str(datetime.now())}
+        try:
+            with self._lock:
+                entry = self._entry(session_id, create=True)
+                entry[0].append(turn)
+                if self.backing_path:
+                    entry[2] = self._persist(session_id, entry[2], turn)
+                self._ops += 1
+                if self._ops % 500 == 0 or len(self._sessions) > self.max_sessions:
+                    self._evict_idle()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar histórico da sessão: {e}")
+        return turn
+
+    def _persist(self, session_id, version, turn):
+        db = self._conn()
+        version += 1
+        db.execute("""
+            INSERT INTO chat_turns (session_id, seq, role, text, timestamp) VALUES (?, ?, ?, ?, ?)
+        """, (session_id, version, turn['role'], turn['text'], turn['timestamp']))
+        db.execute("DELETE FROM chat_turns WHERE session_id = ? AND seq <= ?",
+                   (session_id, version - self.max_turns))
+        db.execute("""
+            INSERT INTO chat_sessions (session_id, version, last_seen) VALUES (?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET version = excluded.version, last_seen = excluded.last_seen
+        """, (session_id, version, time.time()))
+        db.commit()
+        return version
+
+    def turn(self, session_id, index):
+        """Turno na posição `index` (negativo conta do fim), ou None"""
+        try:
+            with self._lock:
+                entry = self._entry(session_id)
+                if entry is None:
+                    return None
+                turns = entry[0]
+                if -len(turns) <= index < len(turns):
+                    return turns[index]
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao ler histórico da sessão: {e}")
+        return None
+
+    def recent(self, session_id, n=None):
+        """Os últimos n turnos (todos os guardados, se n for None)"""
+        try:
+            with self._lock:
+                entry = self._entry(session_id)
+                if entry is None:
+                    return []
+                turns = list(entry[0])
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao ler histórico da sessão: {e}")
+            return []
+        return turns[-n:] if n else turns
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self.backing_path:
+                db = self._conn()
+                db.execute("DELETE FROM chat_turns WHERE session_id = ?", (session_id,))
+                db.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+                db.commit()
+
+    def _evict_idle(self):
+        """Despeja sessões ociosas (e o excesso além de max_sessions, das mais antigas)"""
+        cutoff = time.time() - self.idle_ttl
+        evicted = 0
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry[1] >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            evicted += 1
+        if self.backing_path:
+            db = self._conn()
+            db.execute("""
+                DELETE FROM chat_turns WHERE session_id IN (
+                    SELECT session_id FROM chat_sessions WHERE last_seen < ?
+                )
+            """, (cutoff,))
+            db.execute("DELETE FROM chat_sessions WHERE last_seen < ?", (cutoff,))
+            db.commit()
+        self.stats['sessions_evicted'] += evicted
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def metrics(self):
+        return dict(self.stats, sessions=len(self._sessions), max_turns=self.max_turns)
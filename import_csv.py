@@ -1,10 +1,20 @@
+import argparse
+import os
+import time
+
+import numpy as np
 import pandas as pd
 import mysql.connector
-from datetime import datetime
 
 # Configurações do banco de dados
 from config import DB_CONFIG
 
+CSV_PATH = "data/issues.csv"
+CHUNK_SIZE = 5000
+
+# Só um importador por vez: os IDs novos são reservados a partir do MAX() atual
+IMPORT_LOCK = "edi_import_csv"
+
 
 # Função para conectar ao banco de dados
 def conectar_db():
@@ -16,138 +26,289 @@ def conectar_db():
     )
 
 
-# Função para inserir clientes
-def inserir_cliente(cursor, cliente_nome, cnpj=None, contato=None):
-    cursor.execute("""
-        INSERT INTO Clientes (Nome_Cliente, CNPJ, Contato)
-        VALUES (%s, %s, %s)
-        ON DUPLICATE KEY UPDATE Nome_Cliente=VALUES(Nome_Cliente)
-    """, (cliente_nome, cnpj, contato))
-    return cursor.lastrowid
-
-
-# Função para inserir players
-def inserir_player(cursor, player_nome, tipo_player, detalhes=None):
+SQL_CLIENTES = """
+    INSERT INTO Clientes (ID_Cliente, Nome_Cliente, CNPJ, Contato)
+    VALUES (%s, %s, %s, %s)
+"""
+
+SQL_PLAYERS = """
+    INSERT INTO Players (ID_Player, Nome_Player, Tipo_Player, Detalhes)
+    VALUES (%s, %s, %s, %s)
+"""
+
+# Upserts: reimportar um chamado atualiza o chamado e a operação dele no lugar
+SQL_OPERACOES = """
+    INSERT INTO Operacoes (ID_Operacao, ID_Cliente, ID_Player, Tipo_Operacao, Descricao_Problema, Status,
+                           Data_Cadastro)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE ID_Cliente = VALUES(ID_Cliente), ID_Player = VALUES(ID_Player),
+        Tipo_Operacao = VALUES(Tipo_Operacao), Descricao_Problema = VALUES(Descricao_Problema),
+        Status = VALUES(Status), Data_Cadastro = VALUES(Data_Cadastro)
+"""
+
+SQL_CHAMADOS = """
+    INSERT INTO Chamados_Redmine (
+        ID_Chamado, ID_Operacao, Tipo_Problema, Estado, Prioridade, Assunto, Autor,
+        Data_Inicio, Data_Fim, Data_Alterado, Data_Criado, Observacoes
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE Tipo_Problema = VALUES(Tipo_Problema), Estado = VALUES(Estado),
+        Prioridade = VALUES(Prioridade), Assunto = VALUES(Assunto), Autor = VALUES(Autor),
+        Data_Inicio = VALUES(Data_Inicio), Data_Fim = VALUES(Data_Fim),
+        Data_Alterado = VALUES(Data_Alterado), Data_Criado = VALUES(Data_Criado)
+"""
+
+# Linha de Importacao_Redmine (migrations/0002) com a marca d'água e o checkpoint
+FONTE = "redmine"
+
+
+def proximo_id(cursor, table, id_column):
+    cursor.execute(f"SELECT COALESCE(MAX({id_column}), 0) FROM {table}")
+    return cursor.fetchone()[0] + 1
+
+
+class IdMap:
+    """Nome -> ID já gravado, com reserva local dos próximos IDs de AUTO_INCREMENT"""
+
+    def __init__(self, cursor, table, id_column, name_column):
+        cursor.execute(f"SELECT {id_column}, {name_column} FROM {table}")
+        self.ids = {}
+        for id_, nome in cursor.fetchall():
+            self.ids.setdefault(nome, id_)
+        self.next_id = proximo_id(cursor, table, id_column)
+
+    def reserve(self, names):
+        """Reserva IDs para os nomes ainda desconhecidos; devolve [(id, nome)] a inserir"""
+        novos = []
+        for nome in names:
+            if nome not in self.ids:
+                self.ids[nome] = self.next_id
+                novos.append((self.next_id, nome))
+                self.next_id += 1
+        return novos
+
+
+def assinatura_arquivo(path, chunksize):
+    """Caminho, tamanho e mtime do arquivo mais o chunksize: o checkpoint é um número de chunk"""
+    info = os.stat(path)
+    return f"{os.path.abspath(path)}|{info.st_size}|{int(info.st_mtime)}|{chunksize}"
+
+
+def ler_estado(cursor):
     cursor.execute("""
-        INSERT INTO Players (Nome_Player, Tipo_Player, Detalhes)
-        VALUES (%s, %s, %s)
-        ON DUPLICATE KEY UPDATE Nome_Player=VALUES(Nome_Player)
-    """, (player_nome, tipo_player, detalhes))
-    return cursor.lastrowid
+        SELECT Watermark, Arquivo, Ultimo_Chunk, Max_Alterado FROM Importacao_Redmine WHERE Fonte = %s
+    """, (FONTE,))
+    row = cursor.fetchone()
+    return dict(zip(("watermark", "arquivo", "ultimo_chunk", "max_alterado"), row or (None,) * 4))
 
 
-# Função para inserir operações
-def inserir_operacao(cursor, id_cliente, id_player, tipo_operacao, descricao, status, data_cadastro):
+def gravar_estado(cursor, watermark, arquivo, ultimo_chunk, max_alterado):
     cursor.execute("""
-        INSERT INTO Operacoes (ID_Cliente, ID_Player, Tipo_Operacao, Descricao_Problema, Status, Data_Cadastro)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (id_cliente, id_player, tipo_operacao, descricao, status, data_cadastro))
-    return cursor.lastrowid
+        INSERT INTO Importacao_Redmine (Fonte, Watermark, Arquivo, Ultimo_Chunk, Max_Alterado, Atualizado_Em)
+        VALUES (%s, %s, %s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE Watermark = VALUES(Watermark), Arquivo = VALUES(Arquivo),
+            Ultimo_Chunk = VALUES(Ultimo_Chunk), Max_Alterado = VALUES(Max_Alterado), Atualizado_Em = NOW()
+    """, (FONTE, watermark, arquivo, ultimo_chunk, max_alterado))
 
 
-# Função para inserir chamados
-def inserir_chamado(cursor, id_chamado, id_operacao, tipo_problema, estado, prioridade, assunto, autor,
-                    data_inicio, data_fim, data_alterado, data_criado, observacoes):
-    cursor.execute("""
-        INSERT INTO Chamados_Redmine (
-            ID_Chamado, ID_Operacao, Tipo_Problema, Estado, Prioridade, Assunto, Autor,
-            Data_Inicio, Data_Fim, Data_Alterado, Data_Criado, Observacoes
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (id_chamado, id_operacao, tipo_problema, estado, prioridade, assunto, autor, data_inicio, data_fim,
-          data_alterado, data_criado, observacoes))
+def operacoes_existentes(cursor, ids_chamado):
+    """ID_Chamado -> ID_Operacao dos chamados do chunk que já estão no banco"""
+    placeholders = ", ".join(["%s"] * len(ids_chamado))
+    cursor.execute(f"SELECT ID_Chamado, ID_Operacao FROM Chamados_Redmine WHERE ID_Chamado IN ({placeholders})",
+                   ids_chamado)
+    return dict(cursor.fetchall())
 
 
 # Função principal para importar os dados
-def importar_csv():
-    # Conectar ao banco de dados
+def importar_csv(path=CSV_PATH, chunksize=CHUNK_SIZE, incremental=False):
+    """
+    Importa o CSV em chunks, cada um numa transação junto com o checkpoint.
+    Com incremental=True só entram chamados com "Alterado" a partir da marca d'água
+    da última execução concluída. Uma execução interrompida sobre o mesmo arquivo,
+    com o mesmo chunksize, continua do chunk seguinte ao último gravado.
+    """
     conn = conectar_db()
     cursor = conn.cursor()
-
-    # Ler o CSV
-    df = pd.read_csv("data/issues.csv", sep=";", encoding="utf-8")
-
-    for _, row in df.iterrows():
-        # Extrair informações do CSV
-        id_chamado = int(row["#"])
-        projeto = row["Projeto"]
-        tipo_problema = row["Tipo"]
-        estado = row["Estado"]
-        prioridade = row["Prioridade"]
-        assunto = row["Assunto"]
-        autor = row["Autor"]
-        data_fim = parse_date(row["Data de fim"])
-        data_inicio = parse_date(row["Data de início"])
-        data_alterado = parse_datetime(row["Alterado"])
-        data_criado = parse_datetime(row["Criado"])
-
-        # Identificar cliente e player
-        cliente_nome = extrair_cliente(assunto)
-        player_nome, tipo_player = extrair_player(assunto)
-
-        # Inserir cliente
-        id_cliente = inserir_cliente(cursor, cliente_nome)
-
-        # Inserir player
-        id_player = inserir_player(cursor, player_nome, tipo_player)
-
-        # Inserir operação
-        tipo_operacao = mapear_tipo_operacao(tipo_problema)
-        descricao = assunto
-        status = "Aberto" if estado == "Aberto" else "Em Processamento"
-        data_cadastro = data_inicio
-        id_operacao = inserir_operacao(cursor, id_cliente, id_player, tipo_operacao, descricao, status, data_cadastro)
-
-        # Inserir chamado
-        observacoes = ""
-        inserir_chamado(cursor, id_chamado, id_operacao, tipo_problema, estado, prioridade, assunto, autor,
-                        data_inicio, data_fim, data_alterado, data_criado, observacoes)
-
-    # Commit e fechar conexão
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-
-# Funções auxiliares
-def parse_date(date_str):
-    if pd.isna(date_str) or date_str == "":
-        return None
-    return datetime.strptime(date_str, "%d/%m/%Y").date()
-
-
-def parse_datetime(datetime_str):
-    if pd.isna(datetime_str) or datetime_str == "":
-        return None
-    return datetime.strptime(datetime_str, "%d/%m/%Y %H:%M")
+    cursor.execute("SELECT GET_LOCK(%s, 10)", (IMPORT_LOCK,))
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        conn.close()
+        raise RuntimeError("Outra importação está em andamento")
+
+    start = time.time()
+    total = ignorados = 0
+    try:
+        estado = ler_estado(cursor)
+        conn.commit()
+        arquivo = assinatura_arquivo(path, chunksize)
+        watermark = estado["watermark"]
+        retomar_apos, max_alterado = -1, None
+        if estado["ultimo_chunk"] is not None and estado["arquivo"] != arquivo:
+            mesmo_arquivo, _, chunksize_gravado = estado["arquivo"].rpartition("|")
+            if mesmo_arquivo == arquivo.rpartition("|")[0]:
+                raise RuntimeError(f"Importação interrompida deste arquivo com --chunksize {chunksize_gravado}; "
+                                   f"use o mesmo valor para retomar")
+        if estado["arquivo"] == arquivo and estado["ultimo_chunk"] is not None:
+            retomar_apos, max_alterado = estado["ultimo_chunk"], estado["max_alterado"]
+            print(f"Retomando a importação após o chunk {retomar_apos}")
+
+        clientes = IdMap(cursor, "Clientes", "ID_Cliente", "Nome_Cliente")
+        players = IdMap(cursor, "Players", "ID_Player", "Nome_Player")
+        proxima_operacao = proximo_id(cursor, "Operacoes", "ID_Operacao")
+
+        chunks = pd.read_csv(path, sep=";", encoding="utf-8", dtype=str, chunksize=chunksize)
+        for numero, chunk in enumerate(chunks):
+            if numero <= retomar_apos:
+                continue
+            df = preparar_chunk(chunk)
+
+            # O "Alterado" do Redmine tem resolução de minuto: >= reprocessa o minuto da
+            # marca d'água (o upsert é idempotente) em vez de perder alterações dele.
+            # Sem "Alterado" legível não dá para comparar: o chamado conta como alterado
+            if incremental and watermark is not None:
+                alterados = df["data_alterado"].isna() | (df["data_alterado"] >= pd.Timestamp(watermark))
+                ignorados += int((~alterados).sum())
+                df = df[alterados]
+            df = df.drop_duplicates("id_chamado", keep="last").copy()
+
+            if not df.empty:
+                chunk_max = df["data_alterado"].max()
+                if pd.notna(chunk_max) and (max_alterado is None or chunk_max > pd.Timestamp(max_alterado)):
+                    max_alterado = chunk_max.to_pydatetime()
+
+                novos_clientes = clientes.reserve(df["cliente"].unique())
+                tipos = df.drop_duplicates("player").set_index("player")["tipo_player"]
+                novos_players = players.reserve(df["player"].unique())
+
+                # Chamados já importados mantêm a operação; os novos recebem IDs reservados
+                existentes = operacoes_existentes(cursor, df["id_chamado"].tolist())
+                df["id_operacao"] = df["id_chamado"].map(existentes)
+                novos = df["id_operacao"].isna()
+                df.loc[novos, "id_operacao"] = np.arange(proxima_operacao, proxima_operacao + int(novos.sum()))
+                proxima_operacao += int(novos.sum())
+                df["id_operacao"] = df["id_operacao"].astype(int)
+                df["id_cliente"] = df["cliente"].map(clientes.ids)
+                df["id_player"] = df["player"].map(players.ids)
+
+                data_inicio = valores_python(df["data_inicio"])
+                operacoes = zip(
+                    df["id_operacao"].tolist(), df["id_cliente"].tolist(), df["id_player"].tolist(),
+                    df["tipo_operacao"].tolist(), df["assunto"].tolist(), df["status"].tolist(), data_inicio
+                )
+                chamados = zip(
+                    df["id_chamado"].tolist(), df["id_operacao"].tolist(), valores_python(df["tipo"]),
+                    valores_python(df["estado"]), valores_python(df["prioridade"]), df["assunto"].tolist(),
+                    valores_python(df["autor"]), data_inicio, valores_python(df["data_fim"]),
+                    valores_python(df["data_alterado"]), valores_python(df["data_criado"]), [""] * len(df)
+                )
+
+            try:
+                if not df.empty:
+                    if novos_clientes:
+                        cursor.executemany(SQL_CLIENTES, [(id_, nome, None, None) for id_, nome in novos_clientes])
+                    if novos_players:
+                        cursor.executemany(SQL_PLAYERS,
+                                           [(id_, nome, tipos[nome], None) for id_, nome in novos_players])
+                    cursor.executemany(SQL_OPERACOES, list(operacoes))
+                    cursor.executemany(SQL_CHAMADOS, list(chamados))
+                gravar_estado(cursor, watermark, arquivo, numero, max_alterado)
+                conn.commit()
+            except mysql.connector.Error:
+                conn.rollback()
+                raise
+
+            total += len(df)
+            elapsed = time.time() - start
+            print(f"Chunk {numero}: {total} chamados gravados ({total / elapsed if elapsed else 0:.0f} linhas/s)")
+
+        # Execução concluída: a marca d'água avança e o checkpoint é limpo
+        if max_alterado is not None and (watermark is None or max_alterado > watermark):
+            watermark = max_alterado
+        gravar_estado(cursor, watermark, None, None, None)
+        conn.commit()
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (IMPORT_LOCK,))
+        cursor.fetchone()
+        cursor.close()
+        conn.close()
+
+    elapsed = time.time() - start
+    print(f"Importação concluída: {total} chamados em {elapsed:.1f}s "
+          f"({total / elapsed if elapsed else 0:.0f} linhas/s), {ignorados} sem alteração ignorados, "
+          f"marca d'água {watermark}")
+    return total
+
+
+def preparar_chunk(chunk):
+    """Converte um pedaço do CSV do Redmine nas colunas usadas pela importação, sem laço por linha"""
+    assunto = chunk["Assunto"].fillna("")
+    player = extrair_player(assunto)
+    df = pd.DataFrame({
+        "id_chamado": pd.to_numeric(chunk["#"]).astype(int),
+        "tipo": chunk["Tipo"],
+        "estado": chunk["Estado"],
+        "prioridade": chunk["Prioridade"],
+        "assunto": assunto,
+        "autor": chunk["Autor"],
+        "data_fim": parse_date(chunk["Data de fim"]),
+        "data_inicio": parse_date(chunk["Data de início"]),
+        "data_alterado": parse_datetime(chunk["Alterado"]),
+        "data_criado": parse_datetime(chunk["Criado"]),
+        "cliente": extrair_cliente(assunto),
+        "player": player,
+        "tipo_player": tipo_player(player),
+        "tipo_operacao": mapear_tipo_operacao(chunk["Tipo"].fillna("")),
+        "status": np.where(chunk["Estado"] == "Aberto", "Aberto", "Em Processamento"),
+    })
+    return df.reset_index(drop=True)
+
+
+# Funções auxiliares (operam sobre colunas inteiras)
+def parse_date(col):
+    return pd.to_datetime(col, format="%d/%m/%Y", errors="coerce").dt.date
+
+
+def parse_datetime(col):
+    return pd.to_datetime(col, format="%d/%m/%Y %H:%M", errors="coerce")
+
+
+def valores_python(col):
+    """Coluna -> lista de valores nativos (datetime, str...) com None no lugar de NaN/NaT"""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        valores = pd.Series(col.dt.to_pydatetime(), index=col.index, dtype=object)
+    else:
+        valores = col.astype(object)
+    return valores.where(col.notna(), None).tolist()
 
 
 def extrair_cliente(assunto):
-    # Exemplo: Extrair o nome do cliente do assunto
-    partes = assunto.split(" - ")
-    return partes[0].strip()
+    # Exemplo: o cliente é o trecho antes do primeiro " - " do assunto
+    return assunto.str.split(" - ", n=1).str[0].str.strip()
 
 
 def extrair_player(assunto):
-    # Exemplo: Extrair o player do assunto
-    partes = assunto.split(" - ")
-    player_nome = partes[1].strip() if len(partes) > 1 else "Desconhecido"
-    tipo_player = "Adquirente" if "TicketLog" in player_nome or "Cielo" in player_nome else "Banco"
-    return player_nome, tipo_player
+    # Exemplo: o player é o segundo trecho do assunto
+    return assunto.str.split(" - ", n=2).str[1].str.strip().fillna("Desconhecido")
+
+
+def tipo_player(player):
+    return pd.Series(np.where(player.str.contains("TicketLog|Cielo"), "Adquirente", "Banco"), index=player.index)
 
 
 def mapear_tipo_operacao(tipo_problema):
-    if "Falta de Arquivo" in tipo_problema:
-        return "Manutenção"
-    elif "Erro de Arquivo" in tipo_problema:
-        return "Manutenção"
-    elif "Cancelar tráfego" in tipo_problema:
-        return "Cancelamento"
-    elif "Abertura Relacionamento" in tipo_problema:
-        return "Abertura"
-    else:
-        return "Manutenção"
+    # "Falta de Arquivo", "Erro de Arquivo" e o restante são Manutenção
+    condicoes = [
+        tipo_problema.str.contains("Cancelar tráfego", regex=False),
+        tipo_problema.str.contains("Abertura Relacionamento", regex=False),
+    ]
+    return np.select(condicoes, ["Cancelamento", "Abertura"], default="Manutenção")
 
 
 # Executar a importação
 if __name__ == "__main__":
-    importar_csv()
+    parser = argparse.ArgumentParser(description="Importa o CSV de chamados do Redmine")
+    parser.add_argument("path", nargs="?", default=CSV_PATH)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--incremental", action="store_true",
+                        help="só chamados alterados desde a última importação concluída")
+    args = parser.parse_args()
+    importar_csv(args.path, args.chunksize, args.incremental)
@@ -0,0 +1,295 @@
+# instrumentation.py
+"""
+Instrumentação do app: histogramas e contadores no formato de exposição de texto
+do Prometheus (sem dependências), spans de tempo por etapa da requisição, contagem
+de consultas por requisição através de um cursor instrumentado e log opcional de
+requisições lentas com o detalhamento das etapas.
+
+O rastro da requisição atual fica num ContextVar, então cada thread do gunicorn
+(e o gerador de uma resposta em streaming) enxerga só o seu.
+
+Os valores ficam na memória de cada worker; toda série exposta leva o label
+`worker` (pid do processo), e o total do serviço é a soma entre os workers
+(ex.: sum without (worker) (...)). Sem ele, cada coleta caía num worker diferente
+e os contadores pareciam voltar para trás.
+"""
+
+import bisect
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: labels esperados {self.labelnames}, recebidos {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self, extra=()):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k, extra)} {_format_value(v)}"
+                                for k, v in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [contagem por faixa..., soma, total]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self, extra=()):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        extra = list(extra)
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(self.labelnames, key, extra + [('le', _format_value(float(bound)))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, extra)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, extra)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """`collect()` roda antes de cada exposição (para atualizar gauges)"""
+        self._collectors.append(collect)
+
+    def render(self):
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.error(f"Erro ao coletar métricas: {e}")
+        # pid lido na exposição: vale para o worker mesmo com o app carregado antes do fork
+        extra = [('worker', os.getpid())]
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(extra))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'ednna_request_seconds', 'Duração das requisições HTTP', ('route', 'method', 'status')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'ednna_stage_seconds', 'Duração de cada etapa instrumentada', ('stage',)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'ednna_db_query_seconds', 'Duração de cada consulta ao banco', ()))
+REQUEST_DB_QUERIES = REGISTRY.register(Histogram(
+    'ednna_request_db_queries', 'Consultas ao banco por requisição', ('route',),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)))
+CHAT_ANSWERS = REGISTRY.register(Counter(
+    'ednna_chat_answers_total', 'Respostas do chat por origem (camada de busca que respondeu)', ('tier',)))
+LLM_SECONDS = REGISTRY.register(Histogram(
+    'ednna_llm_request_seconds', 'Duração das chamadas ao Ollama', ('mode', 'outcome'),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)))
+LLM_ERRORS = REGISTRY.register(Counter(
+    'ednna_llm_errors_total', 'Falhas nas chamadas ao Ollama', ('mode', 'reason')))
+LLM_COALESCED = REGISTRY.register(Counter(
+    'ednna_llm_coalesced_total', 'Pedidos à IA atendidos por uma geração igual já em andamento', ('mode',)))
+LLM_RETRIES = REGISTRY.register(Counter(
+    'ednna_llm_retries_total', 'Novas tentativas de chamadas ao Ollama', ('reason',)))
+ADMISSION_DECISIONS = REGISTRY.register(Counter(
+    'ednna_admission_total', 'Decisões do controle de admissão (accepted, queued, shed, timeout, rate_limited)',
+    ('limiter', 'outcome')))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'ednna_admission_wait_seconds', 'Espera na fila do controle de admissão', ('limiter',)))
+ADMISSION_SLOTS = REGISTRY.register(Gauge(
+    'ednna_admission_slots', 'Vagas ocupadas e requisições na fila por limitador', ('limiter', 'state')))
+
+
+# === RASTRO POR REQUISIÇÃO ===
+
+class Trace:
+    __slots__ = ('route', 'start', 'spans', 'queries', 'query_time', 'tier', 'status')
+
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.spans = []  # (etapa, segundos)
+        self.queries = 0
+        self.query_time = 0.0
+        self.tier = None
+        self.status = None
+
+    def breakdown(self):
+        return {
+            'route': self.route,
+            'status': self.status,
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 2),
+            'queries': self.queries,
+            'query_ms': round(self.query_time * 1000, 2),
+            'tier': self.tier,
+            'spans': [{'stage': name, 'ms': round(seconds * 1000, 2)} for name, seconds in self.spans],
+        }
+
+
+_current = contextvars.ContextVar('ednna_trace', default=None)
+
+
+def start_trace(route):
+    trace = Trace(route)
+    _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+def finish_trace(trace, method, status, slow_threshold=None):
+    """Registra a requisição nos histogramas e, acima do limite, no log de lentas"""
+    _current.set(None)
+    elapsed = time.perf_counter() - trace.start
+    REQUEST_SECONDS.observe(elapsed, route=trace.route, method=method, status=status)
+    REQUEST_DB_QUERIES.observe(trace.queries, route=trace.route)
+    if slow_threshold and elapsed >= slow_threshold:
+        logger.warning(f"Requisição lenta: {json.dumps(trace.breakdown(), ensure_ascii=False)}")
+    return elapsed
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.spans.append((stage, elapsed))
+
+
+def record_tier(tier):
+    CHAT_ANSWERS.inc(tier=tier)
+    trace = _current.get()
+    if trace is not None:
+        trace.tier = tier
+
+
+# === CURSOR INSTRUMENTADO ===
+
+class InstrumentedCursor:
+    """Proxy do cursor que conta e cronometra execute/executemany"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, call):
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_QUERY_SECONDS.observe(elapsed)
+            trace = _current.get()
+            if trace is not None:
+                trace.queries += 1
+                trace.query_time += elapsed
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        return self._timed(lambda: self._cursor.execute(operation, params, *args, **kwargs))
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        return self._timed(lambda: self._cursor.executemany(operation, seq_params, *args, **kwargs))
@@ -0,0 +1,183 @@
+# intent_rules.py
+"""
+Motor de regras do chat: saudações, despedidas, temas, ERPs, normalização de termos
+e captura de perfil. Os vocabulários vêm de intent_rules.json e são compilados num
+único autômato Aho-Corasick, percorrido uma vez por mensagem.
+"""
+
+import json
+import os
+import re
+from collections import deque
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_rules.json')
+
+# Valor capturado depois do gatilho de perfil (ex.: "me chamo" -> "joão")
+CAPTURE_RE = re.compile(r'\s+(\w+)')
+
+
+class AhoCorasick:
+    """Autômato multi-padrão: encontra todas as ocorrências (inclusive sobrepostas) numa passada"""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._built = False
+
+    def add(self, word, payload):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(word), payload))
+        self._built = False
+
+    def build(self):
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                if self._fail[nxt] == nxt:
+                    self._fail[nxt] = 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def iter(self, text):
+        """Gera (início, fim, payload) para cada ocorrência"""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                end = i + 1
+                for length, payload in out[state]:
+                    yield end - length, end, payload
+
+    def __len__(self):
+        return len(self._goto)
+
+
+class RuleEngine:
+    """Classifica uma mensagem numa passada: devolve tudo o que casou"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._automaton = AhoCorasick()
+        self._order = {}
+        order = 0
+        for word, replacement in rules.get('normalizations', {}).items():
+            self._add(word, ('normalize', word, replacement), order)
+            order += 1
+        for topic, words in rules.get('topics', {}).items():
+            for word in words:
+                self._add(word, ('topic', topic, topic), order)
+            order += 1
+        for word in rules.get('greetings', []):
+            self._add(word, ('greeting', word, word), order)
+            order += 1
+        for word in rules.get('farewells', []):
+            self._add(word, ('farewell', word, word), order)
+            order += 1
+        for word, erp in rules.get('erps', {}).items():
+            self._add(word, ('erp', word, erp), order)
+            order += 1
+        for field, triggers in rules.get('profile', {}).items():
+            for trigger in triggers:
+                self._add(trigger, ('profile', field, trigger), order)
+                order += 1
+        self._automaton.build()
+
+    def _add(self, word, payload, order):
+        self._automaton.add(word.lower(), payload)
+        self._order[payload] = order
+
+    @property
+    def rule_count(self):
+        return len(self._order)
+
+    def analyze(self, text):
+        """
+        Percorre o texto (em minúsculas) uma vez e devolve:
+        normalized, topics, greetings, farewells, erps (na ordem de prioridade das
+        regras) e profile ({campo: valor capturado}).
+        """
+        low = (text or '').strip().lower()
+        hits = {'normalize': [], 'topic': [], 'greeting': [], 'farewell': [], 'erp': [], 'profile': []}
+        for start, end, payload in self._automaton.iter(low):
+            hits[payload[0]].append((start, end, payload))
+
+        def by_priority(kind):
+            seen = []
+            for _, _, payload in sorted(hits[kind], key=lambda h: self._order[h[2]]):
+                if payload[2] not in seen:
+                    seen.append(payload[2])
+            return seen
+
+        return {
+            'text': low,
+            'normalized': self._normalize(low, hits['normalize']),
+            'topics': by_priority('topic'),
+            'greetings': by_priority('greeting'),
+            'farewells': by_priority('farewell'),
+            'erps': by_priority('erp'),
+            'profile': self._capture_profile(low, hits['profile']),
+        }
+
+    def normalize(self, text):
+        low = (text or '').strip().lower()
+        hits = [h for h in self._automaton.iter(low) if h[2][0] == 'normalize']
+        return self._normalize(low, hits)
+
+    def _normalize(self, low, hits):
+        """Substituições da esquerda para a direita, sem sobreposição (a mais longa vence)"""
+        if not hits:
+            return low
+        parts = []
+        pos = 0
+        for start, end, payload in sorted(hits, key=lambda h: (h[0], -(h[1] - h[0]))):
+            if start < pos:
+                continue
+            parts.append(low[pos:start])
+            parts.append(payload[2])
+            pos = end
+        parts.append(low[pos:])
+        return ''.join(parts)
+
+    def _capture_profile(self, low, hits):
+        """Para cada campo, a ocorrência mais à esquerda (com fronteira de palavra) que captura um valor"""
+        captured = {}
+        for start, end, payload in sorted(hits, key=lambda h: (h[0], self._order[h[2]])):
+            field = payload[1]
+            if field in captured:
+                continue
+            if start > 0 and (low[start - 1].isalnum() or low[start - 1] == '_'):
+                continue
+            match = CAPTURE_RE.match(low, end)
+            if match:
+                captured[field] = match.group(1)
+        return captured
+
+
+def load_rules(path=DEFAULT_RULES_PATH):
+    """Lê o arquivo de vocabulários e compila o motor"""
+    with open(path, encoding='utf-8') as f:
+        return RuleEngine(json.load(f))
@@ -0,0 +1,251 @@
+# kb_bulk.py
+"""
+Importação e exportação em massa da knowledge_base (CSV ou JSONL).
+
+A importação valida todas as linhas e remove duplicatas em memória (a última
+ocorrência de uma pergunta vence; perguntas iguais a menos de maiúsculas, acentos
+e espaços contam como a mesma, como na collation do MySQL — no SQLite, que compara
+em binário, a busca das existentes usa a mesma chave), compara com o que já
+está gravado (novas / alteradas / iguais) e, fora do dry-run, grava tudo numa
+única transação: upserts em executemany por blocos e o fechamento das perguntas
+pendentes que o lote responde. Qualquer linha inválida cancela o lote inteiro.
+
+A exportação lê de um cursor sem buffer e gera o arquivo aos poucos, no mesmo
+formato aceito pela importação.
+
+Uso: python kb_bulk.py import ARQUIVO [--format csv|jsonl] [--dry-run] [--sqlite ARQUIVO]
+     python kb_bulk.py export [--format csv|jsonl] [--gzip] [-o ARQUIVO] [--sqlite ARQUIVO]
+"""
+
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+import time
+
+from kb_keywords import extract_keywords
+from storage import question_key
+
+FORMATS = {
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv', 'csv'),
+}
+COLUMNS = ['question', 'answer', 'category', 'keywords']
+REQUIRED = ('question', 'answer', 'category')
+MAX_LENGTHS = {'question': 255, 'category': 50}
+_SPACES_RE = re.compile(r'\s+')
+
+
+class ImportErrors(ValueError):
+    """Linhas inválidas no arquivo: [(linha, mensagem)]"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} linhas inválidas")
+        self.errors = errors
+
+
+# === LEITURA E VALIDAÇÃO ===
+
+def iter_records(text, fmt):
+    """(número da linha, dict) de cada registro do arquivo"""
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_num, ValueError(f"JSON inválido: {e.msg}")
+                continue
+            yield line_num, record if isinstance(record, dict) else ValueError("esperado um objeto JSON")
+    else:
+        raise ValueError(f"formato deve ser um de: {', '.join(sorted(FORMATS))}")
+
+
+def validate(text, fmt):
+    """
+    Valida e deduplica os registros; devolve ({chave: entrada}, duplicatas) ou
+    levanta ImportErrors com todas as linhas inválidas. Sem keywords no arquivo,
+    elas são extraídas da pergunta e da resposta.
+    """
+    entries, errors, duplicates = {}, [], 0
+    for line_num, record in iter_records(text, fmt):
+        if isinstance(record, Exception):
+            errors.append((line_num, str(record)))
+            continue
+        entry = {column: str(record.get(column) or '').strip() for column in COLUMNS}
+        missing = [column for column in REQUIRED if not entry[column]]
+        if missing:
+            errors.append((line_num, f"campos obrigatórios vazios: {', '.join(missing)}"))
+            continue
+        too_long = [column for column, limit in MAX_LENGTHS.items() if len(entry[column]) > limit]
+        if too_long:
+            errors.append((line_num, "acima do tamanho máximo: " +
+                           ", ".join(f"{column} ({MAX_LENGTHS[column]})" for column in too_long)))
+            continue
+        entry['question'] = _SPACES_RE.sub(' ', entry['question'])
+        if not entry['keywords']:
+            entry['keywords'] = extract_keywords(entry['question'], entry['answer'])
+        key = question_key(entry['question'])
+        if key in entries:
+            duplicates += 1
+        entries[key] = entry
+    if errors:
+        raise ImportErrors(errors)
+    return entries, duplicates
+
+
+# === DIFF E APLICAÇÃO ===
+
+def diff(repo, entries):
+    """Compara com a knowledge_base: {'new': [...], 'changed': [(antes, depois)], 'unchanged': n}"""
+    existing = {question_key(row['question']): row
+                for row in repo.kb_entries_by_questions([e['question'] for e in entries.values()])}
+    result = {'new': [], 'changed': [], 'unchanged': 0}
+    for key, entry in entries.items():
+        current = existing.get(key)
+        if current is None:
+            result['new'].append(entry)
+            continue
+        # Mantém a grafia gravada (como o ON DUPLICATE KEY do MySQL): o upsert cai na mesma linha
+        entry['question'] = current['question']
+        if any((current.get(column) or '') != entry[column] for column in ('answer', 'category', 'keywords')):
+            result['changed'].append(({column: current.get(column) for column in COLUMNS}, entry))
+        else:
+            result['unchanged'] += 1
+    return result
+
+
+def apply(repo, entries, chunk_size=500):
+    """
+    Grava as entradas e fecha as pendências respondidas numa única transação;
+    devolve quantas pendências foram fechadas.
+    """
+    rows = [(e['question'], e['answer'], e['category'], e['keywords']) for e in entries.values()]
+    try:
+        repo.upsert_kb_many(rows, chunk_size=chunk_size)
+        resolved = repo.close_unknown_many([e['question'] for e in entries.values()], chunk_size=chunk_size)
+        repo.connection.commit()
+    except Exception:
+        repo.connection.rollback()
+        raise
+    return resolved
+
+
+def summarize(changes, duplicates, sample=50):
+    """Resumo do diff para a resposta da API (com amostras das entradas)"""
+    return {
+        'new': len(changes['new']),
+        'changed': len(changes['changed']),
+        'unchanged': changes['unchanged'],
+        'duplicates_in_file': duplicates,
+        'sample_new': changes['new'][:sample],
+        'sample_changed': [{'before': before, 'after': after} for before, after in changes['changed'][:sample]],
+    }
+
+
+# === EXPORTAÇÃO ===
+
+def iter_export(repo, fmt, batch_size=1000):
+    """Pedaços de texto do arquivo exportado, lidos aos poucos do banco"""
+    rows = repo.iter_kb(COLUMNS, batch_size=batch_size)
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps({column: row[column] for column in COLUMNS}, ensure_ascii=False) + '\n'
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow([row[column] for column in COLUMNS])
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        raise ValueError(f"formato deve ser um de: {', '.join(sorted(FORMATS))}")
+
+
+def guess_format(filename, default='jsonl'):
+    """Formato pela extensão do arquivo (ex.: base.csv)"""
+    name = (filename or '').lower()
+    for fmt, (_, extension) in FORMATS.items():
+        if name.endswith('.' + extension):
+            return fmt
+    return default
+
+
+def main():
+    import export
+    import storage
+
+    parser = argparse.ArgumentParser(description="Importa/exporta a knowledge_base em massa")
+    sub = parser.add_subparsers(dest='command', required=True)
+    imp = sub.add_parser('import')
+    imp.add_argument('file')
+    imp.add_argument('--format', choices=sorted(FORMATS))
+    imp.add_argument('--dry-run', action='store_true', help="só mostra o diff, sem gravar")
+    imp.add_argument('--chunk-size', type=int, default=500)
+    exp = sub.add_parser('export')
+    exp.add_argument('--format', choices=sorted(FORMATS), default='jsonl')
+    exp.add_argument('--gzip', action='store_true')
+    exp.add_argument('-o', '--output', help="arquivo de saída (padrão: stdout)")
+    for command in (imp, exp):
+        command.add_argument('--sqlite', metavar='ARQUIVO', help="usa o backend SQLite em vez do MySQL")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        storage.create_sqlite_schema(args.sqlite)
+        conn, repo_class = storage.SQLiteConnection(args.sqlite), storage.SQLiteRepository
+    else:
+        import mysql.connector
+        from config import DB_CONFIG
+        conn, repo_class = mysql.connector.connect(**DB_CONFIG), storage.MySQLRepository
+    repo = repo_class(conn)
+    start = time.time()
+    try:
+        if args.command == 'export':
+            out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+            try:
+                for data in export.iter_bytes(iter_export(repo, args.format), compress=args.gzip):
+                    out.write(data)
+            finally:
+                if args.output:
+                    out.close()
+            print(f"Exportação concluída em {time.time() - start:.1f}s", file=sys.stderr)
+            return 0
+
+        with open(args.file, encoding='utf-8-sig') as f:
+            text = f.read()
+        try:
+            entries, duplicates = validate(text, args.format or guess_format(args.file))
+        except ImportErrors as e:
+            for line_num, message in e.errors:
+                print(f"linha {line_num}: {message}", file=sys.stderr)
+            print(f"{len(e.errors)} linhas inválidas; nada foi gravado", file=sys.stderr)
+            return 1
+        changes = diff(repo, entries)
+        print(f"{len(entries)} entradas ({duplicates} duplicadas no arquivo): {len(changes['new'])} novas, "
+              f"{len(changes['changed'])} alteradas, {changes['unchanged']} iguais")
+        if args.dry_run:
+            for entry in changes['new']:
+                print(f"+ {entry['question']}")
+            for before, after in changes['changed']:
+                print(f"~ {after['question']}")
+            return 0
+        resolved = apply(repo, entries, chunk_size=args.chunk_size)
+        print(f"Gravado em {time.time() - start:.1f}s; {resolved} perguntas pendentes fechadas")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
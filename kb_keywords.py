@@ -0,0 +1,228 @@
+# kb_keywords.py
+"""
+Palavras-chave da knowledge_base: tokens do português sem stopwords, comparados
+sem acentos e reduzidos por um stemmer leve (plural, gênero/diminutivo, advérbios
+e terminações verbais/nominais comuns), ranqueados por TF-IDF. A pergunta pesa o
+dobro da resposta. A palavra gravada é a forma mais frequente do radical no texto
+(ex.: "configuração"), para continuar casando com os tokens do índice em memória
+e do cache da IA.
+
+O /admin/teach usa só a frequência no próprio texto; a reindexação em lote calcula
+as frequências de documento de todo o corpus e regrava as keywords das entradas
+alteradas desde a última execução (marca d'água em job_watermarks). A escrita muda
+updated_at, para os workers recarregarem as entradas; na execução seguinte essas
+linhas são relidas, mas só são regravadas se as keywords mudarem.
+
+Uso: python kb_keywords.py [--full] [--batch-size 500] [--top 10] [--dry-run] [--sqlite ARQUIVO]
+"""
+
+import argparse
+import logging
+import math
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+JOB = 'kb_keywords'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+QUESTION_WEIGHT = 2.0
+ANSWER_WEIGHT = 1.0
+
+STOPWORDS = frozenset("""
+a ao aos aquela aquelas aquele aqueles aquilo as ate com como da das de dela delas dele deles
+depois do dos e ela elas ele eles em entre era eram essa essas esse esses esta estao estas
+estava estavam este estes estou eu foi foram ha isso isto ja la lhe lhes mais mas me mesmo
+meu meus minha minhas muito na nao nas nem no nos nossa nossas nosso nossos num numa o os ou
+para pela pelas pelo pelos por qual quando que quem se sem ser sera seu seus so sua suas tambem
+te tem tinha tu tua tuas um uma umas uns voce voces vos sao seja sejam pode podem posso
+fazer faz feito ter tenho temos vai vao vou sobre cada outro outra outros outras onde
+assim entao bem aqui ali agora ainda apenas algum alguma alguns algumas todo toda todos todas
+quais qualquer porque pois estamos estar fica ficar deve devem precisa preciso
+""".split())
+
+
+def fold(text):
+    """Minúsculas e sem acentos"""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+# (sufixo, substituição, tamanho mínimo da palavra) — aplicados sobre o texto sem acentos
+_PLURAL_RULES = [
+    ('oes', 'ao', 5), ('aes', 'ao', 5), ('ais', 'al', 5), ('eis', 'el', 5), ('ois', 'ol', 5),
+    ('zes', 'z', 5), ('res', 'r', 5), ('ns', 'm', 4),
+]
+_SUFFIX_RULES = [
+    ('mente', '', 8), ('zinho', '', 8), ('zinha', '', 8), ('inho', '', 7), ('inha', '', 7),
+    ('amento', '', 8), ('imento', '', 8), ('mento', '', 7), ('acao', '', 7), ('icao', '', 7),
+    ('ando', '', 6), ('endo', '', 6), ('indo', '', 6), ('ador', '', 6), ('ado', '', 5), ('ada', '', 5),
+    ('ido', '', 5), ('ida', '', 5), ('ar', '', 5), ('er', '', 5), ('ir', '', 5),
+]
+
+
+def stem(word):
+    """Stemmer leve para português (palavra já sem acentos)"""
+    for suffix, replacement, min_len in _PLURAL_RULES:
+        if len(word) >= min_len and word.endswith(suffix):
+            word = word[:-len(suffix)] + replacement
+            break
+    else:
+        if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            word = word[:-1]
+    for suffix, replacement, min_len in _SUFFIX_RULES:
+        if len(word) >= min_len and word.endswith(suffix):
+            word = word[:-len(suffix)] + replacement
+            break
+    if len(word) > 4 and word[-1] in 'aeo':
+        word = word[:-1]
+    return word
+
+
+@lru_cache(maxsize=200000)
+def root(word):
+    """Radical da palavra (já em minúsculas), ou None se for stopword/curta/numérica"""
+    folded = fold(word)
+    if len(folded) < 3 or folded.isdigit() or folded in STOPWORDS:
+        return None
+    return stem(folded)
+
+
+def terms(text):
+    """[(radical, palavra original)] dos tokens úteis do texto"""
+    result = []
+    for word in TOKEN_RE.findall(str(text or '').lower()):
+        word_root = root(word)
+        if word_root is not None:
+            result.append((word_root, word))
+    return result
+
+
+def document_terms(question, answer):
+    """Frequência ponderada por radical e a forma mais frequente de cada radical"""
+    weights = Counter()
+    forms = {}
+    for text, weight in ((question, QUESTION_WEIGHT), (answer, ANSWER_WEIGHT)):
+        for word_root, word in terms(text):
+            weights[word_root] += weight
+            forms.setdefault(word_root, Counter())[word] += 1
+    return weights, {word_root: counts.most_common(1)[0][0] for word_root, counts in forms.items()}
+
+
+def extract_keywords(question, answer, df=None, n_docs=0, top=10):
+    """Keywords separadas por vírgula, da mais relevante para a menos (TF-IDF se houver `df`)"""
+    weights, forms = document_terms(question, answer)
+    scored = []
+    for word_root, tf in weights.items():
+        idf = math.log((1 + n_docs) / (1 + df.get(word_root, 0))) + 1 if df else 1.0
+        scored.append((-tf * idf, word_root))
+    scored.sort()
+    return ",".join(forms[word_root] for _, word_root in scored[:top]) or "geral"
+
+
+# === REINDEXAÇÃO EM LOTE ===
+
+def reindex(read_repo, write_repo, full=False, batch_size=500, top=10, dry_run=False):
+    """
+    Recalcula as keywords das entradas alteradas desde a última execução (ou de
+    todas, com `full`). Lê com `read_repo` em streaming e grava com `write_repo`
+    (conexões distintas: a leitura sem buffer não pode ser intercalada com escritas).
+    Devolve o relatório de vazão.
+    """
+    report = {'corpus_rows': 0, 'candidates': 0, 'updated': 0, 'batches': 0}
+    started = time.perf_counter()
+    run_at = write_repo.db_now()
+    watermark = None if full else write_repo.get_watermark(JOB)
+
+    # 1) Frequência de documento de cada radical em todo o corpus
+    df = Counter()
+    for row in read_repo.iter_kb(('question', 'answer'), batch_size=batch_size):
+        weights, _ = document_terms(row['question'], row['answer'])
+        df.update(weights.keys())
+        report['corpus_rows'] += 1
+    report['corpus_seconds'] = round(time.perf_counter() - started, 3)
+
+    # 2) Entradas alteradas: keywords novas gravadas em lotes
+    pending = []
+
+    def write_batch():
+        if not dry_run:
+            write_repo.update_kb_keywords(pending)
+            write_repo.connection.commit()
+        report['updated'] += len(pending)
+        report['batches'] += 1
+        pending.clear()
+        if report['batches'] % 20 == 0:
+            logger.info(f"{report['candidates']} entradas processadas, {report['updated']} regravadas")
+
+    phase_start = time.perf_counter()
+    rows = read_repo.iter_kb(('id', 'question', 'answer', 'keywords'), since=watermark, until=run_at,
+                             batch_size=batch_size)
+    for row in rows:
+        report['candidates'] += 1
+        keywords = extract_keywords(row['question'], row['answer'], df, report['corpus_rows'], top)
+        if keywords != (row['keywords'] or ''):
+            pending.append((keywords, row['id']))
+            if len(pending) >= batch_size:
+                write_batch()
+    if pending:
+        write_batch()
+    if not dry_run:
+        write_repo.set_watermark(JOB, run_at)
+        write_repo.connection.commit()
+
+    elapsed = time.perf_counter() - started
+    report['update_seconds'] = round(time.perf_counter() - phase_start, 3)
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round((report['corpus_rows'] + report['candidates']) / elapsed, 1) if elapsed else None
+    report['watermark'] = str(watermark) if watermark else None
+    return report
+
+
+def main():
+    import storage
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Recalcula as keywords da knowledge_base")
+    parser.add_argument('--full', action='store_true', help="ignora a marca d'água e processa todas as entradas")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--top', type=int, default=10, help="keywords por entrada")
+    parser.add_argument('--dry-run', action='store_true', help="calcula sem gravar")
+    parser.add_argument('--sqlite', metavar='ARQUIVO', help="usa o backend SQLite em vez do MySQL")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        storage.create_sqlite_schema(args.sqlite)
+
+        def connect():
+            return storage.SQLiteConnection(args.sqlite)
+        repository = storage.SQLiteRepository
+    else:
+        import mysql.connector
+        from config import DB_CONFIG
+
+        def connect():
+            return mysql.connector.connect(**DB_CONFIG)
+        repository = storage.MySQLRepository
+
+    read_conn, write_conn = connect(), connect()
+    try:
+        report = reindex(repository(read_conn), repository(write_conn), full=args.full,
+                         batch_size=args.batch_size, top=args.top, dry_run=args.dry_run)
+    finally:
+        read_conn.close()
+        write_conn.close()
+    verb = "a regravar" if args.dry_run else "regravadas"
+    print(f"{report['corpus_rows']} entradas no corpus ({report['corpus_seconds']}s), "
+          f"{report['candidates']} alteradas desde {report['watermark'] or 'sempre'}, "
+          f"{report['updated']} {verb} em {report['batches']} lotes ({report['update_seconds']}s); "
+          f"total {report['seconds']}s, {report['rows_per_second']} linhas/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
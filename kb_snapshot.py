@@ -0,0 +1,426 @@
+# kb_snapshot.py
+"""
+Snapshot binário da knowledge_base compartilhado entre os workers.
+
+Em vez de cada worker ler e indexar a knowledge_base inteira do banco na subida,
+um deles grava o índice (entradas, tamanhos e postings por token) num arquivo e
+todos o mapeiam somente leitura com mmap: as páginas ficam uma vez só no page cache
+do host e a "carga" custa só abrir o arquivo. Os arrays são lidos direto do mapa
+(memoryview.cast) e as entradas só viram dict quando aparecem num resultado.
+
+O arquivo é regravado depois de cada alteração pelo /admin (escrita num arquivo
+temporário + os.replace, serializada entre processos por flock) com a versão
+anterior + 1; os workers comparam o arquivo no disco de tempos em tempos e, se a
+versão subiu, remapeiam. Mapas antigos continuam válidos até a última busca que os
+usa terminar (o os.replace não apaga o inode mapeado).
+
+O cabeçalho guarda o hash da identidade do banco de origem (backend, servidor e
+base, ou o arquivo SQLite): um snapshot gravado a partir de outro banco (ex.: o
+load test apontando para o mesmo caminho) é recusado em vez de servir as entradas
+erradas.
+
+Formato (little-endian, seções alinhadas em 8 bytes):
+    cabeçalho       magic, formato, n_docs, n_tokens, n_postings, versão,
+                    maior updated_at (µs desde 1970, -1 = nenhum), soma dos tamanhos,
+                    sha256 da identidade do banco de origem
+    doc_ids         int64[n_docs], em ordem crescente
+    doc_updated     int64[n_docs]
+    doc_lengths     float64[n_docs]   tamanho ponderado (FIELD_WEIGHTS)
+    doc_fields      uint32[n_docs*8]  (offset, tamanho) de question/answer/category/keywords
+    by_question     uint32[n_docs]    documentos ordenados pela pergunta
+    token_strings   uint32[n_tokens*2] (offset, tamanho), tokens em ordem (UTF-8)
+    token_postings  uint32[n_tokens*3] (início, total, só question/keywords)
+    post_docs       uint32[n_postings] postings de cada token: primeiro os de
+    post_tfs        float32[n_postings] question/keywords, depois os só da resposta
+    strings         UTF-8
+"""
+
+import atexit
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from knowledge_index import FIELD_WEIGHTS, tokenize
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EDNNAKB\0'
+FORMAT = 2
+HEADER = struct.Struct('<8sIIIIQqd32s')
+FIELDS = ('question', 'answer', 'category', 'keywords')
+NULL = 0xFFFFFFFF
+EPOCH = datetime(1970, 1, 1)
+# (nome, typecode do memoryview.cast, itens por documento/token/posting)
+SECTIONS = [
+    ('doc_ids', 'q', 'docs', 1),
+    ('doc_updated', 'q', 'docs', 1),
+    ('doc_lengths', 'd', 'docs', 1),
+    ('doc_fields', 'I', 'docs', 2 * len(FIELDS)),
+    ('by_question', 'I', 'docs', 1),
+    ('token_strings', 'I', 'tokens', 2),
+    ('token_postings', 'I', 'tokens', 3),
+    ('post_docs', 'I', 'postings', 1),
+    ('post_tfs', 'f', 'postings', 1),
+]
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _layout(counts):
+    """Offsets de cada seção e do bloco de strings para as contagens dadas"""
+    offsets = {}
+    offset = _align(HEADER.size)
+    for name, typecode, unit, per_item in SECTIONS:
+        offsets[name] = offset
+        offset = _align(offset + struct.calcsize(typecode) * per_item * counts[unit])
+    return offsets, offset
+
+
+def _to_micros(value):
+    if value is None:
+        return -1
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value):
+    return None if value < 0 else EPOCH + timedelta(microseconds=value)
+
+
+def source_digest(source):
+    """Hash gravado no cabeçalho para a identidade do banco (ex.: 'mysql://host:3306/base')"""
+    return hashlib.sha256((source or '').encode('utf-8')).digest()
+
+
+# === ESCRITA ===
+
+def build(rows, version, source=''):
+    """Serializa as entradas (dicts com KB_COLUMNS) num snapshot; devolve os bytes"""
+    rows = sorted(rows, key=lambda row: row['id'])
+    strings = bytearray()
+    fields, lengths, postings = [], [], defaultdict(list)
+    total_length = 0.0
+    max_updated = None
+    for idx, row in enumerate(rows):
+        for field in FIELDS:
+            value = row.get(field)
+            if value is None:
+                fields.extend((0, NULL))
+            else:
+                data = str(value).encode('utf-8')
+                fields.extend((len(strings), len(data)))
+                strings += data
+        tf = defaultdict(float)
+        phrase = set()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(row.get(field)):
+                tf[token] += weight
+                if field != 'answer':
+                    phrase.add(token)
+        for token, value in tf.items():
+            postings[token].append((token not in phrase, idx, value))
+        length = sum(tf.values())
+        lengths.append(length)
+        total_length += length
+        updated_at = row.get('updated_at')
+        if updated_at is not None and (max_updated is None or updated_at > max_updated):
+            max_updated = updated_at
+
+    by_question = sorted(range(len(rows)), key=lambda idx: rows[idx]['question'] or '')
+    token_strings, token_postings, post_docs, post_tfs = [], [], [], []
+    for token in sorted(postings, key=lambda t: t.encode('utf-8')):
+        entries = sorted(postings[token])  # question/keywords primeiro, cada parte por documento
+        data = token.encode('utf-8')
+        token_strings.extend((len(strings), len(data)))
+        strings += data
+        token_postings.extend((len(post_docs), len(entries), sum(1 for e in entries if not e[0])))
+        post_docs.extend(idx for _, idx, _ in entries)
+        post_tfs.extend(value for _, _, value in entries)
+
+    counts = {'docs': len(rows), 'tokens': len(token_strings) // 2, 'postings': len(post_docs)}
+    offsets, strings_offset = _layout(counts)
+    values = {
+        'doc_ids': [row['id'] for row in rows],
+        'doc_updated': [_to_micros(row.get('updated_at')) for row in rows],
+        'doc_lengths': lengths,
+        'doc_fields': fields,
+        'by_question': by_question,
+        'token_strings': token_strings,
+        'token_postings': token_postings,
+        'post_docs': post_docs,
+        'post_tfs': post_tfs,
+    }
+    buffer = bytearray(strings_offset + len(strings))
+    HEADER.pack_into(buffer, 0, MAGIC, FORMAT, counts['docs'], counts['tokens'], counts['postings'],
+                     version, _to_micros(max_updated), total_length, source_digest(source))
+    for name, typecode, _, _ in SECTIONS:
+        items = values[name]
+        struct.pack_into(f'<{len(items)}{typecode}', buffer, offsets[name], *items)
+    buffer[strings_offset:] = strings
+    return bytes(buffer)
+
+
+def read_version(path):
+    """Versão do snapshot no disco (0 se não existir ou for inválido)"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return 0
+    if len(header) < HEADER.size:
+        return 0
+    magic, fmt, _, _, _, version, _, _, _ = HEADER.unpack(header)
+    return version if magic == MAGIC and fmt == FORMAT else 0
+
+
+def write_snapshot(path, rows, source=''):
+    """
+    Grava o snapshot de forma atômica (temporário + os.replace) com a versão do
+    arquivo atual + 1; devolve a versão gravada
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        version = read_version(path) + 1
+        data = build(rows, version, source)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    return version
+
+
+# === LEITURA ===
+
+class Snapshot:
+    """Snapshot mapeado somente leitura; os índices de documento vão de 0 a n_docs - 1"""
+
+    def __init__(self, path):
+        import mmap
+
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER.size:
+                raise ValueError("snapshot truncado")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        magic, fmt, n_docs, n_tokens, n_postings, version, max_updated, total_length, source = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError(f"formato de snapshot desconhecido ({magic!r}, {fmt})")
+        counts = {'docs': n_docs, 'tokens': n_tokens, 'postings': n_postings}
+        offsets, strings_offset = _layout(counts)
+        if strings_offset > stat.st_size:
+            raise ValueError("snapshot truncado")
+        view = memoryview(self._mmap)
+        for name, typecode, unit, per_item in SECTIONS:
+            size = struct.calcsize(typecode) * per_item * counts[unit]
+            setattr(self, name, view[offsets[name]:offsets[name] + size].cast(typecode))
+        self._strings = view[strings_offset:]
+        self.n_docs = n_docs
+        self.n_tokens = n_tokens
+        self.version = version
+        self.max_updated_at = _from_micros(max_updated)
+        self.total_length = total_length
+        self.source = source
+
+    def __len__(self):
+        return self.n_docs
+
+    def from_source(self, source):
+        """O snapshot foi gravado a partir do banco com esta identidade?"""
+        return self.source == source_digest(source)
+
+    def changed_on_disk(self):
+        """O arquivo no caminho foi substituído desde que este mapa foi aberto?"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self._stat
+
+    def _string(self, offset, size):
+        return str(self._strings[offset:offset + size], 'utf-8')
+
+    def field(self, idx, name):
+        base = idx * 2 * len(FIELDS) + 2 * FIELDS.index(name)
+        offset, size = self.doc_fields[base], self.doc_fields[base + 1]
+        return None if size == NULL else self._string(offset, size)
+
+    def updated_at(self, idx):
+        return _from_micros(self.doc_updated[idx])
+
+    def row(self, idx):
+        """Entrada como dict (mesmas colunas do storage.KB_COLUMNS)"""
+        row = {'id': self.doc_ids[idx]}
+        for name in FIELDS:
+            row[name] = self.field(idx, name)
+        row['updated_at'] = self.updated_at(idx)
+        return row
+
+    def find_id(self, doc_id):
+        """Índice do documento com este id (busca binária), ou None"""
+        lo, hi = 0, self.n_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.doc_ids[mid] < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_docs and self.doc_ids[lo] == doc_id else None
+
+    def find_question(self, question):
+        """Índice do documento com esta pergunta (busca binária), ou None"""
+        lo, hi = 0, self.n_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (self.field(self.by_question[mid], 'question') or '') < question:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_docs and self.field(self.by_question[lo], 'question') == question:
+            return self.by_question[lo]
+        return None
+
+    def postings(self, token):
+        """
+        (documentos, tfs, quantos dos primeiros vêm de question/keywords) do token,
+        como fatias do mapa; None se o token não aparece
+        """
+        key = token.encode('utf-8')
+        lo, hi = 0, self.n_tokens
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, size = self.token_strings[2 * mid], self.token_strings[2 * mid + 1]
+            if bytes(self._strings[offset:offset + size]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.n_tokens:
+            return None
+        offset, size = self.token_strings[2 * lo], self.token_strings[2 * lo + 1]
+        if bytes(self._strings[offset:offset + size]) != key:
+            return None
+        start, count, phrase_count = self.token_postings[3 * lo:3 * lo + 3]
+        return self.post_docs[start:start + count], self.post_tfs[start:start + count], phrase_count
+
+
+def open_snapshot(path):
+    """Mapeia o snapshot do caminho; None se não existir ou for inválido"""
+    if sys.byteorder != 'little' or not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Snapshot da knowledge_base ignorado ({path}): {e}")
+        return None
+
+
+class SnapshotWatcher:
+    """Verifica o arquivo no máximo a cada `interval` segundos e mapeia versões novas"""
+
+    def __init__(self, path, interval=2.0):
+        self.path = path
+        self.interval = interval
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def poll(self, current=None, force=False):
+        """Snapshot mais novo que `current` (o mapa em uso), ou None"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked < self.interval:
+                return None
+            self._checked = now
+        if current is not None and not current.changed_on_disk():
+            return None
+        snapshot = open_snapshot(self.path)
+        if snapshot is None or (current is not None and snapshot.version <= current.version):
+            return None
+        return snapshot
+
+
+# === PUBLICAÇÃO EM SEGUNDO PLANO ===
+
+class SnapshotPublisher:
+    """
+    Regrava o snapshot a partir do banco quando pedido (`request()`), numa thread:
+    pedidos próximos (ex.: um ensino em grupo) viram uma gravação só.
+    `connect()` abre uma conexão e `repository_for(conn)` devolve o repositório;
+    `source` é a identidade do banco gravada no cabeçalho.
+    """
+
+    def __init__(self, path, connect, repository_for, delay=1.0, source=''):
+        self.path = path
+        self.source = source
+        self.connect = connect
+        self.repository_for = repository_for
+        self.delay = delay
+        self.stats = {'published': 0, 'errors': 0, 'last_version': None, 'last_seconds': None}
+        self._requested = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def request(self):
+        self._requested.set()
+
+    def publish(self):
+        """Lê todas as entradas e grava uma nova versão; devolve a versão ou None"""
+        started = time.perf_counter()
+        conn = None
+        try:
+            conn = self.connect()
+            if conn is None:
+                raise RuntimeError("sem conexão com o banco")
+            version = write_snapshot(self.path, self.repository_for(conn).kb_entries(), self.source)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Erro ao gravar o snapshot da knowledge_base: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+        elapsed = time.perf_counter() - started
+        self.stats.update(published=self.stats['published'] + 1, last_version=version,
+                          last_seconds=round(elapsed, 3))
+        logger.info(f"Snapshot da knowledge_base v{version} gravado em {elapsed:.2f}s")
+        return version
+
+    # === THREAD ===
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='kb-snapshot', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def _run(self):
+        while True:
+            self._requested.wait()
+            if self._stop.is_set():
+                return
+            # Junta os pedidos que chegarem logo em seguida
+            self._stop.wait(self.delay)
+            self._requested.clear()
+            self.publish()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._requested.set()
+            self._thread.join(5)
+            self._thread = None
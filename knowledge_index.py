@@ -0,0 +1,337 @@
+# knowledge_index.py
+"""
+Índice invertido em memória para a knowledge_base.
+Substitui as buscas LIKE '%...%' e MATCH ... AGAINST por busca local com BM25.
+
+A base do índice pode ser um snapshot mapeado com mmap (kb_snapshot.py), comum a
+todos os workers; nesse caso só as entradas alteradas depois do snapshot ficam nas
+estruturas em memória, por cima dele (a entrada em memória esconde a do snapshot
+com o mesmo id ou pergunta).
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Peso de cada campo no cálculo da frequência do termo (BM25F simplificado)
+FIELD_WEIGHTS = {'question': 2.0, 'keywords': 2.0, 'answer': 1.0}
+
+
+def tokenize(text):
+    """Quebra o texto em tokens minúsculos"""
+    if not text:
+        return []
+    return TOKEN_RE.findall(str(text).lower())
+
+
+class KnowledgeIndex:
+    """Índice invertido token -> documentos, com pontuação BM25 (sobre o snapshot, se houver)"""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._docs = {}                    # id -> linha da knowledge_base
+        self._by_question = {}             # question -> id
+        self._tf = {}                      # id -> {token: frequência ponderada}
+        self._lengths = {}                 # id -> tamanho ponderado do documento
+        self._postings = defaultdict(set)  # token -> ids (question/keywords/answer)
+        self._phrase_postings = defaultdict(set)  # token -> ids (apenas question/keywords)
+        self._total_length = 0.0
+        self._snapshot = None
+        self._shadowed = set()             # índices do snapshot substituídos em memória
+        self._shadowed_length = 0.0
+        self._next_synthetic_id = -1       # ids provisórios das entradas sem id (só diminui)
+        self.last_updated_at = None
+        self.loaded_at = None
+
+    # === CONSTRUÇÃO ===
+
+    def load_from_db(self, repository):
+        """Carrega (ou recarrega) todo o índice a partir do repositório (storage.py)"""
+        rows = repository.kb_entries()
+        self.build(rows)
+        logger.info(f"Índice da knowledge_base carregado: {len(rows)} entradas")
+        return len(rows)
+
+    def refresh_from_db(self, repository):
+        """Aplica apenas as linhas alteradas desde a última carga"""
+        if self.last_updated_at is None:
+            return self.load_from_db(repository)
+        rows = repository.kb_entries(since=self.last_updated_at)
+        for row in rows:
+            self.upsert(row)
+        with self._lock:
+            self.loaded_at = time.time()
+        return len(rows)
+
+    def _clear(self):
+        self._docs.clear()
+        self._by_question.clear()
+        self._tf.clear()
+        self._lengths.clear()
+        self._postings.clear()
+        self._phrase_postings.clear()
+        self._total_length = 0.0
+        self._shadowed = set()
+        self._shadowed_length = 0.0
+
+    def build(self, rows):
+        with self._lock:
+            self._clear()
+            self._snapshot = None
+            self.last_updated_at = None
+            for row in rows:
+                self._add(row)
+            self.loaded_at = time.time()
+
+    def attach_snapshot(self, snapshot, source=None):
+        """
+        Passa a usar o snapshot mapeado como base, descartando as entradas em memória;
+        o refresh_from_db seguinte traz o que mudou depois dele. Com `source`, recusa
+        (devolve False) um snapshot gravado a partir de outro banco.
+        """
+        if source is not None and not snapshot.from_source(source):
+            logger.warning(f"Snapshot da knowledge_base v{snapshot.version} ignorado: gravado a partir "
+                           f"de outro banco ({snapshot.path})")
+            return False
+        with self._lock:
+            self._clear()
+            self._snapshot = snapshot
+            self.last_updated_at = snapshot.max_updated_at
+            self.loaded_at = time.time()
+        logger.info(f"Snapshot da knowledge_base v{snapshot.version} mapeado: {len(snapshot)} entradas")
+        return True
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def overlay_size(self):
+        """Entradas mantidas em memória (por cima do snapshot, se houver)"""
+        return len(self._docs)
+
+    def upsert(self, row):
+        """Insere ou substitui uma entrada (mesma semântica do ON DUPLICATE KEY)"""
+        with self._lock:
+            snapshot = self._snapshot
+            doc_id = row.get('id')
+            if snapshot is not None and doc_id is not None:
+                # O refresh relê as linhas do último updated_at: as que o snapshot já tem iguais ficam nele
+                idx = snapshot.find_id(doc_id)
+                if idx is not None and idx not in self._shadowed and \
+                        all(row.get(k) == v for k, v in snapshot.row(idx).items()):
+                    return
+            if doc_id is None:
+                doc_id = self._by_question.get(row.get('question'))
+            if doc_id is None and snapshot is not None:
+                idx = snapshot.find_question(row.get('question'))
+                if idx is not None:
+                    doc_id = snapshot.doc_ids[idx]
+            if doc_id is None:
+                doc_id = self._next_synthetic_id
+                self._next_synthetic_id -= 1
+            row = dict(row, id=doc_id)
+            if snapshot is not None:
+                for idx in (snapshot.find_id(doc_id), snapshot.find_question(row.get('question'))):
+                    if idx is not None and idx not in self._shadowed:
+                        self._shadowed.add(idx)
+                        self._shadowed_length += snapshot.doc_lengths[idx]
+            if doc_id in self._docs:
+                self._remove(doc_id)
+            old_id = self._by_question.get(row.get('question'))
+            if old_id is not None and old_id != doc_id:
+                self._remove(old_id)
+            self._add(row)
+
+    def _add(self, row):
+        doc_id = row['id']
+        tf = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(row.get(field)):
+                tf[token] += weight
+                self._postings[token].add(doc_id)
+                if field != 'answer':
+                    self._phrase_postings[token].add(doc_id)
+        length = sum(tf.values())
+        self._docs[doc_id] = row
+        self._by_question[row.get('question')] = doc_id
+        self._tf[doc_id] = dict(tf)
+        self._lengths[doc_id] = length
+        self._total_length += length
+        updated_at = row.get('updated_at')
+        if updated_at is not None and (self.last_updated_at is None or updated_at > self.last_updated_at):
+            self.last_updated_at = updated_at
+
+    def _remove(self, doc_id):
+        row = self._docs.pop(doc_id)
+        for token in self._tf.pop(doc_id):
+            for postings in (self._postings, self._phrase_postings):
+                ids = postings.get(token)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del postings[token]
+        self._total_length -= self._lengths.pop(doc_id)
+        if self._by_question.get(row.get('question')) == doc_id:
+            del self._by_question[row.get('question')]
+
+    def __len__(self):
+        base = len(self._snapshot) - len(self._shadowed) if self._snapshot is not None else 0
+        return len(self._docs) + base
+
+    # === BUSCA ===
+
+    def _recency(self, doc_id):
+        updated_at = self._docs[doc_id].get('updated_at')
+        return (updated_at is not None, updated_at or 0, doc_id)
+
+    def _snapshot_recency(self, idx):
+        updated_at = self._snapshot.updated_at(idx)
+        return (updated_at is not None, updated_at or 0, self._snapshot.doc_ids[idx])
+
+    def match_phrase(self, text, category=None):
+        """
+        Equivalente ao LIKE '%texto%' em question/keywords: devolve a entrada
+        mais recente que contém o texto, usando os postings para filtrar candidatos.
+        """
+        tokens = set(tokenize(text))
+        if not tokens:
+            return None
+        needle = text.strip().lower()
+        with self._lock:
+            best, best_recency = None, None
+            for doc_id in self._phrase_candidates(tokens):
+                row = self._docs[doc_id]
+                if category and row.get('category') != category:
+                    continue
+                if not self._contains(needle, row.get('question'), row.get('keywords')):
+                    continue
+                recency = self._recency(doc_id)
+                if best is None or recency > best_recency:
+                    best, best_recency = dict(row), recency
+            snapshot = self._snapshot
+            for idx in self._snapshot_phrase_candidates(tokens):
+                if category and snapshot.field(idx, 'category') != category:
+                    continue
+                if not self._contains(needle, snapshot.field(idx, 'question'), snapshot.field(idx, 'keywords')):
+                    continue
+                recency = self._snapshot_recency(idx)
+                if best is None or recency > best_recency:
+                    best, best_recency = snapshot.row(idx), recency
+            return best
+
+    @staticmethod
+    def _contains(needle, question, keywords):
+        return needle in (question or '').lower() or needle in (keywords or '').lower()
+
+    def _phrase_candidates(self, tokens):
+        """Documentos em memória com todos os tokens em question/keywords"""
+        candidates = None
+        for token in sorted(tokens, key=lambda t: len(self._phrase_postings.get(t, ()))):
+            ids = self._phrase_postings.get(token)
+            if not ids:
+                return ()
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                return ()
+        return candidates
+
+    def _snapshot_phrase_candidates(self, tokens):
+        """O mesmo para o snapshot (índices de documento, sem os substituídos em memória)"""
+        if self._snapshot is None:
+            return ()
+        postings = []
+        for token in tokens:
+            hit = self._snapshot.postings(token)
+            if hit is None or not hit[2]:
+                return ()
+            postings.append(hit[0][:hit[2]])
+        postings.sort(key=len)
+        candidates = set(postings[0]) - self._shadowed
+        for docs in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(docs)
+        return candidates
+
+    def search(self, text, category=None, min_score=0.0, limit=1):
+        """Ranqueia as entradas por BM25 sobre question/keywords/answer"""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        with self._lock:
+            snapshot = self._snapshot
+            n_docs = len(self)
+            if not n_docs:
+                return []
+            total_length = self._total_length
+            if snapshot is not None:
+                total_length += snapshot.total_length - self._shadowed_length
+            avg_length = total_length / n_docs or 1.0
+            scores = defaultdict(float)           # id em memória -> pontuação
+            snapshot_scores = defaultdict(float)  # índice no snapshot -> pontuação
+            for token in set(tokens):
+                ids = self._postings.get(token, ())
+                hits = ()
+                if snapshot is not None:
+                    hit = snapshot.postings(token)
+                    if hit is not None:
+                        hits = [(idx, tf) for idx, tf in zip(hit[0], hit[1]) if idx not in self._shadowed]
+                df = len(ids) + len(hits)
+                if not df:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id in ids:
+                    tf = self._tf[doc_id][token]
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                for idx, tf in hits:
+                    norm = self.k1 * (1 - self.b + self.b * snapshot.doc_lengths[idx] / avg_length)
+                    snapshot_scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = []
+            for doc_id, score in scores.items():
+                if score <= min_score:
+                    continue
+                if category and self._docs[doc_id].get('category') != category:
+                    continue
+                ranked.append((score, self._recency(doc_id), False, doc_id))
+            for idx, score in snapshot_scores.items():
+                if score <= min_score:
+                    continue
+                if category and snapshot.field(idx, 'category') != category:
+                    continue
+                ranked.append((score, self._snapshot_recency(idx), True, idx))
+            ranked.sort(reverse=True)
+            return [dict(snapshot.row(key) if in_snapshot else self._docs[key], score=score)
+                    for score, _, in_snapshot, key in ranked[:limit]]
+
+    def lookup(self, norm, intencao_atual=None, min_score=0.7):
+        """
+        Mesma ordem de preferência do get_chat_response:
+        1) frase na categoria da intenção atual, 2) frase em qualquer categoria,
+        3) BM25 (apenas consultas com mais de uma palavra) acima do corte.
+        A entrada devolvida traz em 'tier' qual dessas camadas respondeu.
+        """
+        result = None
+        if intencao_atual:
+            result = self.match_phrase(norm, category=intencao_atual)
+            tier = 'kb_phrase_intent'
+        if not result:
+            result = self.match_phrase(norm)
+            tier = 'kb_phrase'
+        if not result and len(norm.split()) > 1:
+            ranked = self.search(norm, min_score=min_score)
+            result = ranked[0] if ranked else None
+            tier = 'kb_bm25'
+        if result:
+            result['tier'] = tier
+        return result
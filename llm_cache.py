@@ -0,0 +1,152 @@
+# llm_cache.py
+"""
+Cache das respostas da IA (Ollama): LRU em memória na frente de um arquivo SQLite
+compartilhado entre os workers. A chave é a mensagem normalizada + o modelo.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from user_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(norm, model):
+    return hashlib.sha1(f"{model}\0{norm}".encode('utf-8')).hexdigest()
+
+
+class LLMAnswerCache:
+    """Memória (TTLCache) -> disco (SQLite em WAL) -> Ollama"""
+
+    def __init__(self, path='data/llm_cache.sqlite3', max_entries=50000, ttl=7 * 24 * 3600,
+                 memory_size=2000, memory_ttl=600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # TTL curto na memória para que invalidações feitas por outro worker se propaguem
+        self.memory = TTLCache(max_size=memory_size, ttl=min(ttl, memory_ttl))
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        self.stats = {'hits_memory': 0, 'hits_disk': 0, 'misses': 0, 'stores': 0,
+                      'invalidated': 0, 'evicted': 0}
+
+    def _conn(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_answers (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    norm TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_hit REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_answers_last_hit ON llm_answers (last_hit)")
+            self._db.commit()
+        return self._db
+
+    def get(self, norm, model):
+        key = cache_key(norm, model)
+        answer = self.memory.get(key)
+        if answer is not None:
+            self.stats['hits_memory'] += 1
+            return answer
+        try:
+            with self._lock:
+                db = self._conn()
+                row = db.execute(
+                    "SELECT answer, created_at FROM llm_answers WHERE key = ?", (key,)).fetchone()
+                if row and time.time() - row[1] <= self.ttl:
+                    db.execute("UPDATE llm_answers SET last_hit = ? WHERE key = ?", (time.time(), key))
+                    db.commit()
+                else:
+                    row = None
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao ler cache da IA: {e}")
+            row = None
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits_disk'] += 1
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def set(self, norm, model, answer):
+        if not answer:
+            return
+        key = cache_key(norm, model)
+        self.memory.set(key, answer)
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._conn()
+                db.execute("""
+                    INSERT OR REPLACE INTO llm_answers (key, model, norm, answer, created_at, last_hit)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (key, model, norm, answer, now, now))
+                db.commit()
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._evict(db)
+            self.stats['stores'] += 1
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar cache da IA: {e}")
+
+    def _evict(self, db):
+        """Remove expirados e, acima do limite, os menos usados"""
+        cur = db.execute("DELETE FROM llm_answers WHERE created_at < ?", (time.time() - self.ttl,))
+        evicted = cur.rowcount
+        total = db.execute("SELECT COUNT(*) FROM llm_answers").fetchone()[0]
+        if total > self.max_entries:
+            cur = db.execute("""
+                DELETE FROM llm_answers WHERE key IN (
+                    SELECT key FROM llm_answers ORDER BY last_hit ASC LIMIT ?
+                )
+            """, (total - self.max_entries,))
+            evicted += cur.rowcount
+        db.commit()
+        self.stats['evicted'] += evicted
+
+    def invalidate_matching(self, *texts):
+        """
+        Apaga as respostas cujo texto normalizado aparece dentro de algum dos textos
+        (pergunta/keywords ensinadas no /admin/teach), como faria o LIKE '%...%'.
+        """
+        texts = [t.lower() for t in texts if t]
+        if not texts:
+            return 0
+        removed = 0
+        try:
+            with self._lock:
+                db = self._conn()
+                for text in texts:
+                    rows = db.execute(
+                        "SELECT key FROM llm_answers WHERE instr(?, norm) > 0", (text,)).fetchall()
+                    for (key,) in rows:
+                        self.memory.delete(key)
+                    cur = db.execute("DELETE FROM llm_answers WHERE instr(?, norm) > 0", (text,))
+                    removed += cur.rowcount
+                db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao invalidar cache da IA: {e}")
+        self.stats['invalidated'] += removed
+        return removed
+
+    def metrics(self):
+        hits = self.stats['hits_memory'] + self.stats['hits_disk']
+        total = hits + self.stats['misses']
+        return dict(self.stats, hit_rate=round(hits / total, 4) if total else 0.0,
+                    memory=self.memory.stats())
@@ -0,0 +1,246 @@
+# llm_client.py
+"""
+Cliente HTTP do Ollama com uma sessão persistente (keep-alive, pool de conexões),
+um pool de threads limitado para as gerações e coalescência "single-flight":
+pedidos simultâneos iguais (modelo + prompt normalizado) acompanham a mesma
+geração em vez de abrir uma cada. A carga no Ollama cresce com as perguntas
+distintas, não com os usuários que as fazem ao mesmo tempo.
+
+Cada geração (um "voo") roda numa thread do pool e publica os trechos conforme
+chegam; quem pediu — o primeiro e os que chegaram depois — lê a lista desde o
+início. A vaga da geração vem de um admission.ConcurrencyLimiter (vagas + fila de
+espera limitada); sem vaga, o pedido recebe Overloaded na hora. Falhas de conexão,
+timeouts e respostas 5xx são repetidas com backoff exponencial e jitter enquanto
+nenhum trecho foi publicado. Se todos os leitores desistem, a geração é
+interrompida.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import LLM_COALESCED, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class LLMTimeout(Exception):
+    """A resposta não ficou pronta dentro do prazo de quem esperava"""
+
+
+class _Flight:
+    """Uma geração em andamento: trechos publicados e quem os está lendo"""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    @property
+    def abandoned(self):
+        return self.readers <= 0
+
+    def subscribe(self, deadline=None):
+        """Leitor dos trechos desde o início; LLMTimeout se passar do `deadline` (time.monotonic)"""
+        with self.cond:
+            self.readers += 1
+        return _Reader(self, deadline)
+
+    def _read(self, deadline):
+        position = 0
+        while True:
+            with self.cond:
+                while position == len(self.chunks) and not self.done:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise LLMTimeout("prazo da resposta da IA esgotado")
+                    self.cond.wait(remaining)
+                chunks = self.chunks[position:]
+                position = len(self.chunks)
+                if not chunks and self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+            yield from chunks
+
+
+class _Reader:
+    """
+    Iterador de um leitor do _Flight. Conta como leitor desde a inscrição (para o
+    voo não ser dado como abandonado antes da primeira leitura) até terminar, ser
+    fechado ou coletado — inclusive quando nunca chegou a ser lido, caso em que o
+    finally de um gerador comum não roda e o voo nunca seria abandonado.
+    """
+
+    def __init__(self, flight, deadline):
+        self._flight = flight
+        self._chunks = flight._read(deadline)
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self._release()
+            raise
+
+    def close(self):
+        self._chunks.close()
+        self._release()
+
+    def __del__(self):
+        self._release()
+
+    def _release(self):
+        with self._flight.cond:
+            if not self._released:
+                self._released = True
+                self._flight.readers -= 1
+
+
+class LLMClient:
+    """
+    `slots` (admission.ConcurrencyLimiter) limita as gerações simultâneas e a fila;
+    o pool de threads tem o mesmo tamanho. `timeout` é (conexão, leitura entre
+    trechos) e `retries` o número de novas tentativas por geração.
+    """
+
+    RETRY_STATUS = (500, 502, 503, 504)
+
+    def __init__(self, base_url, model, slots, timeout=(5, 120), retries=2, backoff=0.5):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.slots = slots
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=slots.limit)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=slots.limit, thread_name_prefix='llm')
+        self._flights = {}  # (modelo, chave) -> _Flight
+        self._lock = threading.Lock()
+        self.stats = {'flights': 0, 'coalesced': 0, 'retries': 0, 'abandoned': 0}
+
+    # === API ===
+
+    def stream(self, prompt, key=None, mode='stream'):
+        """
+        Começa a geração (ou passa a acompanhar uma igual em andamento) e devolve o
+        gerador dos trechos. `key` é o texto normalizado usado na deduplicação
+        (padrão: o próprio prompt). Levanta admission.Overloaded se não houver vaga.
+        """
+        return self._subscribe(prompt, key, mode)
+
+    def generate(self, prompt, key=None, timeout=None):
+        """Resposta completa, esperando no máximo `timeout` segundos (LLMTimeout)"""
+        deadline = time.monotonic() + timeout if timeout else None
+        return ''.join(self._subscribe(prompt, key, 'blocking', deadline))
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    # === VOOS ===
+
+    def _subscribe(self, prompt, key, mode, deadline=None):
+        """Leitor de um voo igual em andamento ou de um voo novo (registrado antes de começar)"""
+        flight_key = (self.model, key or prompt)
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            if flight is not None:
+                self.stats['coalesced'] += 1
+                LLM_COALESCED.inc(mode=mode)
+                return flight.subscribe(deadline)
+            flight = self._flights[flight_key] = _Flight(flight_key)
+            self.stats['flights'] += 1
+            reader = flight.subscribe(deadline)
+        try:
+            permit = self.slots.acquire()
+        except Exception as e:
+            # Quem já se juntou a este voo recebe o mesmo erro
+            self._land(flight, e)
+            raise
+        self._executor.submit(self._run, flight, prompt, permit)
+        return reader
+
+    def _land(self, flight, error=None):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.finish(error)
+
+    def _run(self, flight, prompt, permit):
+        error = None
+        try:
+            self._generate(flight, prompt)
+        except Exception as e:
+            error = e
+            logger.error(f"Erro ao chamar Ollama: {e}")
+        finally:
+            permit.release()
+            self._land(flight, error)
+
+    def _generate(self, flight, prompt):
+        attempt = 0
+        while True:
+            try:
+                with self.session.post(
+                    f"{self.base_url}/api/generate",
+                    json={"model": self.model, "prompt": prompt, "stream": True},
+                    stream=True,
+                    timeout=self.timeout
+                ) as resp:
+                    resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if flight.chunks and flight.abandoned:
+                            self.stats['abandoned'] += 1
+                            return
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get('response'):
+                            flight.publish(chunk['response'])
+                        if chunk.get('done'):
+                            return
+                    return
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                status = e.response.status_code if getattr(e, 'response', None) is not None else None
+                retryable = status is None or status in self.RETRY_STATUS
+                # Depois do primeiro trecho não dá para repetir sem duplicar a resposta
+                if not retryable or flight.chunks or attempt >= self.retries:
+                    raise
+                attempt += 1
+                self.stats['retries'] += 1
+                LLM_RETRIES.inc(reason=type(e).__name__)
+                # Backoff exponencial com jitter para os workers não repetirem juntos
+                delay = self.backoff * 2 ** (attempt - 1)
+                time.sleep(random.uniform(delay / 2, delay * 1.5))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
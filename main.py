@@ -2,36 +2,27 @@
 
 import mysql.connector
 from config import DB_CONFIG
+from migrate import migrate
+
 
 def criar_tabelas():
+    conn = None
     try:
         # Conectar ao banco de dados
-        conn = mysql.connector.connect(
-            host=DB_CONFIG["host"],
-            user=DB_CONFIG["user"],
-            password=DB_CONFIG["password"],
-            database=DB_CONFIG["database"]
-        )
-        cursor = conn.cursor()
-
-        # Ler o script SQL
-        with open("create_tables.sql", "r") as file:
-            sql_script = file.read()
+        conn = mysql.connector.connect(**DB_CONFIG)
 
-        # Executar o script SQL
-        for statement in sql_script.split(";"):
-            if statement.strip():
-                cursor.execute(statement)
+        # Aplicar as migrações pendentes (migrations/*.sql)
+        aplicadas = migrate(conn)
 
-        print("Tabelas criadas com sucesso!")
+        print(f"Tabelas criadas com sucesso! ({len(aplicadas)} migrações aplicadas)")
 
     except mysql.connector.Error as err:
         print(f"Erro ao criar tabelas: {err}")
 
     finally:
-        if conn.is_connected():
-            cursor.close()
+        if conn is not None and conn.is_connected():
             conn.close()
 
+
 if __name__ == "__main__":
     criar_tabelas()
@@ -0,0 +1,170 @@
+# metrics_rollup.py
+"""
+Contadores por faixa de tempo (minuto/hora/dia) para o dashboard.
+Cada worker acumula em memória e descarrega periodicamente com upserts em
+metrics_rollup; uma tarefa de compactação agrega minutos antigos em horas e
+horas antigas em dias, de modo que cada instante existe numa só granularidade.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = """
+    INSERT INTO metrics_rollup (granularity, bucket_start, metric, label, value)
+    VALUES ('minute', %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+"""
+
+# (granularidade de origem, destino, expressão do início da faixa, idade mínima)
+# O % do DATE_FORMAT vai dobrado porque a consulta também recebe parâmetros %s
+COMPACTIONS = [
+    ('minute', 'hour', "DATE_FORMAT(bucket_start, '%%Y-%%m-%%d %%H:00:00')", timedelta(hours=48)),
+    ('hour', 'day', "DATE(bucket_start)", timedelta(days=60)),
+]
+
+
+def minute_bucket(dt):
+    return dt.replace(second=0, microsecond=0)
+
+
+class MetricsRollup:
+    """Acumulador em memória + descarga/compactação em segundo plano"""
+
+    def __init__(self, connect, flush_interval=10, compact_interval=600):
+        self.connect = connect
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self._pending = defaultdict(int)  # (minuto, métrica, label) -> incremento
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_compaction = 0.0
+
+    def record(self, metric, label='', n=1):
+        key = (minute_bucket(datetime.now()), metric, label or '')
+        with self._lock:
+            self._pending[key] += n
+
+    # === DESCARGA ===
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if not pending:
+            return 0
+        conn = None
+        try:
+            conn = self.connect()
+            if conn is None:
+                raise RuntimeError("sem conexão com o banco")
+            cursor = conn.cursor()
+            try:
+                cursor.executemany(UPSERT_SQL, [(b, m, l, v) for (b, m, l), v in pending.items()])
+                conn.commit()
+            finally:
+                cursor.close()
+            return len(pending)
+        except Exception as e:
+            logger.error(f"Erro ao descarregar métricas ({len(pending)} faixas): {e}")
+            # Devolve os incrementos para a próxima tentativa
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] += value
+            return 0
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def compact(self, now=None):
+        """Agrega faixas antigas na granularidade seguinte (um worker por vez, via GET_LOCK)"""
+        now = now or datetime.now()
+        conn = self.connect()
+        if conn is None:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK('ednna_metrics_compaction', 0)")
+            if not cursor.fetchone()[0]:
+                return
+            try:
+                for source, target, bucket_expr, age in COMPACTIONS:
+                    cutoff = now - age
+                    cutoff = cutoff.replace(minute=0, second=0, microsecond=0)
+                    if target == 'day':
+                        cutoff = cutoff.replace(hour=0)
+                    cursor.execute(f"""
+                        INSERT INTO metrics_rollup (granularity, bucket_start, metric, label, value)
+                        SELECT %s, {bucket_expr}, metric, label, SUM(value)
+                        FROM metrics_rollup
+                        WHERE granularity = %s AND bucket_start < %s
+                        GROUP BY {bucket_expr}, metric, label
+                        ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+                    """, (target, source, cutoff))
+                    cursor.execute("DELETE FROM metrics_rollup WHERE granularity = %s AND bucket_start < %s",
+                                   (source, cutoff))
+                    conn.commit()
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('ednna_metrics_compaction')")
+                cursor.fetchone()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Erro ao compactar métricas: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    # === CONSULTA ===
+
+    def window(self, connection, metrics, start=None, end=None):
+        """
+        Soma as métricas na janela [start, end): {(métrica, label): valor}.
+        Inclui os incrementos deste worker ainda não descarregados.
+        """
+        start = start or datetime(1970, 1, 1)
+        end = end or datetime.now() + timedelta(minutes=1)
+        placeholders = ", ".join(["%s"] * len(metrics))
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT metric, label, SUM(value) FROM metrics_rollup
+                WHERE metric IN ({placeholders}) AND bucket_start >= %s AND bucket_start < %s
+                GROUP BY metric, label
+            """, list(metrics) + [start, end])
+            totals = defaultdict(int, {(m, l): int(v) for m, l, v in cursor.fetchall()})
+        finally:
+            cursor.close()
+        with self._lock:
+            for (bucket, metric, label), value in self._pending.items():
+                if metric in metrics and start <= bucket < end:
+                    totals[(metric, label)] += value
+        return totals
+
+    # === THREAD ===
+
+    def start(self):
+        """Inicia a descarga e a compactação periódicas"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='metrics-rollup', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            if time.time() - self._last_compaction >= self.compact_interval:
+                self._last_compaction = time.time()
+                self.compact()
+        self.flush()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(self.flush_interval + 5)
+            self._thread = None
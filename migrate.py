@@ -0,0 +1,260 @@
+# migrate.py
+"""
+Migrações do esquema (tabelas EDI e do chatbot), aplicadas em ordem a partir de
+migrations/NNNN_nome.sql e registradas em schema_migrations.
+
+No MySQL cada DDL faz commit implícito, então uma migração não é atômica de verdade:
+o que a torna segura é ser idempotente. CREATE TABLE usa IF NOT EXISTS e, como o
+MySQL não tem IF NOT EXISTS para índices e colunas, CREATE INDEX e
+ALTER TABLE ... ADD COLUMN são pulados quando o information_schema mostra que já
+existem. Os comandos de dados (cargas iniciais) de cada migração rodam numa
+transação que só termina junto com o registro em schema_migrations; se a migração
+falhar no meio, basta rodar de novo.
+
+Uso: python migrate.py [status | up [--to N] | dry-run]
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_LOCK = 'schema_migrations'
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        checksum CHAR(64) NOT NULL,
+        applied_at DATETIME NOT NULL
+    )
+"""
+
+CREATE_INDEX_RE = re.compile(
+    r'^\s*CREATE\s+(?:(UNIQUE|FULLTEXT)\s+)?INDEX\s+`?(\w+)`?\s+ON\s+`?(\w+)`?\s*\((.*)\)\s*$', re.I | re.S)
+ADD_COLUMN_RE = re.compile(r'^\s*ALTER\s+TABLE\s+`?(\w+)`?\s+ADD\s+COLUMN\s+`?(\w+)`?', re.I)
+FILENAME_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding='utf-8') as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode('utf-8')).hexdigest()
+
+    def statements(self):
+        return split_statements(self.sql)
+
+    def __repr__(self):
+        return f"<Migration {self.version:04d}_{self.name}>"
+
+
+def split_statements(sql):
+    """Separa o script em comandos pelos ';' fora de strings, identificadores e comentários"""
+    statements, current = [], []
+    i, n = 0, len(sql)
+    quote = None
+    while i < n:
+        ch = sql[i]
+        if quote:
+            current.append(ch)
+            if ch == '\\' and quote != '`' and i + 1 < n:
+                current.append(sql[i + 1])
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in ("'", '"', '`'):
+            quote = ch
+            current.append(ch)
+        elif sql.startswith('--', i) or ch == '#':
+            end = sql.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        elif ch == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in os.listdir(directory):
+        match = FILENAME_RE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Versões de migração repetidas em {directory}")
+    return migrations
+
+
+def applied_migrations(cursor):
+    cursor.execute(CREATE_MIGRATIONS_TABLE)
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+
+# === IDEMPOTÊNCIA DE ÍNDICES E COLUNAS ===
+
+def _index_exists(cursor, table, columns, kind):
+    """Já existe índice na tabela cujas primeiras colunas são exatamente `columns`?"""
+    cursor.execute("""
+        SELECT index_name, index_type, non_unique, column_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY index_name, seq_in_index
+    """, (table,))
+    indexes = {}
+    for index_name, index_type, non_unique, column_name in cursor.fetchall():
+        entry = indexes.setdefault(index_name, {'type': index_type, 'unique': not non_unique, 'columns': []})
+        entry['columns'].append(column_name.lower())
+    for entry in indexes.values():
+        if kind == 'FULLTEXT':
+            if entry['type'] == 'FULLTEXT' and set(entry['columns']) == set(columns):
+                return True
+        elif entry['type'] != 'FULLTEXT' and entry['columns'][:len(columns)] == columns:
+            if kind != 'UNIQUE' or (entry['unique'] and len(entry['columns']) == len(columns)):
+                return True
+    return False
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def already_applied(cursor, statement):
+    """True quando o comando cria um índice ou coluna que já existe"""
+    match = CREATE_INDEX_RE.match(statement)
+    if match:
+        kind, _, table, columns = match.groups()
+        # Prefixos como coluna(100) e ordem ASC/DESC não mudam quais colunas o índice cobre
+        columns = [re.split(r'[\s(]', c.strip().strip('`'))[0].lower() for c in columns.split(',')]
+        return _index_exists(cursor, table, columns, (kind or '').upper())
+    match = ADD_COLUMN_RE.match(statement)
+    if match:
+        return _column_exists(cursor, *match.groups())
+    return False
+
+
+# === APLICAÇÃO ===
+
+def apply_migration(connection, migration):
+    cursor = connection.cursor()
+    try:
+        for statement in migration.statements():
+            if already_applied(cursor, statement):
+                logger.info(f"{migration!r}: já aplicado, pulando: {statement.splitlines()[0]}")
+                continue
+            cursor.execute(statement)
+            if cursor.with_rows:
+                cursor.fetchall()
+        cursor.execute("""
+            INSERT INTO schema_migrations (version, name, checksum, applied_at) VALUES (%s, %s, %s, NOW())
+        """, (migration.version, migration.name, migration.checksum))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def migrate(connection, directory=MIGRATIONS_DIR, target=None, dry_run=False):
+    """Aplica as migrações pendentes (até `target`, se informado); devolve as aplicadas"""
+    cursor = connection.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, 60)", (MIGRATION_LOCK,))
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        raise RuntimeError("Outra execução de migrações está em andamento")
+    try:
+        applied = applied_migrations(cursor)
+        connection.commit()
+        done = []
+        for migration in load_migrations(directory):
+            if target is not None and migration.version > target:
+                break
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    logger.warning(f"{migration!r} foi alterada depois de aplicada")
+                continue
+            if not dry_run:
+                logger.info(f"Aplicando {migration!r}")
+                apply_migration(connection, migration)
+            done.append(migration)
+        return done
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        cursor.fetchone()
+        cursor.close()
+
+
+def status(connection, directory=MIGRATIONS_DIR):
+    cursor = connection.cursor()
+    try:
+        applied = applied_migrations(cursor)
+        connection.commit()
+    finally:
+        cursor.close()
+    rows = []
+    for migration in load_migrations(directory):
+        if migration.version not in applied:
+            state = 'pendente'
+        elif applied[migration.version] != migration.checksum:
+            state = 'aplicada (arquivo alterado)'
+        else:
+            state = 'aplicada'
+        rows.append((migration, state))
+    return rows
+
+
+def main():
+    import mysql.connector
+    from config import DB_CONFIG
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Migrações do esquema")
+    parser.add_argument('command', nargs='?', choices=['up', 'status', 'dry-run'], default='up')
+    parser.add_argument('--to', type=int, help="aplica só até esta versão")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        if args.command == 'status':
+            for migration, state in status(conn):
+                print(f"{migration.version:04d}_{migration.name}: {state}")
+            return 0
+        done = migrate(conn, target=args.to, dry_run=args.command == 'dry-run')
+        verb = "pendentes" if args.command == 'dry-run' else "aplicadas"
+        print(f"{len(done)} migrações {verb}" + (": " + ", ".join(repr(m) for m in done) if done else ""))
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
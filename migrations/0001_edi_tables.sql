@@ -1,7 +1,8 @@
--- create_tables.sql
+-- 0001_edi_tables.sql
+-- Tabelas das operações EDI alimentadas pelo Redmine
 
 -- Tabela: Clientes
-CREATE TABLE Clientes (
+CREATE TABLE IF NOT EXISTS Clientes (
     ID_Cliente INT AUTO_INCREMENT PRIMARY KEY,
     Nome_Cliente VARCHAR(255) NOT NULL,
     CNPJ VARCHAR(20),
@@ -9,7 +10,7 @@ CREATE TABLE Clientes (
 );
 
 -- Tabela: Players
-CREATE TABLE Players (
+CREATE TABLE IF NOT EXISTS Players (
     ID_Player INT AUTO_INCREMENT PRIMARY KEY,
     Nome_Player VARCHAR(255) NOT NULL,
     Tipo_Player ENUM('Banco', 'Adquirente', 'ERP', 'Outro') NOT NULL,
@@ -17,7 +18,7 @@ CREATE TABLE Players (
 );
 
 -- Tabela: Operacoes
-CREATE TABLE Operacoes (
+CREATE TABLE IF NOT EXISTS Operacoes (
     ID_Operacao INT AUTO_INCREMENT PRIMARY KEY,
     ID_Cliente INT NOT NULL, -- Referência ao cliente
     ID_Player INT NOT NULL, -- Referência ao player envolvido
@@ -30,7 +31,7 @@ CREATE TABLE Operacoes (
 );
 
 -- Tabela: Chamados_Redmine
-CREATE TABLE Chamados_Redmine (
+CREATE TABLE IF NOT EXISTS Chamados_Redmine (
     ID_Chamado INT PRIMARY KEY, -- Identificador único do chamado no Redmine
     ID_Operacao INT NOT NULL, -- Referência à operação EDI associada
     Tipo_Problema VARCHAR(100), -- Ex.: Falta de Arquivo, Erro de Arquivo
@@ -47,7 +48,7 @@ CREATE TABLE Chamados_Redmine (
 );
 
 -- Tabela: Logs_Cancelamento
-CREATE TABLE Logs_Cancelamento (
+CREATE TABLE IF NOT EXISTS Logs_Cancelamento (
     ID_Log_Cancelamento INT AUTO_INCREMENT PRIMARY KEY,
     ID_Chamado INT NOT NULL, -- Referência ao chamado
     Player_Cancelado VARCHAR(255), -- Ex.: Cielo, Getnet
@@ -0,0 +1,13 @@
+-- 0002_importacao_redmine.sql
+-- Estado da importação do Redmine (import_csv.py)
+
+-- Tabela: Importacao_Redmine
+-- Marca d'água em "Alterado" e checkpoint do último chunk gravado
+CREATE TABLE IF NOT EXISTS Importacao_Redmine (
+    Fonte VARCHAR(64) PRIMARY KEY,
+    Watermark DATETIME NULL, -- maior "Alterado" de uma execução concluída
+    Arquivo VARCHAR(512) NULL, -- arquivo da execução em andamento (caminho, tamanho, mtime)
+    Ultimo_Chunk INT NULL, -- último chunk gravado dessa execução
+    Max_Alterado DATETIME NULL, -- maior "Alterado" já gravado nessa execução
+    Atualizado_Em DATETIME NOT NULL
+);
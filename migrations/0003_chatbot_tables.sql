@@ -0,0 +1,59 @@
+-- 0003_chatbot_tables.sql
+-- Tabelas principais do chatbot. Em bancos antigos elas já existem e nada muda aqui;
+-- os índices de que as consultas dependem vêm na migração seguinte
+
+-- Tabela: users
+CREATE TABLE IF NOT EXISTS users (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Tabela: user_profiles
+-- Dados capturados durante a conversa (nome, empresa, ERP)
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id INT PRIMARY KEY,
+    name VARCHAR(255),
+    company VARCHAR(255),
+    erp VARCHAR(50),
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Tabela: conversations
+CREATE TABLE IF NOT EXISTS conversations (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    started_at DATETIME NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'active' -- Ex.: active, closed
+);
+
+-- Tabela: messages
+CREATE TABLE IF NOT EXISTS messages (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    conversation_id INT NOT NULL,
+    message_text TEXT NOT NULL,
+    is_from_user TINYINT(1) NOT NULL,
+    sent_at DATETIME NOT NULL
+);
+
+-- Tabela: unknown_questions
+-- Perguntas sem resposta na knowledge_base, aguardando o /admin/teach
+CREATE TABLE IF NOT EXISTS unknown_questions (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    question VARCHAR(255) NOT NULL,
+    conversation_id INT,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- Ex.: pending, answered
+    created_at DATETIME NOT NULL
+);
+
+-- Tabela: knowledge_base
+CREATE TABLE IF NOT EXISTS knowledge_base (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    question VARCHAR(255) NOT NULL,
+    answer TEXT NOT NULL,
+    category VARCHAR(50),
+    keywords TEXT,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL,
+    UNIQUE KEY uq_knowledge_base_question (question)
+);
@@ -0,0 +1,24 @@
+-- 0004_chatbot_indexes.sql
+-- Índices usados pelas consultas do app.py (conferidos pelo plan_check.py).
+-- O migrate.py pula cada CREATE INDEX se a tabela já tiver um índice com essas colunas
+
+-- Conversa ativa do usuário (get_or_create_conversation)
+CREATE INDEX idx_conversations_user_status ON conversations (user_id, status, started_at);
+
+-- Mensagens de uma conversa em ordem (/admin/conversa, exportação)
+CREATE INDEX idx_messages_conversation_sent ON messages (conversation_id, sent_at);
+
+-- Pendentes por data (/admin/learn, contagem do dashboard)
+CREATE INDEX idx_unknown_status_created ON unknown_questions (status, created_at);
+
+-- Perguntas frequentes das últimas horas (dashboard); cobre o GROUP BY question
+CREATE INDEX idx_unknown_created_question ON unknown_questions (created_at, question);
+
+-- Deduplicação da última hora e fechamento no /admin/teach
+CREATE INDEX idx_unknown_question_created ON unknown_questions (question, created_at);
+
+-- Sincronização incremental do índice em memória (updated_at >= marca d'água)
+CREATE INDEX idx_knowledge_base_updated ON knowledge_base (updated_at);
+
+-- Busca textual na knowledge_base
+CREATE FULLTEXT INDEX ft_knowledge_base ON knowledge_base (question, answer, keywords);
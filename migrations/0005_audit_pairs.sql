@@ -0,0 +1,27 @@
+-- 0005_audit_pairs.sql
+-- Pares pergunta/resposta lidos pelo /api/audit
+
+-- Tabela: audit_pairs
+-- Par pergunta/resposta gravado no momento da resposta; o /api/audit lê só daqui
+CREATE TABLE IF NOT EXISTS audit_pairs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    conversation_id INT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    intent VARCHAR(50), -- Ex.: saudacao, edi, teia_card, unknown
+    asked_at DATETIME NOT NULL,
+    answered_at DATETIME NOT NULL,
+    INDEX idx_audit_pairs_asked_at (asked_at, id),
+    INDEX idx_audit_pairs_conversation (conversation_id, id)
+);
+
+-- Carga inicial: cada mensagem do usuário com a primeira resposta do bot que veio depois
+INSERT INTO audit_pairs (conversation_id, question, answer, intent, asked_at, answered_at)
+SELECT u.conversation_id, u.message_text, b.message_text, NULL, u.sent_at, b.sent_at
+FROM messages u
+JOIN messages b ON b.id = (
+    SELECT MIN(n.id) FROM messages n
+    WHERE n.conversation_id = u.conversation_id AND n.id > u.id AND n.is_from_user = 0
+)
+WHERE u.is_from_user = 1
+  AND NOT EXISTS (SELECT 1 FROM (SELECT id FROM audit_pairs LIMIT 1) AS existing);
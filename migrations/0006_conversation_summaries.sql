@@ -0,0 +1,38 @@
+-- 0006_conversation_summaries.sql
+-- Resumo por conversa lido pelo /admin/historics
+
+-- Tabela: conversation_summaries
+-- Resumo de cada conversa mantido a cada mensagem gravada; o /admin/historics lê só daqui
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id INT PRIMARY KEY,
+    user_id INT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'active',
+    name VARCHAR(255), -- Copiados de user_profiles para filtrar sem JOIN
+    company VARCHAR(255),
+    erp VARCHAR(50),
+    started_at DATETIME NOT NULL,
+    message_count INT NOT NULL DEFAULT 0,
+    unknown_count INT NOT NULL DEFAULT 0,
+    last_message_at DATETIME,
+    last_user_message TEXT,
+    INDEX idx_summaries_started (started_at, conversation_id),
+    INDEX idx_summaries_company (company, started_at, conversation_id),
+    INDEX idx_summaries_erp (erp, started_at, conversation_id),
+    INDEX idx_summaries_status (status, started_at, conversation_id),
+    INDEX idx_summaries_user (user_id)
+);
+
+-- Carga inicial a partir das conversas existentes
+INSERT IGNORE INTO conversation_summaries (
+    conversation_id, user_id, status, name, company, erp, started_at,
+    message_count, unknown_count, last_message_at, last_user_message
+)
+SELECT
+    c.id, c.user_id, c.status, p.name, p.company, p.erp, c.started_at,
+    (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = c.id),
+    (SELECT COUNT(*) FROM unknown_questions q WHERE q.conversation_id = c.id),
+    (SELECT MAX(m.sent_at) FROM messages m WHERE m.conversation_id = c.id),
+    (SELECT m.message_text FROM messages m
+     WHERE m.conversation_id = c.id AND m.is_from_user = 1 ORDER BY m.id DESC LIMIT 1)
+FROM conversations c
+LEFT JOIN user_profiles p ON c.user_id = p.user_id;
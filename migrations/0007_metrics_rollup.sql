@@ -0,0 +1,30 @@
+-- 0007_metrics_rollup.sql
+-- Contadores e valores instantâneos do dashboard
+
+-- Tabela: metrics_rollup
+-- Contadores por faixa de tempo; minutos viram horas após 48h e horas viram dias após 60 dias
+CREATE TABLE IF NOT EXISTS metrics_rollup (
+    granularity ENUM('minute', 'hour', 'day') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    metric VARCHAR(50) NOT NULL, -- Ex.: answered, unknown, kb_hit, kb_miss
+    label VARCHAR(100) NOT NULL DEFAULT '', -- Ex.: intenção/categoria da resposta
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, metric, label, bucket_start),
+    INDEX idx_rollup_metric_bucket (metric, bucket_start)
+);
+
+-- Tabela: metrics_gauges
+-- Valores instantâneos atualizados pela tarefa periódica (ex.: perguntas pendentes)
+CREATE TABLE IF NOT EXISTS metrics_gauges (
+    metric VARCHAR(50) PRIMARY KEY,
+    value BIGINT NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+
+-- Carga inicial: mensagens de usuário já registradas, por dia
+INSERT INTO metrics_rollup (granularity, bucket_start, metric, label, value)
+SELECT 'day', DATE(sent_at), 'answered', '', COUNT(*)
+FROM messages
+WHERE is_from_user = 1
+GROUP BY DATE(sent_at)
+ON DUPLICATE KEY UPDATE value = VALUES(value);
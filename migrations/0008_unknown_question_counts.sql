@@ -0,0 +1,30 @@
+-- 0008_unknown_question_counts.sql
+-- Contadores por pergunta desconhecida (unknown_tracker.py): uma linha pendente por
+-- pergunta, com o total de ocorrências e quando apareceu pela última vez
+
+ALTER TABLE unknown_questions ADD COLUMN occurrences INT NOT NULL DEFAULT 1;
+ALTER TABLE unknown_questions ADD COLUMN last_seen DATETIME NULL;
+
+UPDATE unknown_questions SET last_seen = created_at WHERE last_seen IS NULL;
+
+-- Consolida as pendências repetidas (uma por hora, no esquema antigo) na mais antiga;
+-- as demais ficam como 'merged' para não perder o histórico de quem perguntou
+UPDATE unknown_questions u
+JOIN (
+    SELECT question, MIN(id) AS keep_id, COUNT(*) AS total, MAX(created_at) AS last_at
+    FROM unknown_questions WHERE status = 'pending'
+    GROUP BY question HAVING COUNT(*) > 1
+) d ON u.id = d.keep_id
+SET u.occurrences = d.total, u.last_seen = d.last_at;
+
+UPDATE unknown_questions u
+JOIN (
+    SELECT question, MIN(id) AS keep_id
+    FROM unknown_questions WHERE status = 'pending'
+    GROUP BY question HAVING COUNT(*) > 1
+) d ON u.question = d.question AND u.id <> d.keep_id
+SET u.status = 'merged'
+WHERE u.status = 'pending';
+
+-- Top-N por contagem (dashboard e /admin/learn) direto do índice
+CREATE INDEX idx_unknown_status_occurrences ON unknown_questions (status, occurrences, last_seen);
@@ -0,0 +1,10 @@
+-- 0009_job_watermarks.sql
+-- Marca d'água das tarefas em lote incrementais (ex.: reindexação das keywords da knowledge_base)
+
+-- Tabela: job_watermarks
+-- Até onde (updated_at) cada tarefa já processou
+CREATE TABLE IF NOT EXISTS job_watermarks (
+    job VARCHAR(50) PRIMARY KEY,
+    watermark DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
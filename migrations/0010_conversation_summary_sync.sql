@@ -0,0 +1,28 @@
+-- 0010_conversation_summary_sync.sql
+-- conversation_summaries: status acompanhando conversations e uma definição só de unknown_count
+
+-- O status da conversa muda fora do app (encerramento, ajustes manuais); o gatilho
+-- repassa a mudança para o resumo, que é de onde o /admin/historics filtra
+DROP TRIGGER IF EXISTS trg_conversations_status_summary;
+CREATE TRIGGER trg_conversations_status_summary
+AFTER UPDATE ON conversations FOR EACH ROW
+UPDATE conversation_summaries SET status = NEW.status
+WHERE conversation_id = NEW.id AND NEW.status <> OLD.status;
+
+UPDATE conversation_summaries s
+JOIN conversations c ON c.id = s.conversation_id
+SET s.status = c.status
+WHERE s.status <> c.status;
+
+-- unknown_count = respostas "unknown" da conversa (uma por turno), o mesmo que o
+-- write-behind soma a cada troca; a carga da 0006 contava as linhas de
+-- unknown_questions, deduplicadas por hora. Conversas sem intent nos pares de
+-- auditoria (anteriores a ele) não têm o dado por turno e mantêm a estimativa antiga.
+UPDATE conversation_summaries s
+JOIN (
+    SELECT conversation_id, SUM(intent = 'unknown') AS unknown_turns
+    FROM audit_pairs
+    GROUP BY conversation_id
+    HAVING COUNT(intent) > 0
+) a ON a.conversation_id = s.conversation_id
+SET s.unknown_count = a.unknown_turns;
@@ -0,0 +1,5 @@
+-- 0011_drop_metrics_gauges.sql
+-- metrics_gauges (0007) deixou de ser usada: o dashboard conta as perguntas
+-- pendentes na hora pelo índice de unknown_questions
+
+DROP TABLE IF EXISTS metrics_gauges;
@@ -0,0 +1,123 @@
+# plan_check.py
+"""
+Confere os planos das consultas quentes do app.py: roda EXPLAIN em cada uma e
+falha (código de saída 1) quando alguma tabela é lida por varredura completa
+(type = ALL). Rode depois das migrações, num banco com volume representativo:
+em tabelas quase vazias o otimizador prefere varrer, por isso varreduras com
+menos de --min-rows linhas estimadas são toleradas.
+
+Uso: python plan_check.py [--min-rows 100] [--verbose]
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+_now = datetime.now()
+
+# (nome, consulta, parâmetros de exemplo) — mantenha em sincronia com o app.py e o storage.py
+HOT_QUERIES = [
+    ('perfil do usuário', "SELECT * FROM user_profiles WHERE user_id = %s", (1,)),
+    ('usuário existe', "SELECT id FROM users WHERE id = %s", (1,)),
+    ('conversa ativa', """
+        SELECT id FROM conversations WHERE user_id = %s AND status = 'active'
+        ORDER BY started_at DESC LIMIT 1
+    """, (1,)),
+    ('pendentes (contagem)', "SELECT COUNT(*) FROM unknown_questions WHERE status = 'pending'", ()),
+    ('pendentes mais frequentes (/admin/learn, dashboard)', """
+        SELECT id, user_id, question, created_at, occurrences, last_seen FROM unknown_questions
+        WHERE status = 'pending' ORDER BY occurrences DESC, last_seen DESC LIMIT 50
+    """, ()),
+    ('pendência da pergunta', """
+        SELECT id FROM unknown_questions WHERE question = %s AND status = 'pending'
+        ORDER BY id LIMIT 1
+    """, ('como configurar o edi',)),
+    ('fechar pendentes (/admin/teach)', """
+        UPDATE unknown_questions SET status = 'answered' WHERE question = %s AND status = 'pending'
+    """, ('como configurar o edi',)),
+    ('knowledge_base por pergunta', """
+        SELECT id, question, answer, category, keywords, updated_at
+        FROM knowledge_base WHERE question = %s
+    """, ('como configurar o edi',)),
+    ('knowledge_base alterada', """
+        SELECT id, question, answer, category, keywords, updated_at
+        FROM knowledge_base WHERE updated_at >= %s
+    """, (_now - timedelta(minutes=1),)),
+    ('mensagens da conversa', """
+        SELECT is_from_user, message_text, sent_at FROM messages
+        WHERE conversation_id = %s ORDER BY sent_at ASC
+    """, (1,)),
+    ('auditoria', """
+        SELECT id, question AS pergunta, answer AS resposta, asked_at AS data, intent
+        FROM audit_pairs WHERE id < %s ORDER BY id DESC LIMIT 100
+    """, (10 ** 9,)),
+    ('auditoria por período', """
+        SELECT id, question AS pergunta, answer AS resposta, asked_at AS data, intent
+        FROM audit_pairs WHERE asked_at >= %s AND asked_at < %s ORDER BY id DESC LIMIT 100
+    """, (_now - timedelta(days=1), _now)),
+    ('históricos', """
+        SELECT conversation_id, user_id, started_at, status, name, company, erp
+        FROM conversation_summaries ORDER BY started_at DESC, conversation_id DESC LIMIT 50
+    """, ()),
+    ('históricos por empresa', """
+        SELECT conversation_id, user_id, started_at, status, name, company, erp
+        FROM conversation_summaries WHERE company = %s
+        ORDER BY started_at DESC, conversation_id DESC LIMIT 50
+    """, ('Netunna',)),
+    ('resumo da conversa', """
+        UPDATE conversation_summaries SET unknown_count = unknown_count + 1 WHERE conversation_id = %s
+    """, (1,)),
+    ('métricas por janela', """
+        SELECT metric, label, SUM(value) FROM metrics_rollup
+        WHERE metric IN (%s, %s) AND bucket_start >= %s AND bucket_start < %s
+        GROUP BY metric, label
+    """, ('answered', 'unknown', _now - timedelta(days=1), _now)),
+]
+
+
+def explain(connection, query, params):
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("EXPLAIN " + query, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def check(connection, queries=HOT_QUERIES, min_rows=100, verbose=False):
+    """Devolve [(nome, tabela, linhas estimadas)] das varreduras completas encontradas"""
+    failures = []
+    for name, query, params in queries:
+        for row in explain(connection, query, params):
+            rows = row.get('rows') or 0
+            if verbose:
+                print(f"  {name}: {row.get('table')} type={row.get('type')} key={row.get('key')} "
+                      f"rows={rows} {row.get('Extra') or ''}")
+            if row.get('type') == 'ALL' and rows >= min_rows:
+                failures.append((name, row.get('table'), rows))
+    return failures
+
+
+def main():
+    import mysql.connector
+    from config import DB_CONFIG
+
+    parser = argparse.ArgumentParser(description="Confere os planos das consultas quentes")
+    parser.add_argument('--min-rows', type=int, default=100,
+                        help="tolera varreduras em tabelas com menos linhas estimadas que isso")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        failures = check(conn, min_rows=args.min_rows, verbose=args.verbose)
+    finally:
+        conn.close()
+    for name, table, rows in failures:
+        print(f"VARREDURA COMPLETA: {name} lê {table} inteira (~{rows} linhas)")
+    print(f"{len(HOT_QUERIES)} consultas conferidas, {len(failures)} com varredura completa")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# question_clusters.py
+"""
+Agrupa perguntas pendentes quase iguais ("como funciona o EDI" / "como funciona EDI?")
+para que o /admin/learn ensine uma resposta e feche o grupo inteiro de uma vez.
+
+Cada pergunta vira um conjunto de shingles (trigramas de caracteres do texto sem
+acentos nem pontuação) e uma assinatura MinHash; o LSH por bandas só compara
+perguntas que caem no mesmo balde em alguma banda, então o custo cresce perto de
+linearmente com o número de perguntas em vez de comparar todos os pares. Os
+candidatos são confirmados pela similaridade estimada e unidos (union-find).
+
+As assinaturas ficam em cache pelo texto da pergunta (a cada abertura da página só
+as perguntas novas são processadas) e os valores de hash de cada trigrama, que se
+repetem muito entre perguntas, também: a assinatura é o mínimo coluna a coluna
+desses vetores, calculado com zip/map em vez de um laço por função de hash.
+"""
+
+import random
+import re
+import unicodedata
+import zlib
+
+from user_cache import TTLCache
+
+MASK_32 = 0xFFFFFFFF
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """Minúsculas, sem acentos e com pontuação trocada por espaço"""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD_RE.sub(' ', text).strip()
+
+
+def shingles(text, size=3):
+    """Trigramas de caracteres de cada palavra (com bordas), ou a palavra inteira se for curta"""
+    grams = set()
+    for word in normalize(text).split():
+        padded = f' {word} '
+        if len(padded) <= size:
+            grams.add(padded)
+        for i in range(len(padded) - size + 1):
+            grams.add(padded[i:i + size])
+    return grams
+
+
+class QuestionClusterer:
+    """
+    MinHash com `num_perm` funções (hash do shingle combinado por XOR com máscaras
+    aleatórias fixas) e LSH com `bands` bandas; com 64/16 (4 linhas por banda) pares
+    com Jaccard acima de ~0,5 quase sempre viram candidatos. `threshold` é a
+    similaridade estimada mínima para juntar dois candidatos no mesmo grupo.
+    """
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.5, cache_size=100000, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm deve ser múltiplo de bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = random.Random(seed)
+        self._masks = [rng.getrandbits(32) for _ in range(num_perm)]
+        self._signatures = TTLCache(max_size=cache_size, ttl=7 * 24 * 3600)
+        self._gram_values = {}  # trigrama -> valores nas num_perm funções
+        self._max_grams = cache_size
+
+    def _values(self, gram):
+        values = self._gram_values.get(gram)
+        if values is None:
+            if len(self._gram_values) >= self._max_grams:
+                self._gram_values.clear()
+            h = zlib.crc32(gram.encode('utf-8'))
+            values = self._gram_values[gram] = tuple([h ^ mask for mask in self._masks])
+        return values
+
+    def signature(self, text):
+        cached = self._signatures.get(text)
+        if cached is not None:
+            return cached
+        vectors = [self._values(gram) for gram in shingles(text)]
+        if vectors:
+            signature = tuple(map(min, zip(*vectors)))
+        else:
+            signature = (MASK_32,) * self.num_perm
+        self._signatures.set(text, signature)
+        return signature
+
+    def similarity(self, a, b):
+        """Jaccard estimado entre duas assinaturas"""
+        return sum(x == y for x, y in zip(a, b)) / self.num_perm
+
+    def cluster(self, rows, key='question'):
+        """
+        Agrupa as linhas (dicts com `key`) e devolve os grupos do maior para o menor:
+        [{'representative': linha, 'members': [linhas], 'size': n, 'occurrences': total}].
+        O representante é o membro com mais ocorrências.
+        """
+        signatures = [self.signature(row[key]) for row in rows]
+        parent = list(range(len(rows)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for band in range(self.bands):
+            start = band * self.rows
+            buckets = {}
+            for i, signature in enumerate(signatures):
+                buckets.setdefault(signature[start:start + self.rows], []).append(i)
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                first = members[0]
+                for other in members[1:]:
+                    root_a, root_b = find(first), find(other)
+                    if root_a == root_b:
+                        continue
+                    if self.similarity(signatures[first], signatures[other]) >= self.threshold:
+                        parent[root_b] = root_a
+
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(find(i), []).append(row)
+        clusters = []
+        for members in groups.values():
+            members.sort(key=lambda row: row.get('occurrences') or 1, reverse=True)
+            clusters.append({
+                'representative': members[0],
+                'members': members,
+                'size': len(members),
+                'occurrences': sum(row.get('occurrences') or 1 for row in members),
+            })
+        clusters.sort(key=lambda c: (c['size'], c['occurrences']), reverse=True)
+        return clusters
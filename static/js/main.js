@@ -58,7 +58,7 @@ async function sendMessage() {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 
     try {
-        const response = await fetch('/api/chat', {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -67,20 +67,80 @@ async function sendMessage() {
             })
         });
 
-        typingDiv.remove();
-
-        const data = await response.json();
-        if (response.ok) {
-            addMessage(data.response, 'bot');
-        } else {
+        if (!response.ok || !response.body) {
+            typingDiv.remove();
             addMessage('Desculpe, tive um problema interno.', 'bot');
+            return;
         }
+
+        await readChatStream(response, typingDiv);
     } catch (error) {
         typingDiv.remove();
         addMessage('Erro de conexão. Verifique sua internet.', 'bot');
     }
 }
 
+// ✅ LÊ A RESPOSTA NDJSON E RENDERIZA OS TRECHOS À MEDIDA QUE CHEGAM
+async function readChatStream(response, typingDiv) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    let content = null;
+
+    const render = (value) => {
+        if (!content) {
+            typingDiv.remove();
+            content = addMessage(value, 'bot');
+        } else {
+            renderBotText(content, value);
+        }
+        const chatMessages = document.getElementById('chat-messages');
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+
+            const event = JSON.parse(line);
+            if (event.event === 'delta') {
+                text += event.text;
+                render(text);
+            } else if (event.event === 'reset') {
+                // A geração falhou no meio: o servidor manda o texto de novo do início
+                text = '';
+            } else if (event.event === 'done') {
+                render(event.response);
+            }
+        }
+    }
+
+    if (!content) {
+        typingDiv.remove();
+        addMessage('Desculpe, tive um problema interno.', 'bot');
+    }
+}
+
+function renderBotText(content, text) {
+    if (typeof marked !== 'undefined') {
+        try {
+            content.innerHTML = marked.parse(text);
+            return;
+        } catch (e) {
+            // cai para texto puro
+        }
+    }
+    content.textContent = text;
+}
+
 function createTypingIndicator() {
     const div = document.createElement('div');
     div.classList.add('message', 'bot-message');
@@ -109,26 +169,20 @@ function addMessage(text, sender) {
         avatar.style.flexShrink = "0";
 
         const content = document.createElement('div');
-
-        if (typeof marked !== 'undefined') {
-            try {
-                content.innerHTML = marked.parse(text);
-            } catch (e) {
-                content.textContent = text;
-            }
-        } else {
-            content.textContent = text;
-        }
+        renderBotText(content, text);
 
         container.appendChild(avatar);
         container.appendChild(content);
         messageDiv.appendChild(container);
-    } else {
-        messageDiv.textContent = text;
+        chatMessages.appendChild(messageDiv);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+        return content;
     }
 
+    messageDiv.textContent = text;
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageDiv;
 }
 
 // ✅ VINCULA O EVENTO DE ENTER AO CAMPO DE ENTRADA
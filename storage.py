@@ -0,0 +1,659 @@
+# storage.py
+"""
+Repositório do chatbot: as consultas de usuários, perfis, conversas, mensagens,
+perguntas desconhecidas e knowledge_base ficam aqui, atrás de uma interface única,
+com dois backends escolhidos por STORAGE_BACKEND:
+
+- mysql (padrão): o servidor MySQL configurado em DB_CONFIG, com o esquema das
+  migrações (migrate.py);
+- sqlite: um arquivo SQLite embutido em modo WAL, para instalações pequenas que
+  não querem manter um servidor de banco. As leituras locais ficam abaixo de 1 ms
+  e a busca textual usa FTS5 no lugar do MATCH ... AGAINST do MySQL.
+
+As conexões SQLite imitam as do mysql.connector (cursor(dictionary=True), %s,
+lastrowid, exceções mysql.connector.Error), e as construções de MySQL que o resto
+do app usa (NOW(), DATE_SUB, ON DUPLICATE KEY UPDATE, INSERT IGNORE, GREATEST,
+DATE_FORMAT, GET_LOCK) são traduzidas; por isso o pool, o write-behind, o rollup de
+métricas e a exportação funcionam sobre os dois backends sem mudanças. GET_LOCK
+sempre concede o lock: o SQLite serializa as escritas no próprio arquivo.
+
+O repositório não faz commit: a transação continua sendo de quem chama.
+"""
+
+import os
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime, date
+
+import mysql.connector
+
+from kb_keywords import fold
+
+# === ESQUEMA SQLITE (equivalente às migrações do MySQL) ===
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT, company TEXT, erp TEXT,
+    updated_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    started_at DATETIME NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active'
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_user_status ON conversations (user_id, status, started_at);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL,
+    message_text TEXT NOT NULL,
+    is_from_user INTEGER NOT NULL,
+    sent_at DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_sent ON messages (conversation_id, sent_at);
+CREATE TABLE IF NOT EXISTS unknown_questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    question TEXT NOT NULL,
+    conversation_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at DATETIME NOT NULL,
+    occurrences INTEGER NOT NULL DEFAULT 1,
+    last_seen DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_unknown_status_created ON unknown_questions (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_unknown_created_question ON unknown_questions (created_at, question);
+CREATE INDEX IF NOT EXISTS idx_unknown_question_created ON unknown_questions (question, created_at);
+CREATE TABLE IF NOT EXISTS knowledge_base (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    answer TEXT NOT NULL,
+    category TEXT,
+    keywords TEXT,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_knowledge_base_updated ON knowledge_base (updated_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_base_fts USING fts5(
+    question, answer, keywords,
+    content='knowledge_base', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_insert AFTER INSERT ON knowledge_base BEGIN
+    INSERT INTO knowledge_base_fts (rowid, question, answer, keywords)
+    VALUES (new.id, new.question, new.answer, new.keywords);
+END;
+CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_delete AFTER DELETE ON knowledge_base BEGIN
+    INSERT INTO knowledge_base_fts (knowledge_base_fts, rowid, question, answer, keywords)
+    VALUES ('delete', old.id, old.question, old.answer, old.keywords);
+END;
+CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_update AFTER UPDATE ON knowledge_base BEGIN
+    INSERT INTO knowledge_base_fts (knowledge_base_fts, rowid, question, answer, keywords)
+    VALUES ('delete', old.id, old.question, old.answer, old.keywords);
+    INSERT INTO knowledge_base_fts (rowid, question, answer, keywords)
+    VALUES (new.id, new.question, new.answer, new.keywords);
+END;
+CREATE TABLE IF NOT EXISTS audit_pairs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    intent TEXT,
+    asked_at DATETIME NOT NULL,
+    answered_at DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audit_pairs_asked_at ON audit_pairs (asked_at, id);
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active',
+    name TEXT, company TEXT, erp TEXT,
+    started_at DATETIME NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    unknown_count INTEGER NOT NULL DEFAULT 0,
+    last_message_at DATETIME,
+    last_user_message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_started ON conversation_summaries (started_at, conversation_id);
+CREATE INDEX IF NOT EXISTS idx_summaries_company ON conversation_summaries (company, started_at, conversation_id);
+CREATE TRIGGER IF NOT EXISTS trg_conversations_status_summary
+AFTER UPDATE OF status ON conversations FOR EACH ROW WHEN NEW.status <> OLD.status
+BEGIN
+    UPDATE conversation_summaries SET status = NEW.status WHERE conversation_id = NEW.id;
+END;
+CREATE TABLE IF NOT EXISTS metrics_rollup (
+    granularity TEXT NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    metric TEXT NOT NULL,
+    label TEXT NOT NULL DEFAULT '',
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, metric, label, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_metric_bucket ON metrics_rollup (metric, bucket_start);
+DROP TABLE IF EXISTS metrics_gauges;
+CREATE TABLE IF NOT EXISTS job_watermarks (
+    job TEXT PRIMARY KEY,
+    watermark DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+"""
+
+# Colunas acrescentadas depois da criação do esquema: (tabela, coluna, definição)
+SQLITE_ADDED_COLUMNS = [
+    ('unknown_questions', 'occurrences', 'INTEGER NOT NULL DEFAULT 1'),
+    ('unknown_questions', 'last_seen', 'DATETIME'),
+]
+
+# Índices que dependem das colunas acima (criados depois delas)
+SQLITE_LATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_unknown_status_occurrences ON unknown_questions (status, occurrences, last_seen);
+"""
+
+sqlite3.register_adapter(datetime, lambda v: v.isoformat(' '))
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+sqlite3.register_converter('DATETIME', lambda v: datetime.fromisoformat(v.decode()))
+
+# === TRADUÇÃO DO DIALETO ===
+
+_UNITS = {'SECOND': 'seconds', 'MINUTE': 'minutes', 'HOUR': 'hours', 'DAY': 'days'}
+_LOCK_RE = re.compile(r'^\s*SELECT\s+(GET_LOCK|RELEASE_LOCK)\s*\(', re.I)
+_DATE_SUB_RE = re.compile(r"DATE_SUB\(\s*NOW\(\)\s*,\s*INTERVAL\s+(\d+)\s+(\w+)\s*\)", re.I)
+_DATE_FORMAT_RE = re.compile(r"DATE_FORMAT\(\s*([\w.]+)\s*,\s*'([^']*)'\s*\)", re.I)
+_VALUES_RE = re.compile(r'VALUES\((\w+)\)', re.I)
+_cache = {}
+
+
+def translate(sql):
+    """Converte uma consulta no dialeto MySQL do app para SQLite (com cache por texto)"""
+    translated = _cache.get(sql)
+    if translated is not None:
+        return translated
+    out = sql.replace('%s', '?').replace('%%', '%')
+    out = _DATE_SUB_RE.sub(
+        lambda m: f"datetime('now', 'localtime', '-{m.group(1)} {_UNITS[m.group(2).upper()]}')", out)
+    out = _DATE_FORMAT_RE.sub(lambda m: f"strftime('{m.group(2)}', {m.group(1)})", out)
+    out = re.sub(r'\bNOW\(\)', "datetime('now', 'localtime')", out, flags=re.I)
+    out = re.sub(r'\bINSERT\s+IGNORE\b', 'INSERT OR IGNORE', out, flags=re.I)
+    out = re.sub(r'\bGREATEST\(', 'MAX(', out, flags=re.I)
+    if re.search(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', out, re.I):
+        head, tail = re.split(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', out, maxsplit=1, flags=re.I)
+        # INSERT ... SELECT precisa de um WHERE antes do ON CONFLICT no SQLite
+        if re.search(r'\bSELECT\b', head, re.I) and not re.search(r'\bWHERE\b', head, re.I):
+            head += ' WHERE 1'
+        out = head + ' ON CONFLICT DO UPDATE SET ' + _VALUES_RE.sub(r'excluded.\1', tail)
+    _cache[sql] = out
+    return out
+
+
+# === CONEXÕES SQLITE NO FORMATO DO MYSQL.CONNECTOR ===
+
+class SQLiteCursor:
+    """Cursor com a interface usada do mysql.connector; as linhas são lidas sob demanda"""
+
+    def __init__(self, connection, dictionary=False):
+        self._cursor = connection._db.cursor()
+        self._dictionary = dictionary
+        self._has_rows = False
+        self.column_names = ()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    @property
+    def with_rows(self):
+        return self._has_rows
+
+    def _wrap(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def execute(self, operation, params=()):
+        if _LOCK_RE.match(operation):
+            self._cursor.execute("SELECT 1")
+            self._after_execute()
+            return
+        try:
+            self._cursor.execute(translate(operation), tuple(params or ()))
+        except sqlite3.IntegrityError as e:
+            raise mysql.connector.IntegrityError(msg=str(e))
+        except sqlite3.Error as e:
+            raise mysql.connector.DatabaseError(msg=str(e))
+        self._after_execute()
+
+    def executemany(self, operation, seq_params):
+        try:
+            self._cursor.executemany(translate(operation), [tuple(p) for p in seq_params])
+        except sqlite3.IntegrityError as e:
+            raise mysql.connector.IntegrityError(msg=str(e))
+        except sqlite3.Error as e:
+            raise mysql.connector.DatabaseError(msg=str(e))
+        self._after_execute()
+
+    def _after_execute(self):
+        description = self._cursor.description
+        self._has_rows = bool(description)
+        self.column_names = tuple(d[0] for d in description) if description else ()
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def fetchone(self):
+        return self._wrap(self._cursor.fetchone()) if self._has_rows else None
+
+    def fetchmany(self, size=1):
+        return [self._wrap(row) for row in self._cursor.fetchmany(size)] if self._has_rows else []
+
+    def fetchall(self):
+        return [self._wrap(row) for row in self._cursor.fetchall()] if self._has_rows else []
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._cursor.close()
+
+
+def question_key(text):
+    """Pergunta sem acentos, em minúsculas e com espaços normalizados (como utf8mb4_unicode_ci)"""
+    return ' '.join(fold(text).split())
+
+
+class SQLiteConnection:
+    cursor_class = SQLiteCursor
+
+    def __init__(self, path, timeout=30):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=timeout,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.create_function('question_key', 1, question_key, deterministic=True)
+        self._closed = False
+
+    def cursor(self, dictionary=False, buffered=None):
+        return self.cursor_class(self, dictionary=dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._db.in_transaction
+
+    def is_connected(self):
+        return not self._closed
+
+    def ping(self, reconnect=False):
+        if self._closed:
+            raise mysql.connector.InterfaceError(msg="Conexão SQLite fechada")
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._db.close()
+
+
+def create_sqlite_schema(path):
+    """Cria (se faltar) o esquema no arquivo SQLite; seguro para rodar a cada subida"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SQLITE_SCHEMA)
+        for table, column, definition in SQLITE_ADDED_COLUMNS:
+            existing = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        db.executescript(SQLITE_LATE_INDEXES)
+        db.commit()
+    finally:
+        db.close()
+
+
+# === REPOSITÓRIOS ===
+
+KB_COLUMNS = "id, question, answer, category, keywords, updated_at"
+
+
+class Repository(ABC):
+    """
+    Consultas do chatbot sobre uma conexão (do pool ou avulsa). O SQL comum está no
+    dialeto MySQL, que as conexões SQLite traduzem; só o que não tem tradução
+    direta (a busca textual) é implementado por backend.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _fetchone(self, query, params=(), dictionary=False):
+        cursor = self.connection.cursor(dictionary=dictionary)
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def _fetchall(self, query, params=(), dictionary=True):
+        cursor = self.connection.cursor(dictionary=dictionary)
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _execute(self, query, params=()):
+        """Executa um comando e devolve (rowcount, lastrowid)"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query, params)
+            return cursor.rowcount, cursor.lastrowid
+        finally:
+            cursor.close()
+
+    # --- usuários e perfis ---
+
+    def user_exists(self, user_id):
+        return self._fetchone("SELECT id FROM users WHERE id = %s", (user_id,)) is not None
+
+    def get_profile(self, user_id):
+        return self._fetchone("SELECT * FROM user_profiles WHERE user_id = %s", (user_id,), dictionary=True)
+
+    def create_profile(self, user_id):
+        self._execute("""
+            INSERT INTO user_profiles (user_id, name, company, erp) VALUES (%s, NULL, NULL, NULL)
+        """, (user_id,))
+        return {'user_id': user_id, 'name': None, 'company': None, 'erp': None}
+
+    def update_profile(self, user_id, updates):
+        set_clause = ", ".join([f"{k} = %s" for k in updates.keys()])
+        self._execute(f"UPDATE user_profiles SET {set_clause}, updated_at = NOW() WHERE user_id = %s",
+                      list(updates.values()) + [user_id])
+
+    # --- conversas e mensagens ---
+
+    def get_conversation(self, conversation_id):
+        return self._fetchone("SELECT * FROM conversations WHERE id = %s", (conversation_id,), dictionary=True)
+
+    def active_conversation_id(self, user_id):
+        row = self._fetchone("""
+            SELECT id FROM conversations WHERE user_id = %s AND status = 'active'
+            ORDER BY started_at DESC LIMIT 1
+        """, (user_id,))
+        return row[0] if row else None
+
+    def create_conversation(self, user_id, started_at):
+        _, conversation_id = self._execute("""
+            INSERT INTO conversations (user_id, started_at, status) VALUES (%s, %s, 'active')
+        """, (user_id, started_at))
+        return conversation_id
+
+    def conversation_messages(self, conversation_id):
+        return self._fetchall("""
+            SELECT is_from_user, message_text, sent_at
+            FROM messages
+            WHERE conversation_id = %s
+            ORDER BY sent_at ASC
+        """, (conversation_id,))
+
+    # --- perguntas desconhecidas ---
+
+    def count_pending_unknown(self):
+        return self._fetchone("SELECT COUNT(*) FROM unknown_questions WHERE status = 'pending'")[0]
+
+    def top_unknown(self, limit=50):
+        """Pendências mais frequentes (índice status, occurrences, last_seen)"""
+        return self._fetchall("""
+            SELECT id, user_id, question, created_at, occurrences, last_seen FROM unknown_questions
+            WHERE status = 'pending' ORDER BY occurrences DESC, last_seen DESC LIMIT %s
+        """, (limit,))
+
+    def bump_unknown(self, question, occurrences, last_seen, unknown_id=None):
+        """
+        Soma ocorrências à pendência da pergunta (pelo id, quando conhecido);
+        devolve o id atualizado ou None se não há pendência.
+        """
+        if unknown_id is not None:
+            rowcount, _ = self._execute("""
+                UPDATE unknown_questions
+                SET occurrences = occurrences + %s, last_seen = GREATEST(COALESCE(last_seen, %s), %s)
+                WHERE id = %s AND status = 'pending'
+            """, (occurrences, last_seen, last_seen, unknown_id))
+            return unknown_id if rowcount else None
+        row = self._fetchone("""
+            SELECT id FROM unknown_questions WHERE question = %s AND status = 'pending'
+            ORDER BY id LIMIT 1
+        """, (question,))
+        if row is None:
+            return None
+        return self.bump_unknown(question, occurrences, last_seen, row[0])
+
+    def insert_unknown(self, user_id, question, conversation_id, created_at, occurrences, last_seen):
+        _, unknown_id = self._execute("""
+            INSERT INTO unknown_questions
+                (user_id, question, conversation_id, status, created_at, occurrences, last_seen)
+            VALUES (%s, %s, %s, 'pending', %s, %s, %s)
+        """, (user_id, question, conversation_id, created_at, occurrences, last_seen))
+        return unknown_id
+
+    def close_unknown(self, question):
+        """Marca como respondida a pendência desta pergunta; devolve quantas linhas mudaram"""
+        rowcount, _ = self._execute("""
+            UPDATE unknown_questions SET status = 'answered' WHERE question = %s AND status = 'pending'
+        """, (question,))
+        return rowcount
+
+    def close_unknown_many(self, questions, chunk_size=500):
+        """Fecha as pendências destas perguntas; devolve quantas linhas mudaram"""
+        questions = list(questions)
+        closed = 0
+        for start in range(0, len(questions), chunk_size):
+            chunk = questions[start:start + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            rowcount, _ = self._execute(f"""
+                UPDATE unknown_questions SET status = 'answered'
+                WHERE question IN ({placeholders}) AND status = 'pending'
+            """, chunk)
+            closed += rowcount
+        return closed
+
+    def close_unknown_ids(self, ids, chunk_size=500):
+        """Fecha as pendências com estes ids; devolve as perguntas que estavam pendentes"""
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        questions = []
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            rows = self._fetchall(f"""
+                SELECT question FROM unknown_questions WHERE id IN ({placeholders}) AND status = 'pending'
+            """, chunk, dictionary=False)
+            questions.extend(row[0] for row in rows)
+            self._execute(f"""
+                UPDATE unknown_questions SET status = 'answered' WHERE id IN ({placeholders}) AND status = 'pending'
+            """, chunk)
+        return questions
+
+    # --- knowledge_base ---
+
+    def kb_entries(self, since=None):
+        """Todas as entradas, ou só as alteradas a partir de `since`"""
+        if since is None:
+            return self._fetchall(f"SELECT {KB_COLUMNS} FROM knowledge_base")
+        return self._fetchall(f"SELECT {KB_COLUMNS} FROM knowledge_base WHERE updated_at >= %s", (since,))
+
+    def kb_entry(self, question):
+        return self._fetchone(f"SELECT {KB_COLUMNS} FROM knowledge_base WHERE question = %s",
+                              (question,), dictionary=True)
+
+    def iter_kb(self, columns=KB_COLUMNS.split(', '), since=None, until=None, batch_size=1000):
+        """Entradas lidas aos poucos de um cursor sem buffer (filtradas por updated_at, se informado)"""
+        where, params = [], []
+        if since is not None:
+            where.append("updated_at >= %s")
+            params.append(since)
+        if until is not None:
+            where.append("updated_at < %s")
+            params.append(until)
+        cursor = self.connection.cursor(dictionary=True, buffered=False)
+        done = False
+        try:
+            cursor.execute(f"""
+                SELECT {", ".join(columns)} FROM knowledge_base
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY id
+            """, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    done = True
+                    break
+                yield from rows
+        finally:
+            # Leitura interrompida: descarta o resto para a conexão poder ser reutilizada
+            if not done:
+                try:
+                    while cursor.fetchmany(batch_size):
+                        pass
+                except Exception:
+                    pass
+            cursor.close()
+
+    def update_kb_keywords(self, rows):
+        """[(keywords, id)] num único executemany; updated_at muda para os workers recarregarem"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.executemany("UPDATE knowledge_base SET keywords = %s, updated_at = NOW() WHERE id = %s", rows)
+        finally:
+            cursor.close()
+
+    def kb_entries_by_questions(self, questions, chunk_size=500):
+        """Entradas existentes para estas perguntas (comparação pela collation do banco)"""
+        questions = list(questions)
+        rows = []
+        for start in range(0, len(questions), chunk_size):
+            chunk = questions[start:start + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            rows.extend(self._fetchall(f"""
+                SELECT {KB_COLUMNS} FROM knowledge_base WHERE question IN ({placeholders})
+            """, chunk))
+        return rows
+
+    def upsert_kb_many(self, rows, chunk_size=500):
+        """[(question, answer, category, keywords)] em executemany por blocos, sem commit"""
+        cursor = self.connection.cursor()
+        try:
+            for start in range(0, len(rows), chunk_size):
+                cursor.executemany("""
+                    INSERT INTO knowledge_base (question, answer, category, keywords, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, NOW(), NOW())
+                    ON DUPLICATE KEY UPDATE answer = VALUES(answer), category = VALUES(category),
+                        keywords = VALUES(keywords), updated_at = NOW()
+                """, rows[start:start + chunk_size])
+        finally:
+            cursor.close()
+
+    def upsert_kb(self, question, answer, category, keywords):
+        self._execute("""
+            INSERT INTO knowledge_base (question, answer, category, keywords, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, NOW(), NOW())
+            ON DUPLICATE KEY UPDATE answer = VALUES(answer), updated_at = NOW()
+        """, (question, answer, category, keywords))
+
+    # --- tarefas em lote ---
+
+    def db_now(self):
+        value = self._fetchone("SELECT NOW()")[0]
+        return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+    def get_watermark(self, job):
+        row = self._fetchone("SELECT watermark FROM job_watermarks WHERE job = %s", (job,))
+        if row is None:
+            return None
+        return datetime.fromisoformat(row[0]) if isinstance(row[0], str) else row[0]
+
+    def set_watermark(self, job, watermark):
+        self._execute("""
+            INSERT INTO job_watermarks (job, watermark, updated_at) VALUES (%s, %s, NOW())
+            ON DUPLICATE KEY UPDATE watermark = VALUES(watermark), updated_at = NOW()
+        """, (job, watermark))
+
+    @abstractmethod
+    def search_kb(self, text, limit=5, min_score=0.0, category=None):
+        """
+        Busca textual em question/answer/keywords, com 'score' (maior = melhor);
+        só entradas acima de `min_score` e, se informada, da `category`
+        """
+
+
+class MySQLRepository(Repository):
+    def search_kb(self, text, limit=5, min_score=0.0, category=None):
+        if not text or not text.strip():
+            return []
+        category_clause = "AND category = %s" if category else ""
+        params = (text, text, min_score) + ((category,) if category else ()) + (limit,)
+        return self._fetchall(f"""
+            SELECT {KB_COLUMNS}, MATCH(question, answer, keywords) AGAINST (%s) AS score
+            FROM knowledge_base
+            WHERE MATCH(question, answer, keywords) AGAINST (%s) > %s {category_clause}
+            ORDER BY score DESC LIMIT %s
+        """, params)
+
+
+FTS_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SQLiteRepository(Repository):
+    def kb_entries_by_questions(self, questions, chunk_size=500):
+        """
+        Sem a collation do MySQL, compara pela question_key (acentos, maiúsculas e
+        espaços não contam); percorre a tabela, o que cabe no backend embutido
+        """
+        keys = list(dict.fromkeys(question_key(q) for q in questions))
+        rows = []
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            rows.extend(self._fetchall(f"""
+                SELECT {KB_COLUMNS} FROM knowledge_base WHERE question_key(question) IN ({placeholders})
+            """, chunk))
+        return rows
+
+    def search_kb(self, text, limit=5, min_score=0.0, category=None):
+        # Termos entre aspas e unidos por OR: o mesmo "modo natural" do MATCH ... AGAINST,
+        # sem que palavras como AND/NOT/NEAR virem operadores do FTS5
+        tokens = FTS_TOKEN_RE.findall((text or '').lower())
+        if not tokens:
+            return []
+        query = ' OR '.join(f'"{token}"' for token in dict.fromkeys(tokens))
+        category_clause = "AND kb.category = %s" if category else ""
+        params = (query,) + ((category,) if category else ()) + (min_score, limit)
+        # bm25() é menor para documentos melhores; pesos iguais aos do índice em memória
+        return self._fetchall(f"""
+            SELECT * FROM (
+                SELECT kb.id, kb.question, kb.answer, kb.category, kb.keywords, kb.updated_at,
+                       -bm25(knowledge_base_fts, 2.0, 1.0, 2.0) AS score
+                FROM knowledge_base_fts
+                JOIN knowledge_base kb ON kb.id = knowledge_base_fts.rowid
+                WHERE knowledge_base_fts MATCH %s {category_clause}
+            ) ranked
+            WHERE score > %s
+            ORDER BY score DESC LIMIT %s
+        """, params)
+
+
+REPOSITORIES = {'mysql': MySQLRepository, 'sqlite': SQLiteRepository}
+
+
+def repository_class(backend):
+    try:
+        return REPOSITORIES[backend]
+    except KeyError:
+        raise ValueError(f"STORAGE_BACKEND desconhecido: {backend!r} (use {' ou '.join(REPOSITORIES)})")
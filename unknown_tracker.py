@@ -0,0 +1,177 @@
+# unknown_tracker.py
+"""
+Rastreamento das perguntas sem resposta sem consultar o banco a cada mensagem.
+
+Cada worker acumula em memória quantas vezes cada pergunta apareceu e descarrega
+periodicamente: a pendência existente ganha as ocorrências (occurrences, last_seen)
+e, se não houver pendência, uma linha nova é inserida já com a contagem. Uma janela
+de deduplicação (TTL) guarda o id da pendência de cada pergunta vista recentemente,
+então as repetições só somam no contador local e a descarga atualiza pela chave
+primária. O dashboard e o /admin/learn leem o top-N por contagem pelo índice
+(status, occurrences, last_seen), sem agregar linhas.
+"""
+
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+from user_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+FLUSH_LOCK = 'ednna_unknown_flush'
+
+
+class _Pending:
+    __slots__ = ('count', 'user_id', 'conversation_id', 'first_seen', 'last_seen')
+
+    def __init__(self, user_id, conversation_id, now):
+        self.count = 0
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.first_seen = now
+        self.last_seen = now
+
+    def merge(self, other):
+        self.count += other.count
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_seen = max(self.last_seen, other.last_seen)
+
+
+class UnknownQuestionTracker:
+    """
+    `connect()` abre uma conexão (ex.: db_pool.acquire) e `repository_for(conn)`
+    devolve o repositório do storage.py usado na descarga.
+    """
+
+    def __init__(self, connect, repository_for, window=3600, max_size=50000, flush_interval=5):
+        self.connect = connect
+        self.repository_for = repository_for
+        self.flush_interval = flush_interval
+        self._known = TTLCache(max_size=max_size, ttl=window)  # pergunta -> id da pendência
+        self._pending = {}  # pergunta -> _Pending
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def seen(self, question):
+        """A pergunta já apareceu dentro da janela (neste worker)?"""
+        with self._lock:
+            if question in self._pending:
+                return True
+        return self._known.get(question) is not None
+
+    def record(self, question, user_id=None, conversation_id=None):
+        """Conta uma ocorrência (usuário e conversa valem para a primeira, se criar a pendência)"""
+        now = datetime.now()
+        with self._lock:
+            entry = self._pending.get(question)
+            if entry is None:
+                entry = self._pending[question] = _Pending(user_id, conversation_id, now)
+            entry.count += 1
+            entry.last_seen = now
+
+    def forget(self, question):
+        """Descarta o que se sabe da pergunta (ex.: depois de respondida no /admin/teach)"""
+        with self._lock:
+            self._pending.pop(question, None)
+        self._known.delete(question)
+
+    def pending_counts(self):
+        with self._lock:
+            return {question: entry.count for question, entry in self._pending.items()}
+
+    # === DESCARGA ===
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        conn = None
+        cursor = None
+        try:
+            conn = self.connect()
+            if conn is None:
+                raise RuntimeError("sem conexão com o banco")
+            cursor = conn.cursor()
+            # Serializa as descargas dos workers para que duas não criem a mesma pendência
+            cursor.execute("SELECT GET_LOCK(%s, 10)", (FLUSH_LOCK,))
+            if not cursor.fetchone()[0]:
+                raise RuntimeError("lock de descarga ocupado")
+            try:
+                self._apply(conn, pending)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (FLUSH_LOCK,))
+                cursor.fetchone()
+            return len(pending)
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            logger.error(f"Erro ao descarregar perguntas desconhecidas ({len(pending)} perguntas): {e}")
+            # Devolve as contagens para a próxima tentativa
+            with self._lock:
+                for question, entry in pending.items():
+                    current = self._pending.get(question)
+                    if current is None:
+                        self._pending[question] = entry
+                    else:
+                        current.merge(entry)
+            return 0
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if conn is not None:
+                conn.close()
+
+    def _apply(self, conn, pending):
+        """Upsert das contagens numa transação; devolve quantas pendências foram criadas"""
+        repo = self.repository_for(conn)
+        ids, created = {}, 0
+        for question, entry in pending.items():
+            known_id = self._known.get(question)
+            unknown_id = repo.bump_unknown(question, entry.count, entry.last_seen, known_id)
+            if unknown_id is None and known_id is not None:
+                # A pendência conhecida foi respondida ou consolidada: procura pela pergunta
+                unknown_id = repo.bump_unknown(question, entry.count, entry.last_seen)
+            if unknown_id is None:
+                unknown_id = repo.insert_unknown(entry.user_id, question, entry.conversation_id,
+                                                 entry.first_seen, entry.count, entry.last_seen)
+                created += 1
+            ids[question] = unknown_id
+        conn.commit()
+        for question, unknown_id in ids.items():
+            self._known.set(question, unknown_id)
+        return created
+
+    # === CONSULTA ===
+
+    def top(self, connection, limit=50):
+        """Pendências mais frequentes, somando as contagens ainda não descarregadas"""
+        rows = self.repository_for(connection).top_unknown(limit)
+        local = self.pending_counts()
+        for row in rows:
+            row['occurrences'] = (row.get('occurrences') or 0) + local.get(row['question'], 0)
+        rows.sort(key=lambda row: row['occurrences'], reverse=True)
+        return rows
+
+    # === THREAD ===
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='unknown-tracker', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(self.flush_interval + 5)
+            self._thread = None
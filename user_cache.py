@@ -0,0 +1,124 @@
+# user_cache.py
+"""
+Cache em memória (TTL + LRU) do estado por usuário:
+existência em `users`, linha de `user_profiles` e id da conversa ativa.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Dicionário limitado com expiração por tempo e despejo LRU"""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # chave -> (valor, expira_em)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class UserStateCache:
+    """Agrupa os três caches por usuário usados no fluxo do /api/chat"""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.users = TTLCache(max_size, ttl)
+        self.profiles = TTLCache(max_size, ttl)
+        self.conversations = TTLCache(max_size, ttl)
+
+    # Existência do usuário
+    def get_user_exists(self, user_id):
+        return self.users.get(user_id)
+
+    def set_user_exists(self, user_id, exists):
+        # Só o "existe" fica em cache: um usuário recém-cadastrado não pode ficar
+        # preso no "não existe" (e cair no usuário padrão) até o TTL vencer
+        if exists:
+            self.users.set(user_id, True)
+        else:
+            self.users.delete(user_id)
+
+    # Perfil
+    def get_profile(self, user_id):
+        profile = self.profiles.get(user_id)
+        return dict(profile) if profile is not None else None
+
+    def set_profile(self, user_id, profile):
+        self.profiles.set(user_id, dict(profile))
+
+    def update_profile(self, user_id, updates):
+        """Write-through: aplica no perfil em cache o que foi gravado no banco"""
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            self.profiles.set(user_id, dict(profile, **updates))
+
+    # Conversa ativa
+    def get_conversation(self, user_id):
+        return self.conversations.get(user_id)
+
+    def set_conversation(self, user_id, conversation_id):
+        self.conversations.set(user_id, conversation_id)
+
+    def invalidate(self, user_id):
+        self.users.delete(user_id)
+        self.profiles.delete(user_id)
+        self.conversations.delete(user_id)
+
+    def stats(self):
+        return {
+            'users': self.users.stats(),
+            'profiles': self.profiles.stats(),
+            'conversations': self.conversations.stats(),
+        }
@@ -0,0 +1,316 @@
+# write_behind.py
+"""
+Fila write-behind para as gravações de log (mensagens, pares de auditoria,
+perguntas desconhecidas e os contadores de conversation_summaries).
+Uma thread em segundo plano grava em lote com executemany, uma transação por lote,
+e despeja os registros em disco quando o MySQL está indisponível.
+
+O arquivo de spill é comum aos workers: escrita e recuperação são serializadas
+entre processos com flock, e cada recuperação renomeia o arquivo para um nome
+próprio (pid) antes de ler. Registros que o banco recusa um a um (dados inválidos,
+chave duplicada) vão para um arquivo de rejeitados em vez de voltar ao spill.
+"""
+
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, date
+
+from mysql.connector import errors as db_errors
+
+logger = logging.getLogger(__name__)
+
+# Tipo de registro -> INSERT usado no executemany
+STATEMENTS = {
+    'message': """
+        INSERT INTO messages (conversation_id, message_text, is_from_user, sent_at)
+        VALUES (%s, %s, %s, %s)
+    """,
+    'audit_pair': """
+        INSERT INTO audit_pairs (conversation_id, question, answer, intent, asked_at, answered_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """,
+    # Manutenção incremental de conversation_summaries
+    'summary_messages': """
+        UPDATE conversation_summaries
+        SET message_count = message_count + %s,
+            last_message_at = GREATEST(COALESCE(last_message_at, %s), %s),
+            last_user_message = COALESCE(%s, last_user_message)
+        WHERE conversation_id = %s
+    """,
+    # unknown_count: +1 por resposta "unknown" (turno), como na carga da migrations/0010
+    'summary_unknown': """
+        UPDATE conversation_summaries SET unknown_count = unknown_count + 1 WHERE conversation_id = %s
+    """,
+}
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return {'__dt__': value.isoformat()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and '__dt__' in value:
+        return datetime.fromisoformat(value['__dt__'])
+    return value
+
+
+# Erros do próprio registro: repetir não adianta
+REJECTED_ERRORS = (db_errors.IntegrityError, db_errors.DataError, db_errors.ProgrammingError,
+                   db_errors.NotSupportedError, KeyError)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriteBehindLogger:
+    """Fila limitada + thread de gravação em lote (group commit)"""
+
+    def __init__(self, connect, max_queue=10000, batch_size=200, flush_interval=0.5,
+                 spill_path='data/write_behind_spill.jsonl', dead_letter_path=None):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.dead_letter_path = dead_letter_path or os.path.splitext(spill_path)[0] + '_rejected.jsonl'
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._spill_lock = threading.Lock()
+        self.stats = {'enqueued': 0, 'written': 0, 'batches': 0, 'spilled': 0, 'replayed': 0, 'errors': 0,
+                      'rejected': 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def enqueue(self, kind, params):
+        """Enfileira um registro; se a fila estiver cheia, grava direto no spill em disco"""
+        record = (kind, tuple(params))
+        try:
+            self._queue.put_nowait(record)
+            self.stats['enqueued'] += 1
+        except queue.Full:
+            logger.warning("Fila write-behind cheia, gravando registro em disco")
+            self._spill([record])
+
+    # === THREAD DE GRAVAÇÃO ===
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        # Drena o que sobrou na fila
+        while True:
+            batch = self._collect(block=False)
+            if not batch:
+                break
+            self._write(batch)
+
+    def _collect(self, block=True):
+        """Junta registros até atingir batch_size ou estourar flush_interval"""
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        conn = None
+        try:
+            conn = self.connect()
+            if conn is None:
+                raise RuntimeError("sem conexão com o banco")
+            self._replay_spill(conn)
+            self._insert(conn, batch)
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Erro ao gravar lote write-behind ({len(batch)} registros): {e}")
+            self._spill(batch)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _insert(self, conn, records):
+        grouped = {}
+        for kind, params in records:
+            grouped.setdefault(kind, []).append(params)
+        cursor = conn.cursor()
+        try:
+            for kind, rows in grouped.items():
+                cursor.executemany(STATEMENTS[kind], rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    # === SPILL EM DISCO ===
+
+    @contextmanager
+    def _spill_locked(self):
+        """Exclusão entre as threads deste worker e entre os workers (flock)"""
+        with self._spill_lock:
+            directory = os.path.dirname(self.spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.spill_path + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _append(path, lines):
+        with open(path, 'a', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _spill(self, records):
+        with self._spill_locked():
+            self._append(self.spill_path, (json.dumps({'kind': kind, 'params': [_encode(v) for v in params]})
+                                           for kind, params in records))
+        self.stats['spilled'] += len(records)
+
+    def _dead_letter(self, item, error):
+        item = dict(item, error=str(error), rejected_at=datetime.now().isoformat(timespec='seconds'))
+        with self._spill_locked():
+            self._append(self.dead_letter_path, [json.dumps(item)])
+        self.stats['rejected'] += 1
+
+    def _reject(self, record, error):
+        kind, params = record
+        self._dead_letter({'kind': kind, 'params': [_encode(v) for v in params]}, error)
+        logger.error(f"Write-behind: registro '{kind}' recusado pelo banco, movido para "
+                     f"{self.dead_letter_path}: {error}")
+
+    def _claim_spill(self):
+        """
+        Renomeia o spill (e recuperações abandonadas por workers que morreram) para
+        arquivos só deste processo; devolve os caminhos a recuperar
+        """
+        claimed = []
+        with self._spill_locked():
+            for path in glob.glob(self.spill_path + '.*.replay'):
+                try:
+                    pid = int(path[len(self.spill_path) + 1:].split('.')[0])
+                except ValueError:
+                    continue
+                if pid != os.getpid() and not _pid_alive(pid):
+                    mine = f"{self.spill_path}.{os.getpid()}.{time.time_ns()}.replay"
+                    os.replace(path, mine)
+                    claimed.append(mine)
+            if os.path.exists(self.spill_path):
+                mine = f"{self.spill_path}.{os.getpid()}.{time.time_ns()}.replay"
+                os.replace(self.spill_path, mine)
+                claimed.append(mine)
+        return claimed
+
+    def _replay_spill(self, conn):
+        """Regrava os registros despejados em disco assim que o banco volta"""
+        for replaying in self._claim_spill():
+            records = []
+            with open(replaying, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        item = json.loads(line)
+                        records.append((item['kind'], tuple(_decode(v) for v in item['params'])))
+                    except (ValueError, KeyError, TypeError) as e:
+                        # Ex.: última linha truncada por uma queda no meio do spill
+                        self._dead_letter({'line': line.rstrip('\n')}, e)
+                        logger.error(f"Write-behind: linha ilegível no spill movida para "
+                                     f"{self.dead_letter_path}: {e}")
+            try:
+                written = self._insert_isolating(conn, records)
+            except Exception:
+                os.remove(replaying)
+                raise
+            os.remove(replaying)
+            self.stats['replayed'] += written
+            logger.info(f"Write-behind: {written} registros recuperados do disco")
+
+    def _insert_isolating(self, conn, records):
+        """
+        Grava em lotes; um lote que falha é refeito registro a registro para separar
+        os recusados (arquivo de rejeitados) de uma falha do banco, que devolve o
+        restante ao spill e propaga o erro. Devolve quantos foram gravados.
+        """
+        written = 0
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            try:
+                self._insert(conn, batch)
+                written += len(batch)
+                continue
+            except REJECTED_ERRORS:
+                pass
+            except Exception:
+                self._spill(records[start:])
+                raise
+            for i, record in enumerate(batch):
+                try:
+                    self._insert(conn, [record])
+                    written += 1
+                except REJECTED_ERRORS as e:
+                    self._reject(record, e)
+                except Exception:
+                    self._spill(batch[i:] + records[start + len(batch):])
+                    raise
+        return written
+
+    def stop(self, timeout=10):
+        """Para a thread drenando a fila (chamado no desligamento do worker)"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Write-behind não drenou a tempo; despejando a fila em disco")
+        # Qualquer resto na fila vai para o disco
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self._spill(leftover)
+        self._thread = None
+
+    def queue_size(self):
+        return self._queue.qsize()